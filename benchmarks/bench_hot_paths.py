@@ -0,0 +1,323 @@
+"""
+热点路径微基准（带回归阈值）
+
+测量每轮对话都会执行的纯Python函数（ensure_json_format、extract_choices_from_text、
+validate_choices、sanitize_text、format_dialogue_history、SessionData.add_message），
+以及SessionManager在1k/10k/100k个会话下的创建、读取和过期清理。解析类函数使用
+benchmarks/data/llm_outputs.jsonl中的真实输出样本，会话消息也取自这些样本。
+
+每项取多轮测量中最快的一轮（微秒/次），并除以紧挨着该项前后测得的一段固定纯Python负载的
+耗时（calibration）进行归一化，使不同机器、不同负载下的结果可以与同一份基线比较。
+归一化后比基线慢超过 --threshold 的项会重新测量（--retries），仍然超出时视为回归，
+以非0状态退出，可以放在CI中。
+
+用法:
+  python benchmarks/bench_hot_paths.py                      # 与基线比较
+  python benchmarks/bench_hot_paths.py --json results.json  # 同时输出机器可读的结果（- 为标准输出）
+  python benchmarks/bench_hot_paths.py --update-baseline    # 改动经过确认后更新基线
+  python benchmarks/bench_hot_paths.py --scales 1000,10000 --only session_manager
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 不读取开发者本地的.env，也避免配置警告混入 --json - 的输出
+os.environ["GAL_SIM_ENV_FILE"] = os.devnull
+os.environ.setdefault("LLM_API_KEY", "bench")
+
+from gal_sim.models.history import HistoryBuffer, Message  # noqa: E402
+from gal_sim.services.session_manager import SessionData, SessionManager  # noqa: E402
+from gal_sim.utils.dialogue_utils import (  # noqa: E402
+    ensure_json_format, extract_choices_from_text, format_dialogue_history, sanitize_text, validate_choices
+)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+CORPUS_PATH = os.path.join(DATA_DIR, "llm_outputs.jsonl")
+BASELINE_PATH = os.path.join(DATA_DIR, "hot_paths_baseline.json")
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+
+
+def load_corpus() -> List[Dict]:
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def message_contents(corpus: List[Dict]) -> List[str]:
+    """从样本中解析出的台词和选项，作为模拟会话的消息内容"""
+    contents = []
+    for case in corpus:
+        result = ensure_json_format(case["text"], case["field"])
+        contents.append(sanitize_text(str(result.get(case["field"]) or "")))
+        contents.extend(choice for choice in validate_choices(result.get("choices")) if choice)
+    return [content for content in contents if content]
+
+
+def best_of(func: Callable[[], object], number: int, rounds: int) -> float:
+    """执行number次为一轮，返回最快一轮中单次调用的耗时（微秒）"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number * 1e6
+
+
+def _calibration_workload():
+    table = {}
+    for i in range(2000):
+        key = "k" + str(i)
+        table[key] = [i, key.upper()]
+    return sum(len(value[1]) for value in table.values())
+
+
+def calibrate() -> float:
+    """固定纯Python负载（字符串拼接、字典和列表操作）的耗时（微秒），用于归一化"""
+    return best_of(_calibration_workload, number=5, rounds=20)
+
+
+class Suite:
+    """
+    收集各项结果；每次测量前后各做一次calibration，取较快的一次作为该项的参照，
+    共享机器上CPU频率和邻居负载的变化因此会同时影响分子和分母；重复测量时每项保留最快的结果
+    """
+    def __init__(self, only: str = None):
+        self.only = only
+        self.results: Dict[str, float] = {}
+        self.normalized: Dict[str, float] = {}
+        self.items: List[Tuple[List[str], Callable[[], Dict[str, float]]]] = []
+
+    def wanted(self, name: str) -> bool:
+        return not self.only or name.startswith(self.only)
+
+    def measure(self, names: List[str], run: Callable[[], Dict[str, float]]):
+        """run返回{名称: 微秒/次}，names中没有需要运行的项时跳过"""
+        if not any(self.wanted(name) for name in names):
+            return
+        self.items.append((names, run))
+        self._run(run)
+
+    def _run(self, run: Callable[[], Dict[str, float]]):
+        before = calibrate()
+        measured = run()
+        reference = min(before, calibrate())
+        for name, value in measured.items():
+            normalized = value / reference
+            if self.wanted(name) and normalized < self.normalized.get(name, float("inf")):
+                self.results[name] = round(value, 4)
+                self.normalized[name] = round(normalized, 6)
+
+    def remeasure(self, names: List[str]):
+        """重新测量包含这些名称的项"""
+        for item_names, run in self.items:
+            if set(item_names) & set(names):
+                self._run(run)
+
+
+def _over_corpus(func: Callable, items: List) -> Callable[[], None]:
+    def run():
+        for item in items:
+            func(item)
+    return run
+
+
+def bench_functions(suite: Suite, corpus: List[Dict], contents: List[str], rounds: int):
+    """逐轮执行的工具函数，解析类函数的结果为整个样本集上每个样本的平均耗时"""
+    n = len(corpus)
+    cases = [(case["text"], case["field"]) for case in corpus]
+    texts = [text for text, _ in cases]
+    parsed = [ensure_json_format(text, field) for text, field in cases]
+    raw_choices = [result.get("choices") for result in parsed]
+    raw_texts = [str(result.get(field) or "") for result, (_, field) in zip(parsed, cases)]
+
+    now = time.time()
+    messages = [Message("user" if i % 2 else "character", contents[i % len(contents)], now + i) for i in range(50)]
+    buffer = HistoryBuffer(50, messages)
+    format_dialogue_history(buffer)
+
+    # 历史已写满时的追加（稳态：覆盖最旧的消息并更新内存估算）
+    session_data = SessionData(session_id="bench", theme="海边小镇的夏天")
+    session_data.on_resize = lambda session, delta: None
+    for i in range(session_data.max_history_length):
+        session_data.add_message("user" if i % 2 else "character", contents[i % len(contents)])
+    counter = iter(range(10 ** 9))
+
+    items = {
+        "ensure_json_format": lambda: best_of(
+            lambda: [ensure_json_format(text, field) for text, field in cases], 50, rounds) / n,
+        "extract_choices_from_text": lambda: best_of(_over_corpus(extract_choices_from_text, texts), 50, rounds) / n,
+        "validate_choices": lambda: best_of(_over_corpus(validate_choices, raw_choices), 500, rounds) / n,
+        "sanitize_text": lambda: best_of(_over_corpus(sanitize_text, raw_texts), 500, rounds) / n,
+        "format_dialogue_history[buffer]": lambda: best_of(lambda: format_dialogue_history(buffer), 20000, rounds),
+        "format_dialogue_history[list]": lambda: best_of(lambda: format_dialogue_history(messages), 5000, rounds),
+        "SessionData.add_message": lambda: best_of(
+            lambda: session_data.add_message("character", contents[next(counter) % len(contents)]), 5000, rounds),
+    }
+    for name, run in items.items():
+        suite.measure([name], lambda run=run, name=name: {name: run()})
+
+
+async def _fill(manager: SessionManager, ids: List[str]) -> float:
+    """创建会话，返回每个会话的耗时（秒）"""
+    start = time.perf_counter()
+    for session_id in ids:
+        await manager.create_session(session_id, "海边小镇的夏天")
+    return (time.perf_counter() - start) / len(ids)
+
+
+async def _bench_manager(scale: int, rounds: int) -> Dict[str, float]:
+    rng = random.Random(scale)
+    ids = [f"{i:08x}-{rng.getrandbits(32):08x}" for i in range(scale)]
+    lookups = [rng.choice(ids) for _ in range(min(scale, 10000))]
+    label = _label(scale)
+    create, get, cleanup = [], [], []
+    for _ in range(rounds):
+        # 不设内存上限，避免淘汰混入测得的耗时
+        manager = SessionManager(session_timeout=3600, memory_budget=0, max_sessions=0)
+        create.append(await _fill(manager, ids))
+        # 读取耗时短，每轮内多测几遍
+        for _ in range(3):
+            start = time.perf_counter()
+            for session_id in lookups:
+                await manager.get_session(session_id)
+            get.append((time.perf_counter() - start) / len(lookups))
+        del manager
+
+        # session_timeout为负时所有会话在清理时都已过期
+        manager = SessionManager(session_timeout=-1, memory_budget=0, max_sessions=0)
+        await _fill(manager, ids)
+        start = time.perf_counter()
+        removed = await manager.cleanup_expired_sessions()
+        cleanup.append((time.perf_counter() - start) / scale)
+        assert removed == scale and not manager.sessions, (removed, len(manager.sessions))
+        del manager
+    return {
+        f"session_manager.create[{label}]": min(create) * 1e6,
+        f"session_manager.get[{label}]": min(get) * 1e6,
+        f"session_manager.cleanup[{label}]": min(cleanup) * 1e6,
+    }
+
+
+def _label(scale: int) -> str:
+    return f"{scale // 1000}k" if scale % 1000 == 0 else str(scale)
+
+
+def bench_session_manager(suite: Suite, scales: List[int], rounds: int):
+    for scale in scales:
+        label = _label(scale)
+        names = [f"session_manager.{operation}[{label}]" for operation in ("create", "get", "cleanup")]
+        # 大规模时每轮耗时较长，减少轮数
+        scale_rounds = max(2, rounds // (1 + scale // 50000))
+        suite.measure(names, lambda scale=scale, scale_rounds=scale_rounds: asyncio.run(
+            _bench_manager(scale, scale_rounds)))
+
+
+def compare(suite: Suite, baseline: Dict, threshold: float, out=None) -> Dict[str, float]:
+    """按归一化耗时与基线比较，返回{回归项: 相对基线的倍数}；out不为空时输出对比表"""
+    regressions = {}
+    verbose = out is not None
+    if verbose:
+        print(f"\n{'benchmark':<36}{'us/op':>10}{'baseline':>10}{'ratio':>8}", file=out)
+    for name, value in suite.results.items():
+        base = baseline["normalized"].get(name)
+        if base is None:
+            if verbose:
+                print(f"{name:<36}{value:>10.2f}{'-':>10}{'new':>8}", file=out)
+            continue
+        ratio = suite.normalized[name] / base
+        flag = "  REGRESSION" if ratio > 1 + threshold else ""
+        if verbose:
+            print(f"{name:<36}{value:>10.2f}{baseline['results'][name]:>10.2f}{ratio:>8.2f}{flag}", file=out)
+        if flag:
+            regressions[name] = ratio
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="SessionManager基准的会话数，逗号分隔")
+    parser.add_argument("--rounds", type=int, default=5, help="每项测量的轮数，取最快的一轮")
+    parser.add_argument("--only", help="只运行名称以此开头的项")
+    parser.add_argument("--json", help="把结果写入该JSON文件（- 为标准输出）")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.3, help="允许的变慢比例，默认0.3即30%%")
+    parser.add_argument("--retries", type=int, default=2, help="超出阈值的项最多重新测量几次")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线中对应的项")
+    args = parser.parse_args()
+    scales = [int(scale) for scale in args.scales.split(",") if scale]
+
+    corpus = load_corpus()
+    suite = Suite(args.only)
+    bench_functions(suite, corpus, message_contents(corpus), args.rounds)
+    bench_session_manager(suite, scales, args.rounds)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = {}
+    if args.update_baseline:
+        # 基线取两次测量中较快的结果
+        suite.remeasure(list(suite.results))
+    elif baseline is not None:
+        # 偶发的干扰只影响一次测量，真正的回归在重新测量后仍然存在
+        regressions = compare(suite, baseline, args.threshold)
+        for _ in range(args.retries):
+            if not regressions:
+                break
+            suite.remeasure(list(regressions))
+            regressions = compare(suite, baseline, args.threshold)
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": suite.results,
+        "normalized": suite.normalized,
+        "regressions": {name: round(ratio, 3) for name, ratio in regressions.items()},
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        # 只运行了部分项时保留基线中的其余项
+        previous = baseline or {"results": {}, "normalized": {}}
+        updated = {
+            "python": report["python"],
+            "results": {**previous["results"], **report["results"]},
+            "normalized": {**previous["normalized"], **report["normalized"]},
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(updated, f, indent=2)
+            f.write("\n")
+        print(f"基线已更新: {args.baseline}", file=sys.stderr)
+        return
+
+    if baseline is None:
+        print(f"没有基线文件 {args.baseline}，使用 --update-baseline 生成", file=sys.stderr)
+        return
+    # 以JSON输出到标准输出时，对比表输出到标准错误
+    out = sys.stderr if args.json == "-" else sys.stdout
+    compare(suite, baseline, args.threshold, out)
+    if regressions:
+        print(f"\n{len(regressions)}项比基线慢{args.threshold:.0%}以上:", file=out)
+        for name, ratio in regressions.items():
+            print(f"  {name}: 归一化后为基线的{ratio:.2f}倍", file=out)
+        sys.exit(1)
+    print("\n没有超出阈值的回归", file=out)
+
+if __name__ == "__main__":
+    main()
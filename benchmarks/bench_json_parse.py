@@ -0,0 +1,144 @@
+"""
+LLM输出解析基准
+
+在benchmarks/data/llm_outputs.jsonl中的样本（合法JSON、代码块、前后说明文字、结尾逗号、
+截断输出、A/B/C/D列表等）上，对比旧的解析流程（json.loads -> 贪婪正则 -> 多个未预编译的正则
+和逐行扫描）与当前的单遍解析器，输出每个样本的单次解析耗时以及是否正确恢复了文本和选项
+
+用法: python benchmarks/bench_json_parse.py [--repeat 2000] [--stdlib-json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gal_sim.utils.dialogue_utils import ensure_json_format, sanitize_text, validate_choices  # noqa: E402
+from gal_sim.utils import llm_json  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "llm_outputs.jsonl")
+
+
+def legacy_extract_choices_from_text(text: str) -> List[str]:
+    """旧版extract_choices_from_text"""
+    patterns = [
+        r'[A-D]\.\s*(.*?)(?=\n[A-D]\.|$)',
+        r'选项[A-D]：(.*?)(?=选项[A-D]|$)',
+        r'选项[A-D]\s*[:：]\s*(.*?)(?=选项[A-D]|$)',
+    ]
+    for pattern in patterns:
+        matches = re.findall(pattern, text, re.MULTILINE | re.DOTALL)
+        if len(matches) >= 4:
+            choices = [match.strip() for match in matches[:4]]
+            if all(choices):
+                return choices
+    choices = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if line.startswith(('A.', 'B.', 'C.', 'D.', 'A：', 'B：', 'C：', 'D：', 'A:', 'B:', 'C:', 'D:')):
+            content = line[2:].strip()
+            if content:
+                choices.append(content)
+    if len(choices) >= 4:
+        return choices[:4]
+    return ["", "", "", ""]
+
+
+def legacy_ensure_json_format(response: str) -> Dict[str, Any]:
+    """旧版ensure_json_format"""
+    try:
+        return json.loads(response)
+    except Exception:
+        pass
+    json_match = re.search(r'\{.*\}', response, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group())
+        except Exception:
+            pass
+    result = {"response": response, "choices": ["", "", "", ""]}
+    choices = legacy_extract_choices_from_text(response)
+    if choices and any(choices):
+        result["choices"] = choices
+    non_choice_lines = []
+    for line in response.split('\n'):
+        if not (line.strip().startswith(('A.', 'B.', 'C.', 'D.', 'A：', 'B：', 'C：', 'D：', 'A:', 'B:', 'C:', 'D:'))):
+            non_choice_lines.append(line)
+    result["response"] = "\n".join(non_choice_lines).strip()
+    return result
+
+
+def legacy_parse(text: str, field: str) -> Dict[str, Any]:
+    """旧版LLMService中解析一次回复的完整流程"""
+    result = legacy_ensure_json_format(text)
+    try:
+        body = re.sub(r'\s+', ' ', re.sub(r'\n+', '\n', result.get(field, ""))).strip()
+        choices = list(result.get("choices", ["", "", "", ""]))
+        choices = (choices + [""] * 4)[:4]
+        choices = [re.sub(r'\s+', ' ', str(c if c is not None else "").strip()) for c in choices]
+    except Exception:
+        # 旧流程在choices不是列表等情况下直接抛出异常
+        return {field: "", "choices": ["", "", "", ""], "error": True}
+    return {field: body, "choices": choices}
+
+
+def current_parse(text: str, field: str) -> Dict[str, Any]:
+    """当前LLMService._parse_dialogue的流程"""
+    result = ensure_json_format(text, field)
+    return {
+        field: sanitize_text(str(result.get(field) or "")),
+        "choices": validate_choices(result.get("choices", ["", "", "", ""]))
+    }
+
+
+def time_per_call(parse, text: str, field: str, repeat: int) -> float:
+    """单次解析的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(text, field)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--stdlib-json", action="store_true", help="即使安装了orjson也使用标准库json")
+    args = parser.parse_args()
+    if args.stdlib_json:
+        llm_json.orjson = None
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    print(f"{len(corpus)} samples, {args.repeat} calls each, json backend: {'orjson' if llm_json.orjson else 'json'}")
+    print(f"{'sample':<24} {'legacy us':>10} {'current us':>10} {'legacy ok':>9} {'current ok':>10}")
+    totals = {"legacy": 0.0, "current": 0.0}
+    recovered = {"legacy": 0, "current": 0}
+    for case in corpus:
+        text, field, expected = case["text"], case["field"], case["expected_choices"]
+        row = {}
+        for name, parse in (("legacy", legacy_parse), ("current", current_parse)):
+            result = parse(text, field)
+            found = sum(1 for choice in result["choices"] if choice)
+            # 文本字段不能为空，也不能是原样返回的JSON
+            body = result[field]
+            ok = (found >= expected and bool(body) and not body.startswith("{") and '"choices"' not in body
+                  and not result.get("error"))
+            recovered[name] += ok
+            elapsed = time_per_call(parse, text, field, args.repeat)
+            totals[name] += elapsed
+            row[name] = (elapsed, ok)
+        print(f"{case['name']:<24} {row['legacy'][0]:10.1f} {row['current'][0]:10.1f} "
+              f"{str(row['legacy'][1]):>9} {str(row['current'][1]):>10}")
+
+    n = len(corpus)
+    print(f"{'mean':<24} {totals['legacy'] / n:10.1f} {totals['current'] / n:10.1f} "
+          f"{recovered['legacy']:>6}/{n} {recovered['current']:>7}/{n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+按请求类型选择模型的基准（LLM_PROFILES / LLM_FAST_MODEL）
+
+在进程内启动模拟LLM服务器，主模型（strong）和快速模型（fast）的首token延迟分别由
+--strong-ttft / --fast-ttft 指定：
+1. 自动主题开始对话（生成主题+开场白）时，所有请求都用主模型与主题改用快速模型的耗时对比
+2. 主模型在运行中变慢、超出延迟目标后，回应请求切换到快速模型，恢复后切回；
+   输出每个阶段的平均耗时和各模型处理的请求数
+
+用法: python benchmarks/bench_model_profiles.py [--sessions 20] [--strong-ttft 0.8] [--fast-ttft 0.1]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_test  # noqa: E402
+import mock_llm_server  # noqa: E402
+
+STRONG, FAST = "strong", "fast"
+
+
+def _service(profiles_json: str, fast_model: str = ""):
+    from gal_sim.services.llm_profiles import parse_profiles
+    from gal_sim.services.llm_service import LLMService
+    return LLMService(max_concurrency=64, profiles=parse_profiles(profiles_json, fast_model))
+
+
+async def bench_start(args: argparse.Namespace):
+    """自动主题开始对话：主题和开场白依次生成"""
+    print(f"{'配置':<24}{'开始对话ms':>12}{'主题ms':>10}")
+    for label, fast_model in (("全部使用主模型", ""), ("主题使用快速模型", FAST)):
+        service = _service(json.dumps({"initial": {"model": STRONG}, "theme": {"model": fast_model or STRONG}}))
+        theme_elapsed, total_elapsed = [], []
+
+        async def start_one():
+            start = time.perf_counter()
+            theme = await service.generate_theme()
+            theme_elapsed.append(time.perf_counter() - start)
+            await service.generate_initial_dialogue(theme)
+            total_elapsed.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(start_one() for _ in range(args.sessions)))
+        print(f"{label:<24}{sum(total_elapsed) / len(total_elapsed) * 1000:>12.0f}"
+              f"{sum(theme_elapsed) / len(theme_elapsed) * 1000:>10.0f}")
+
+
+async def bench_fallback(args: argparse.Namespace, settings: mock_llm_server.MockSettings):
+    """主模型变慢后切换到快速模型，恢复后切回"""
+    from gal_sim.models.history import Message
+    slo = args.strong_ttft * 2
+    service = _service(json.dumps({
+        "response": {"model": STRONG, "fallback_model": FAST, "latency_slo": slo, "cooldown": args.cooldown}
+    }))
+    profile = service.profiles["response"]
+    history = [Message("character", "“你终于来了！”", time.time())]
+    print(f"\n回应请求的延迟目标为{slo:.1f}秒，冷却时间{args.cooldown}秒")
+    print(f"{'阶段':<16}{'平均耗时ms':>12}{'strong':>8}{'fast':>8}")
+    phases = (("正常", args.strong_ttft), ("主模型变慢", args.strong_ttft * 5), ("主模型恢复", args.strong_ttft))
+    for label, strong_ttft in phases:
+        settings.model_ttft[STRONG] = strong_ttft
+        before = {name: stats.requests for name, stats in profile.models.items()}
+        elapsed = []
+        deadline = time.monotonic() + args.phase_seconds
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                service.generate_response("海边小镇的夏天", history, "问她在看什么书") for _ in range(4)
+            ))
+            elapsed.append(time.perf_counter() - start)
+        counts = {name: stats.requests - before.get(name, 0) for name, stats in profile.models.items()}
+        print(f"{label:<16}{sum(elapsed) / len(elapsed) * 1000:>12.0f}"
+              f"{counts.get(STRONG, 0):>8}{counts.get(FAST, 0):>8}")
+    print(f"切换到备用模型的次数: {profile.fallbacks}")
+
+
+async def bench(args: argparse.Namespace):
+    settings = mock_llm_server.MockSettings(
+        ttft=args.strong_ttft, tokens_per_second=args.tps,
+        model_ttft={STRONG: args.strong_ttft, FAST: args.fast_ttft},
+    )
+    task, server, port = await load_test._serve_mock(settings)
+    os.environ.update(LLM_BASE_URL=f"http://127.0.0.1:{port}/v1", LLM_API_KEY="mock", LLM_MODEL=STRONG,
+                      LLM_ENDPOINTS="", LLM_CACHE_ENABLED="false", GAL_SIM_ENV_FILE=os.devnull)
+    try:
+        await bench_start(args)
+        await bench_fallback(args, settings)
+    finally:
+        server.should_exit = True
+        await task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--strong-ttft", type=float, default=0.8, help="主模型的首token延迟（秒）")
+    parser.add_argument("--fast-ttft", type=float, default=0.1, help="快速模型的首token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=500, help="模拟LLM的生成速度（token/秒）")
+    parser.add_argument("--cooldown", type=float, default=3.0, help="切换到备用模型后多久重新尝试主模型（秒）")
+    parser.add_argument("--phase-seconds", type=float, default=8.0, help="每个阶段的持续时间（秒）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+LLM协议基准：原有协议与精简协议（LLM_COMPACT_PROTOCOL）的对比
+
+在进程内启动模拟LLM服务器，分别以两种协议跑相同数量的对话（开场白+若干轮回应），
+统计每轮的输入/输出token（取模拟服务器返回的用量）、每轮耗时和自适应max_tokens的取值。
+模拟服务器按输出token数决定耗时，输出越短返回越快
+
+用法: python benchmarks/bench_protocol.py [--sessions 20] [--turns 6] [--tps 200]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_test  # noqa: E402
+import mock_llm_server  # noqa: E402
+
+
+def _token_totals(counter, operations=("initial", "response")):
+    """按(operation, model, type)累计的token数中，指定请求类型的输入和输出总数"""
+    totals = {"prompt": 0, "completion": 0}
+    for (operation, _, kind), value in counter.values.items():
+        if operation in operations:
+            totals[kind] += value
+    return totals["prompt"], totals["completion"]
+
+
+async def run_protocol(compact: bool, args: argparse.Namespace):
+    from gal_sim.models.history import Message
+    from gal_sim.services.llm_service import LLMService
+    from gal_sim.services.metrics import LLM_TOKENS
+
+    service = LLMService(max_concurrency=args.sessions, compact=compact)
+    before = _token_totals(LLM_TOKENS)
+    turns = 0
+    elapsed = 0.0
+
+    async def play(seed: int):
+        nonlocal turns, elapsed
+        history = []
+        start = time.perf_counter()
+        result = await service.generate_initial_dialogue(f"海边小镇的夏天·{seed}")
+        elapsed += time.perf_counter() - start
+        turns += 1
+        history.append(Message("character", result["dialogue"], time.time()))
+        for turn in range(args.turns):
+            choice = result["choices"][turn % 4]
+            history.append(Message("user", choice, time.time()))
+            start = time.perf_counter()
+            result = await service.generate_response("海边小镇的夏天", history, choice)
+            elapsed += time.perf_counter() - start
+            turns += 1
+            history.append(Message("character", result["response"], time.time()))
+
+    await asyncio.gather(*(play(i) for i in range(args.sessions)))
+    after = _token_totals(LLM_TOKENS)
+    return {
+        "prompt": (after[0] - before[0]) / turns,
+        "completion": (after[1] - before[1]) / turns,
+        "latency": elapsed / turns,
+        "stats": service.protocol_stats(),
+    }
+
+
+async def bench(args: argparse.Namespace):
+    task, server, port = await load_test._serve_mock(
+        mock_llm_server.MockSettings(ttft=args.ttft, tokens_per_second=args.tps)
+    )
+    os.environ.update(LLM_BASE_URL=f"http://127.0.0.1:{port}/v1", LLM_API_KEY="mock", LLM_MODEL="mock-model",
+                      LLM_ENDPOINTS="", LLM_CACHE_ENABLED="false", GAL_SIM_ENV_FILE=os.devnull)
+    try:
+        results = {}
+        for compact in (False, True):
+            results[compact] = await run_protocol(compact, args)
+    finally:
+        server.should_exit = True
+        await task
+
+    print(f"{'协议':<8}{'输入token/轮':>14}{'输出token/轮':>14}{'耗时ms/轮':>12}{'max_tokens(开场/回应)':>24}")
+    for compact, result in results.items():
+        budgets = result["stats"]["max_tokens"]
+        print(f"{'精简' if compact else '原有':<8}{result['prompt']:>14.0f}{result['completion']:>14.0f}"
+              f"{result['latency'] * 1000:>12.0f}"
+              f"{budgets['initial']['max_tokens']:>12}/{budgets['response']['max_tokens']:<11}")
+    legacy, compact = results[False], results[True]
+    print(f"\n实测每轮节省: 输入{legacy['prompt'] - compact['prompt']:.0f} token，"
+          f"输出{legacy['completion'] - compact['completion']:.0f} token，"
+          f"耗时{(legacy['latency'] - compact['latency']) * 1000:.0f} ms")
+    stats = compact["stats"]
+    print(f"精简协议自行估算的每轮节省: 输入{stats['input_tokens_saved_per_turn']} token，"
+          f"输出{stats['output_tokens_saved_per_turn']} token")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=6, help="每个会话在开场白之后的回应轮数")
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--tps", type=float, default=200, help="模拟LLM的生成速度（token/秒）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+会话历史内存占用与开销基准
+
+对比旧的表示方式（每条消息一个dict + ISO时间字符串，超长后每次追加都切片重建列表，
+每轮重新切片拼接上下文）与当前的环形缓冲区表示
+
+用法: python benchmarks/bench_session_memory.py [--sessions 5000] [--messages 60]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gal_sim.models.history import HistoryBuffer, Message  # noqa: E402
+from gal_sim.utils.dialogue_utils import format_dialogue_history  # noqa: E402
+
+MAX_HISTORY_LENGTH = 50
+
+
+class LegacyHistory:
+    """旧版SessionData.history的行为"""
+    __slots__ = ("history",)
+
+    def __init__(self):
+        self.history = []
+
+    def add_message(self, role: str, content: str):
+        self.history.append({
+            "role": role,
+            "content": content,
+            "timestamp": datetime.now().isoformat()
+        })
+        if len(self.history) > MAX_HISTORY_LENGTH:
+            self.history = self.history[-MAX_HISTORY_LENGTH:]
+
+    def context(self) -> str:
+        recent_history = self.history[-10:] if len(self.history) > 10 else self.history
+        formatted_history = []
+        for entry in recent_history:
+            role = "用户" if entry["role"] == "user" else "角色"
+            formatted_history.append(f"{role}: {entry['content']}")
+        return "\n".join(formatted_history)
+
+
+class CompactHistory:
+    """当前的环形缓冲区表示"""
+    __slots__ = ("history",)
+
+    def __init__(self):
+        self.history = HistoryBuffer(MAX_HISTORY_LENGTH)
+
+    def add_message(self, role: str, content: str):
+        self.history.append(Message(role, content, time.time()))
+
+    def context(self) -> str:
+        return format_dialogue_history(self.history)
+
+
+# 所有会话共用同一组消息文本，使测得的差异只来自历史结构本身
+CONTENTS = [f"这是第{i}条对话内容，用于模拟角色和用户之间的一轮交流。" for i in range(64)]
+
+
+def measure_memory(history_cls, sessions: int, messages: int) -> float:
+    """每个会话的平均内存占用（字节）"""
+    tracemalloc.start()
+    histories = []
+    for _ in range(sessions):
+        h = history_cls()
+        for i in range(messages):
+            h.add_message("user" if i % 2 else "character", CONTENTS[i % len(CONTENTS)])
+            h.context()
+        histories.append(h)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / sessions
+
+
+def measure_time(history_cls, sessions: int, messages: int):
+    """每轮add_message和构建上下文的平均耗时（纳秒）"""
+    append_time = 0.0
+    context_time = 0.0
+    for _ in range(sessions):
+        h = history_cls()
+        for i in range(messages):
+            t0 = time.perf_counter()
+            h.add_message("user" if i % 2 else "character", CONTENTS[i % len(CONTENTS)])
+            t1 = time.perf_counter()
+            h.context()
+            context_time += time.perf_counter() - t1
+            append_time += t1 - t0
+    ops = sessions * messages
+    return append_time / ops * 1e9, context_time / ops * 1e9
+
+
+def play(history_cls, sessions: int, messages: int):
+    append_ns, context_ns = measure_time(history_cls, sessions, messages)
+    return {
+        "bytes_per_session": measure_memory(history_cls, sessions, messages),
+        "append_ns": append_ns,
+        "context_ns": context_ns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=60)
+    args = parser.parse_args()
+
+    print(f"{args.sessions} sessions x {args.messages} messages (max_history_length={MAX_HISTORY_LENGTH})")
+    results = {}
+    for name, cls in (("legacy", LegacyHistory), ("compact", CompactHistory)):
+        results[name] = play(cls, args.sessions, args.messages)
+        r = results[name]
+        print(f"{name:>8}: {r['bytes_per_session']:10.0f} B/session  "
+              f"add_message {r['append_ns']:8.0f} ns  context {r['context_ns']:8.0f} ns")
+    legacy, compact = results["legacy"], results["compact"]
+    print(f"memory per session: {compact['bytes_per_session'] / legacy['bytes_per_session']:.2f}x of legacy")
+
+
+if __name__ == "__main__":
+    main()
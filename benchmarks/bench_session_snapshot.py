@@ -0,0 +1,105 @@
+"""
+会话快照与存档基准
+
+生成一批模拟会话，对每种压缩方式测量全量快照的写入/恢复吞吐和每个会话占用的字节数，
+并与逐会话JSON序列化的大小对比
+
+用法: python benchmarks/bench_session_snapshot.py [--sessions 100000] [--messages 12] [--codec all]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gal_sim.services.session_manager import SessionData, SessionManager  # noqa: E402
+from gal_sim.services.session_snapshot import (  # noqa: E402
+    CODEC_NAMES, dump_save, load_save, zstd_available
+)
+
+FRAGMENTS = [
+    "今天的风有点大", "你来得正好", "我一直在等你", "要不要一起去海边", "那家店的蛋糕很好吃",
+    "……其实我有话想说", "别误会了", "下次再一起来吧", "图书馆今天人很少", "放学后在天台见",
+    "我才没有在意呢", "谢谢你陪我", "这首歌我很喜欢", "夏天快要结束了", "你还记得那天吗",
+    "要下雨了", "我们走吧", "嗯", "真的吗？", "好开心",
+]
+
+
+def _line(rng: random.Random) -> str:
+    return "，".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(2, 6))) + "。"
+
+
+def make_sessions(manager: SessionManager, count: int, messages: int, seed: int = 0):
+    rng = random.Random(seed)
+    now = time.time()
+    for i in range(count):
+        session_data = SessionData(session_id=f"{i:08x}-bench", theme=f"主题{rng.randint(0, 999)}")
+        for j in range(messages):
+            role = "user" if j % 2 else "character"
+            session_data.add_message(role, _line(rng))
+        session_data.offered_choices = [(_line(rng), delta) for delta in (2, 1, 0, -1)]
+        session_data.affection = rng.randint(0, 100)
+        session_data.last_accessed = datetime.fromtimestamp(now)
+        manager._cache(session_data)
+
+
+def json_bytes(session_data) -> int:
+    return len(json.dumps({
+        "session_id": session_data.session_id,
+        "theme": session_data.theme,
+        "affection": session_data.affection,
+        "created_at": session_data.created_at.isoformat(),
+        "last_accessed": session_data.last_accessed.isoformat(),
+        "summary": session_data.summary,
+        "offered_choices": session_data.offered_choices,
+        "history": [message.to_dict() for message in session_data.history],
+    }, ensure_ascii=False).encode("utf-8"))
+
+
+async def bench(args: argparse.Namespace):
+    codecs = [name for name in CODEC_NAMES if name != "zstd" or zstd_available()]
+    if args.codec != "all":
+        codecs = [args.codec]
+    source = SessionManager(memory_budget=0, max_sessions=0)
+    start = time.perf_counter()
+    make_sessions(source, args.sessions, args.messages)
+    print(f"生成{args.sessions}个会话（每个{args.messages}条消息）用时{time.perf_counter() - start:.1f}秒")
+    sample = list(source.sessions.values())[:1000]
+    print(f"JSON（未压缩）: 平均每个会话{sum(map(json_bytes, sample)) / len(sample):.0f}字节")
+    print()
+    print(f"{'压缩':<6}{'每会话字节':>10}{'单个存档':>10}{'快照(会话/秒)':>16}{'恢复(会话/秒)':>16}{'文件(MB)':>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in codecs:
+            codec = CODEC_NAMES[name]
+            path = os.path.join(directory, f"sessions.{name}.snap")
+            result = await source.snapshot(path, codec)
+            target = SessionManager(memory_budget=0, max_sessions=0)
+            restored = await target.restore(path)
+            assert restored["restored"] == args.sessions, restored
+            save_size = sum(len(dump_save(s, codec)) for s in sample) / len(sample)
+            record = load_save(dump_save(sample[0], codec))[1]
+            assert [m.content for m in record["history"]] == [m.content for m in sample[0].history]
+            print(f"{name:<6}{result['bytes'] / args.sessions:>10.0f}{save_size:>10.0f}"
+                  f"{args.sessions / result['elapsed']:>16,.0f}{args.sessions / restored['elapsed']:>16,.0f}"
+                  f"{result['bytes'] / 1e6:>10.1f}")
+            del target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=12, help="每个会话的消息数")
+    parser.add_argument("--codec", default="all", choices=["all", *CODEC_NAMES])
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+启动耗时基准
+
+在全新的Python进程中测量：
+- import: 导入gal_sim.main的耗时
+- ready: 启动uvicorn到 /healthz 返回200的耗时（Electron在此之后才加载页面）
+并用 -X importtime 列出导入耗时最多的顶层模块。超过 --import-budget-ms / --ready-budget-ms
+时以非0状态退出，可以放在CI中防止启动变慢
+
+用法: python benchmarks/bench_startup.py [--runs 5] [--import-budget-ms 1000] [--ready-budget-ms 2000]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import gal_sim.main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("LLM_API_KEY", "bench")
+    # 不读取开发者本地的.env，结果只取决于代码本身
+    env["GAL_SIM_ENV_FILE"] = os.devnull
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def measure_import() -> float:
+    """在新进程中导入gal_sim.main的耗时（秒）"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, env=_env(),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_ready(timeout: float = 30.0) -> float:
+    """启动uvicorn进程到 /healthz 返回200的耗时（秒）"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/healthz"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "gal_sim.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with code {process.returncode}: {process.stderr.read().decode()}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"server not ready after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def heaviest_imports(limit: int) -> List[Tuple[str, int]]:
+    """-X importtime输出中累计耗时最多的顶层包（微秒）"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import gal_sim.main"], cwd=ROOT, env=_env(),
+        capture_output=True, text=True, check=True
+    ).stderr
+    totals: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        package = name.strip().split(".")[0]
+        # 同一个包取最外层（累计耗时最大）的那一条
+        totals[package] = max(totals.get(package, 0), int(cumulative))
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=1000)
+    parser.add_argument("--ready-budget-ms", type=float, default=2000)
+    parser.add_argument("--top", type=int, default=10, help="列出导入耗时最多的前N个包")
+    args = parser.parse_args()
+
+    measure_import()  # 预热，让字节码缓存和磁盘缓存就绪
+    imports = [measure_import() for _ in range(args.runs)]
+    readies = [measure_ready() for _ in range(args.runs)]
+
+    print(f"{args.runs} runs, python {sys.version.split()[0]}")
+    print(f"{'phase':<8} {'median ms':>10} {'min ms':>8} {'max ms':>8} {'budget ms':>10}")
+    failed = False
+    for name, values, budget in (("import", imports, args.import_budget_ms),
+                                 ("ready", readies, args.ready_budget_ms)):
+        median = statistics.median(values) * 1000
+        failed |= median > budget
+        print(f"{name:<8} {median:10.0f} {min(values) * 1000:8.0f} {max(values) * 1000:8.0f} {budget:10.0f}"
+              f"{'  OVER BUDGET' if median > budget else ''}")
+
+    print("\nheaviest imports (cumulative ms):")
+    for package, micros in heaviest_imports(args.top):
+        print(f"  {package:<24} {micros / 1000:8.1f}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
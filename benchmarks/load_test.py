@@ -0,0 +1,234 @@
+"""
+端到端压力测试
+
+模拟玩家的完整流程：/start 开始对话，再连续选择N次 /dialogue，统计每个接口的吞吐量、
+p50/p95/p99延迟和错误数
+
+默认在进程内启动模拟LLM服务器（benchmarks/mock_llm_server.py），并通过ASGI直接调用
+gal_sim.main:app，不需要网络；指定 --url 时改为压测已经运行的GAL-SIM实例。
+进程内的ASGI调用会等整个响应生成完才返回，流式接口的首字节时间（ttfb）只在 --url 模式下有意义
+
+用法: python benchmarks/load_test.py [--players 50] [--journeys 200] [--turns 5] [--stream]
+                                    [--ttft 0.3] [--tps 50] [--error-rate 0.01] [--malformed-rate 0.05]
+                                    [--url http://127.0.0.1:8000]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+import mock_llm_server  # noqa: E402
+
+
+class Recorder:
+    """按接口记录每次请求的延迟和结果"""
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_byte: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.journeys = 0
+        self.failed_journeys = 0
+
+    def ok(self, name: str, latency: float, first_byte: Optional[float] = None):
+        self.latencies[name].append(latency)
+        if first_byte is not None:
+            self.first_byte[name].append(first_byte)
+
+    def error(self, name: str, reason: str):
+        self.errors[name][reason] += 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def _post_json(client: httpx.AsyncClient, recorder: Recorder, name: str, url: str,
+                     body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, json=body)
+    except httpx.HTTPError as e:
+        recorder.error(name, type(e).__name__)
+        return None
+    if response.status_code != 200:
+        recorder.error(name, str(response.status_code))
+        return None
+    recorder.ok(name, time.perf_counter() - start)
+    return response.json()
+
+
+async def _post_stream(client: httpx.AsyncClient, recorder: Recorder, name: str, url: str,
+                       body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """请求SSE接口，返回done事件的数据；首字节时间按第一个delta事件计"""
+    start = time.perf_counter()
+    first_byte = None
+    done = None
+    try:
+        async with client.stream("POST", url, json=body) as response:
+            if response.status_code != 200:
+                recorder.error(name, str(response.status_code))
+                return None
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    if event == "delta" and first_byte is None:
+                        first_byte = time.perf_counter() - start
+                    elif event == "done":
+                        done = json.loads(line[5:])
+                    elif event == "error":
+                        recorder.error(name, "sse_error")
+                        return None
+    except httpx.HTTPError as e:
+        recorder.error(name, type(e).__name__)
+        return None
+    if done is None:
+        recorder.error(name, "incomplete")
+        return None
+    recorder.ok(name, time.perf_counter() - start, first_byte)
+    return done
+
+
+async def play_journey(client: httpx.AsyncClient, recorder: Recorder, turns: int, stream: bool):
+    """一个玩家：开始对话后连续选择turns次"""
+    post = _post_stream if stream else _post_json
+    suffix = "/stream" if stream else ""
+    theme = random.choice(["auto", None])
+    started = await post(client, recorder, f"/start{suffix}", f"/api/v1/start{suffix}",
+                         {"theme": theme, "custom_theme": None if theme else f"压测主题{random.randrange(10_000)}"})
+    if started is None:
+        recorder.failed_journeys += 1
+        return
+    session_id, choices = started["session_id"], started["choices"]
+    for _ in range(turns):
+        indexes = [i for i, choice in enumerate(choices) if choice] or [0]
+        result = await post(client, recorder, f"/dialogue{suffix}", f"/api/v1/dialogue{suffix}",
+                            {"session_id": session_id, "choice_index": random.choice(indexes)})
+        if result is None:
+            recorder.failed_journeys += 1
+            return
+        choices = result["choices"]
+    recorder.journeys += 1
+
+
+async def run_players(client: httpx.AsyncClient, args: argparse.Namespace) -> Tuple[Recorder, float]:
+    recorder = Recorder()
+    remaining = args.journeys
+
+    async def player():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await play_journey(client, recorder, args.turns, args.stream)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(player() for _ in range(args.players)))
+    return recorder, time.perf_counter() - start
+
+
+def report(recorder: Recorder, elapsed: float):
+    print(f"\n{recorder.journeys} journeys completed, {recorder.failed_journeys} failed, {elapsed:.1f}s wall time")
+    print(f"{'endpoint':<20} {'ok':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttfb p50':>9}")
+    for name in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = recorder.latencies[name]
+        errors = sum(recorder.errors[name].values())
+        ttfb = recorder.first_byte.get(name)
+        print(f"{name:<20} {len(latencies):>6} {errors:>5} {len(latencies) / elapsed:8.1f} "
+              f"{percentile(latencies, 0.50) * 1000:8.0f} {percentile(latencies, 0.95) * 1000:8.0f} "
+              f"{percentile(latencies, 0.99) * 1000:8.0f} "
+              f"{(percentile(ttfb, 0.50) * 1000 if ttfb else 0):9.0f}")
+        if errors:
+            print(f"{'':<20} errors: {dict(recorder.errors[name])}")
+
+
+async def _serve_mock(settings: mock_llm_server.MockSettings) -> Tuple[asyncio.Task, Any, int]:
+    """在当前事件循环中启动模拟LLM服务器，返回(任务, 服务器, 端口)"""
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    config = uvicorn.Config(mock_llm_server.create_app(settings), log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return task, server, port
+
+
+async def run_in_process(args: argparse.Namespace):
+    task, server, port = await _serve_mock(mock_llm_server.settings_from_args(args))
+    # 配置在导入gal_sim时读取，必须先设置环境变量
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ["LLM_API_KEY"] = "mock"
+    os.environ["LLM_MODEL"] = "mock-model"
+    os.environ["LLM_ENDPOINTS"] = ""
+    if not args.llm_cache:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.chdir(ROOT)  # 静态文件目录按相对路径挂载
+    from gal_sim.main import app
+
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gal-sim", timeout=120) as client:
+                recorder, elapsed = await run_players(client, args)
+                stats = {}
+                for path in ("/api/v1/llm-endpoints/stats", "/api/v1/admission/stats"):
+                    stats[path] = (await client.get(path)).json()
+    finally:
+        server.should_exit = True
+        await task
+    report(recorder, elapsed)
+    print(f"\nmock LLM requests: {server.config.app.state.requests}")
+    endpoint = stats["/api/v1/llm-endpoints/stats"]
+    print(f"LLM retries: {endpoint['retries']}, admission: {stats['/api/v1/admission/stats']}")
+
+
+async def run_remote(args: argparse.Namespace):
+    limits = httpx.Limits(max_connections=args.players * 2)
+    async with httpx.AsyncClient(base_url=args.url, timeout=120, limits=limits) as client:
+        recorder, elapsed = await run_players(client, args)
+    report(recorder, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=50, help="同时在线的玩家数")
+    parser.add_argument("--journeys", type=int, default=200, help="总共完成的流程数")
+    parser.add_argument("--turns", type=int, default=5, help="每个流程中/dialogue的次数")
+    parser.add_argument("--stream", action="store_true", help="使用SSE流式接口")
+    parser.add_argument("--url", help="压测已运行的GAL-SIM实例，而不是进程内的应用")
+    parser.add_argument("--llm-cache", action="store_true", help="进程内压测时保留LLM响应缓存")
+    mock_llm_server.add_arguments(parser)
+    args = parser.parse_args()
+    # 重试等预期内的警告不输出，错误数在报告中统计
+    logging.basicConfig(level=logging.ERROR)
+
+    print(f"{args.players} players, {args.journeys} journeys x (1 start + {args.turns} dialogue), "
+          f"{'stream' if args.stream else 'json'} endpoints, target: {args.url or 'in-process app + mock LLM'}")
+    if args.url:
+        asyncio.run(run_remote(args))
+    else:
+        asyncio.run(run_in_process(args))
+
+
+if __name__ == "__main__":
+    main()
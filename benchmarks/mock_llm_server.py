@@ -0,0 +1,198 @@
+"""
+本地OpenAI兼容模拟服务器
+
+实现 POST /v1/chat/completions（含stream=true），按配置的首token延迟、每秒token数、错误率和
+格式错误率返回随机生成的对话，不消耗API额度，用于基准测试和压力测试
+
+用法: python benchmarks/mock_llm_server.py [--port 9000] [--ttft 0.3] [--tps 50]
+                                          [--error-rate 0.01] [--malformed-rate 0.05]
+                                          [--model-ttft gpt-4o=2.0 --model-ttft gpt-4o-mini=0.2]
+然后以 LLM_BASE_URL=http://127.0.0.1:9000/v1 LLM_API_KEY=mock 启动GAL-SIM
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+THEMES = ["校园恋爱", "魔法学院的邂逅", "未来世界的机器人伙伴", "海边小镇的夏天", "咖啡店的常客", "古堡里的委托"]
+LINES = [
+    "她低下头，小声说道：“其实……我一直在等你。”",
+    "“你今天怎么这么晚？”她鼓起脸颊，却还是把伞往你这边挪了挪。",
+    "窗外下起了雨，她望着你，像是有什么话想说。",
+    "“要不要一起去看看？听说那边的樱花开了。”",
+]
+CHOICE_TEMPLATES = ["温柔地回应她", "问她发生了什么", "岔开话题", "冷淡地转身离开"]
+
+
+@dataclass
+class MockSettings:
+    ttft: float = 0.3  # 首token延迟（秒）
+    tokens_per_second: float = 50.0
+    error_rate: float = 0.0  # 返回5xx/429的概率
+    malformed_rate: float = 0.0  # 返回格式有问题的JSON的概率
+    chars_per_token: int = 2  # 中文大致每1-2个字符一个token
+    model_ttft: Dict[str, float] = field(default_factory=dict)  # 按请求中的模型名覆盖首token延迟
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    return "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+
+
+def _dialogue_json(field: str, compact: bool = False) -> str:
+    tag = random.randrange(1_000_000)
+    text = f"{random.choice(LINES)}（#{tag}）"
+    choices = [f"{choice}（#{tag}-{i}）" for i, choice in enumerate(CHOICE_TEMPLATES)]
+    if compact:
+        # 精简协议：短键名、不带缩进
+        return json.dumps({"t": text, "c": choices}, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps({field: text, "choices": choices}, ensure_ascii=False, indent=2)
+
+
+def _malform(content: str) -> str:
+    """模拟模型常见的格式问题"""
+    kind = random.randrange(4)
+    if kind == 0:
+        return f"好的，以下是回复：\n```json\n{content}\n```\n希望你喜欢！"
+    if kind == 1:
+        return content[:int(len(content) * 0.7)]  # 输出被截断
+    if kind == 2:
+        return content.replace('"\n  ]', '",\n  ]').replace('"]}', '",]}')  # 结尾逗号
+    data = json.loads(content)
+    choices = data.get("c") or data["choices"]
+    text = next(value for key, value in data.items() if key not in ("c", "choices"))
+    return text + "\n" + "\n".join(f"{letter}. {choice}" for letter, choice in zip("ABCD", choices))
+
+
+def generate_content(prompt: str, settings: MockSettings) -> str:
+    """根据提示词的类型生成回复"""
+    if "有趣主题" in prompt:
+        return f"{random.choice(THEMES)}·{random.randrange(10_000)}"
+    if "剧情概要" in prompt and "只返回概要内容" in prompt:
+        return "两人在雨中相遇，关系逐渐亲近。"
+    field = "dialogue" if '"dialogue"' in prompt else "response"
+    content = _dialogue_json(field, compact='{"t":' in prompt)
+    if random.random() < settings.malformed_rate:
+        content = _malform(content)
+    return content
+
+
+def _split_tokens(content: str, chars_per_token: int) -> List[str]:
+    return [content[i:i + chars_per_token] for i in range(0, len(content), chars_per_token)]
+
+
+def _error_response() -> JSONResponse:
+    status = random.choice((429, 500, 503))
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": f"mock error {status}", "type": "server_error"}},
+        headers={"Retry-After": "0"} if status == 429 else None,
+    )
+
+
+def create_app(settings: MockSettings = None) -> FastAPI:
+    settings = settings or MockSettings()
+    app = FastAPI(title="GAL-SIM mock LLM")
+    app.state.settings = settings
+    app.state.requests = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        if random.random() < settings.error_rate:
+            await asyncio.sleep(settings.ttft)
+            return _error_response()
+
+        prompt = _prompt_text(body)
+        content = generate_content(prompt, settings)
+        tokens = _split_tokens(content, settings.chars_per_token)
+        finish_reason = "stop"
+        max_tokens = body.get("max_tokens")
+        if max_tokens and len(tokens) > max_tokens:
+            tokens = tokens[:max_tokens]
+            content = "".join(tokens)
+            finish_reason = "length"
+        model = body.get("model", "mock-model")
+        ttft = settings.model_ttft.get(model, settings.ttft)
+        created = int(time.time())
+        completion_id = f"chatcmpl-mock-{random.randrange(1 << 32):x}"
+        usage = {
+            "prompt_tokens": len(prompt) // settings.chars_per_token,
+            "completion_tokens": len(tokens),
+            "total_tokens": len(prompt) // settings.chars_per_token + len(tokens),
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + len(tokens) / settings.tokens_per_second)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+
+        async def events() -> AsyncIterator[str]:
+            await asyncio.sleep(ttft)
+            interval = 1 / settings.tokens_per_second
+            for token in tokens:
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(interval)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--ttft", type=float, default=0.3, help="首token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=50.0, help="每秒生成的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的概率")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="返回格式有问题的输出的概率")
+    parser.add_argument("--model-ttft", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="指定模型的首token延迟，可重复")
+
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    model_ttft = {}
+    for entry in args.model_ttft:
+        model, _, seconds = entry.rpartition("=")
+        model_ttft[model] = float(seconds)
+    return MockSettings(
+        ttft=args.ttft, tokens_per_second=args.tps, error_rate=args.error_rate, malformed_rate=args.malformed_rate,
+        model_ttft=model_ttft
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
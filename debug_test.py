@@ -4,15 +4,16 @@ sys.path.append('.')
 
 from gal_sim.services.llm_service import LLMService
 
-def test_service():
+async def check_service():
+    """手动检查与LLM服务的连通性（调用真实接口），用法: python debug_test.py"""
     service = LLMService()
     try:
         print('测试生成主题...')
-        theme = service.generate_theme()
+        theme = await service.generate_theme()
         print(f'主题生成成功: {theme}')
         
         print('测试生成初始对话...')
-        dialogue = service.generate_initial_dialogue(theme)
+        dialogue = await service.generate_initial_dialogue(theme)
         print(f'对话生成成功，选项数: {len(dialogue["choices"])}')
         
         print('测试完成')
@@ -22,4 +23,4 @@ def test_service():
         traceback.print_exc()
 
 if __name__ == "__main__":
-    test_service()
\ No newline at end of file
+    asyncio.run(check_service())
\ No newline at end of file
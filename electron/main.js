@@ -4,6 +4,12 @@ const isDev = require('electron-is-dev');
 const { spawn, exec } = require('child_process');
 const fs = require('fs');
 const dotenv = require('dotenv');
+const http = require('http');
+
+const SERVER_URL = 'http://127.0.0.1:8000';
+const HEALTH_URL = `${SERVER_URL}/healthz`;
+const HEALTH_POLL_INTERVAL = 100; // 轮询就绪接口的间隔（毫秒）
+const SERVER_START_TIMEOUT = 60000; // 等待后端就绪的最长时间（毫秒）
 
 let mainWindow;
 let pythonProcess;
@@ -49,6 +55,7 @@ function checkEnvFile() {
     console.warn('⚠️  警告: API密钥未配置或仍为默认值，请在 .env 文件中配置');
     console.warn('   示例: LLM_API_KEY=sk-...');
   }
+  return envPath;
 }
 
 function createWindow() {
@@ -63,25 +70,90 @@ function createWindow() {
     icon: path.join(__dirname, '../gal_sim/static/favicon.ico') // 使用项目中的favicon作为应用图标
   });
 
-  // 在开发模式下使用本地服务器，生产模式下启动FastAPI服务器
-  if (isDev) {
-    mainWindow.loadURL('http://localhost:8000');
-  } else {
-    // 启动FastAPI服务器并等待其就绪
-    startFastAPIServer().then(() => {
-      mainWindow.loadURL('http://localhost:8000');
-    }).catch((err) => {
-      console.error('Failed to start FastAPI server:', err);
-      // 如果服务器启动失败，显示错误页面
-      showErrorMessage(err);
-    });
-  }
+  // 后端就绪前先显示加载页面，避免白屏
+  showLoadingPage();
+
+  // 在开发模式下等待本地服务器就绪，生产模式下启动FastAPI服务器并等待其就绪
+  const serverStarted = isDev ? waitForServer(SERVER_START_TIMEOUT) : startFastAPIServer();
+  serverStarted.then(() => {
+    mainWindow.loadURL(SERVER_URL);
+  }).catch((err) => {
+    console.error('Failed to start FastAPI server:', err);
+    // 如果服务器启动失败，显示错误页面
+    showErrorMessage(err);
+  });
 
   if (isDev) {
     mainWindow.webContents.openDevTools();
   }
 }
 
+// 显示加载页面
+function showLoadingPage() {
+  const loadingPage = `
+    <!DOCTYPE html>
+    <html lang="zh-CN">
+    <head>
+        <meta charset="UTF-8">
+        <title>GAL-SIM</title>
+        <style>
+            body {
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+                background: #f5f5f5;
+                margin: 0;
+                display: flex;
+                justify-content: center;
+                align-items: center;
+                min-height: 100vh;
+                color: #555;
+            }
+        </style>
+    </head>
+    <body>
+        <p>正在启动 GAL-SIM 服务...</p>
+    </body>
+    </html>
+  `;
+
+  mainWindow.loadURL(`data:text/html;charset=utf-8,${encodeURIComponent(loadingPage)}`);
+}
+
+// 请求一次就绪接口，返回200时为true
+function checkHealth() {
+  return new Promise((resolve) => {
+    const req = http.get(HEALTH_URL, { timeout: 1000 }, (res) => {
+      res.resume();
+      resolve(res.statusCode === 200);
+    });
+    req.on('timeout', () => req.destroy());
+    req.on('error', () => resolve(false));
+  });
+}
+
+// 轮询就绪接口直到后端可用；shouldStop返回错误时提前结束（如后端进程已退出）
+function waitForServer(timeoutMs, shouldStop = () => null) {
+  const deadline = Date.now() + timeoutMs;
+  return new Promise((resolve, reject) => {
+    const poll = async () => {
+      const stopError = shouldStop();
+      if (stopError) {
+        reject(stopError);
+        return;
+      }
+      if (await checkHealth()) {
+        resolve();
+        return;
+      }
+      if (Date.now() >= deadline) {
+        reject(new Error(`Server did not become ready within ${timeoutMs / 1000} seconds`));
+        return;
+      }
+      setTimeout(poll, HEALTH_POLL_INTERVAL);
+    };
+    poll();
+  });
+}
+
 // 显示错误消息页面
 function showErrorMessage(error) {
   const errorPage = `
@@ -177,134 +249,128 @@ function showErrorMessage(error) {
 
 // 启动FastAPI服务器
 function startFastAPIServer() {
-  return new Promise((resolve, reject) => {
-    // 检查环境配置
-    checkEnvFile();
-    
-    const resourcesPath = isDev 
-      ? path.join(__dirname, '..') 
-      : process.resourcesPath;
-    
-    const appPath = isDev
-      ? path.join(__dirname, '../run_server.py')
-      : path.join(resourcesPath, 'app/run_server.py');
-    
-    // 根据操作系统确定Python可执行文件路径
-    let pythonCmd = 'python3';
-    
-    if (process.platform === 'win32') {
+  // 检查环境配置
+  const envPath = checkEnvFile();
+  
+  const resourcesPath = isDev 
+    ? path.join(__dirname, '..') 
+    : process.resourcesPath;
+  
+  const appPath = isDev
+    ? path.join(__dirname, '../run_server.py')
+    : path.join(resourcesPath, 'app/run_server.py');
+  
+  // 根据操作系统确定Python可执行文件路径
+  let pythonCmd = 'python3';
+  
+  if (process.platform === 'win32') {
+    pythonCmd = 'python';
+  }
+  
+  // 检查是否在Electron打包后的环境中
+  const isPackaged = app.isPackaged;
+  
+  // Windows环境下尝试多种Python执行文件名
+  if (process.platform === 'win32') {
+    // 检查是否有python.exe
+    const { execSync } = require('child_process');
+    try {
+      execSync('python --version');
       pythonCmd = 'python';
-    }
-    
-    // 检查是否在Electron打包后的环境中
-    const isPackaged = app.isPackaged;
-    
-    // Windows环境下尝试多种Python执行文件名
-    if (process.platform === 'win32') {
-      // 检查是否有python.exe
-      const { execSync } = require('child_process');
+    } catch (e) {
       try {
-        execSync('python --version');
-        pythonCmd = 'python';
+        execSync('python.exe --version');
+        pythonCmd = 'python.exe';
       } catch (e) {
         try {
-          execSync('python.exe --version');
-          pythonCmd = 'python.exe';
+          execSync('py --version');  // Windows上常用的Python启动器
+          pythonCmd = 'py';
         } catch (e) {
-          try {
-            execSync('py --version');  // Windows上常用的Python启动器
-            pythonCmd = 'py';
-          } catch (e) {
-            console.warn('⚠️ 未找到Python命令，应用可能无法正常工作');
-            pythonCmd = 'python'; // 默认回退
-          }
+          console.warn('⚠️ 未找到Python命令，应用可能无法正常工作');
+          pythonCmd = 'python'; // 默认回退
         }
       }
     }
+  }
+  
+  const workingDir = isDev
+    ? path.join(__dirname, '..')
+    : path.join(resourcesPath, 'app');
+  
+  // 在Windows环境下，可能需要使用完整的Python路径或添加额外的环境变量
+  const spawnOptions = {
+    cwd: workingDir,
+    env: {
+      ...process.env,
+      PYTHONUNBUFFERED: '1',
+      // 后端直接读取这个.env，不再逐个探测可能的位置
+      GAL_SIM_ENV_FILE: envPath
+    }
+  };
+  
+  // 在Windows上设置适当的PATH
+  if (process.platform === 'win32') {
+    spawnOptions.env.PATH = process.env.PATH || '';
     
-    const workingDir = isDev
-      ? path.join(__dirname, '..')
-      : path.join(resourcesPath, 'app');
-    
-    // 在Windows环境下，可能需要使用完整的Python路径或添加额外的环境变量
-    const spawnOptions = {
-      cwd: workingDir,
-      env: {
-        ...process.env,
-        PYTHONUNBUFFERED: '1'
-      }
-    };
+    // 在Windows上，可能需要添加Python安装路径到环境变量
+    const pythonPaths = [
+      'C:\\Python39\\Scripts\\',
+      'C:\\Python38\\Scripts\\',
+      'C:\\Python37\\Scripts\\',
+      'C:\\Python39\\',
+      'C:\\Python38\\',
+      'C:\\Python37\\'
+    ];
     
-    // 在Windows上设置适当的PATH
-    if (process.platform === 'win32') {
-      spawnOptions.env.PATH = process.env.PATH || '';
-      
-      // 在Windows上，可能需要添加Python安装路径到环境变量
-      const pythonPaths = [
-        'C:\\Python39\\Scripts\\',
-        'C:\\Python38\\Scripts\\',
-        'C:\\Python37\\Scripts\\',
-        'C:\\Python39\\',
-        'C:\\Python38\\',
-        'C:\\Python37\\'
-      ];
-      
-      for (const pythonPath of pythonPaths) {
-        if (spawnOptions.env.PATH.indexOf(pythonPath) === -1) {
-          spawnOptions.env.PATH = `${pythonPath};${spawnOptions.env.PATH}`;
-        }
+    for (const pythonPath of pythonPaths) {
+      if (spawnOptions.env.PATH.indexOf(pythonPath) === -1) {
+        spawnOptions.env.PATH = `${pythonPath};${spawnOptions.env.PATH}`;
       }
     }
-    
-    console.log('Starting FastAPI server...');
-    console.log('Python command:', pythonCmd);
-    console.log('App path:', appPath);
-    console.log('Working directory:', workingDir);
-    console.log('Resources path:', resourcesPath);
-    console.log('Is packaged:', app.isPackaged);
-    
-    pythonProcess = spawn(pythonCmd, [appPath], spawnOptions);
+  }
+  
+  console.log('Starting FastAPI server...');
+  console.log('Python command:', pythonCmd);
+  console.log('App path:', appPath);
+  console.log('Working directory:', workingDir);
+  console.log('Resources path:', resourcesPath);
+  console.log('Is packaged:', app.isPackaged);
+  
+  pythonProcess = spawn(pythonCmd, [appPath], spawnOptions);
+  let exitError = null;
 
-    pythonProcess.stdout.on('data', (data) => {
-      const output = data.toString();
-      console.log(`FastAPI: ${output}`);
-      
-      // 检测服务器是否已启动
-      if (!serverReady && (output.includes('Uvicorn running on') || output.includes('Application startup complete'))) {
-        serverReady = true;
-        console.log('FastAPI server is ready');
-        resolve();
-      }
-    });
+  pythonProcess.stdout.on('data', (data) => {
+    console.log(`FastAPI: ${data}`);
+  });
 
-    pythonProcess.stderr.on('data', (data) => {
-      console.error(`FastAPI Error: ${data}`);
-    });
+  pythonProcess.stderr.on('data', (data) => {
+    console.error(`FastAPI Error: ${data}`);
+  });
 
-    pythonProcess.on('close', (code) => {
-      console.log(`FastAPI process exited with code ${code}`);
-      if (!serverReady) {
-        // 在Windows环境下，如果服务器启动失败，显示错误信息
-        if (process.platform === 'win32') {
-          console.error('FastAPI server failed to start on Windows. This may be due to:');
-          console.error('1. Python is not installed or not in PATH');
-          console.error('2. Required Python packages are not installed');
-          console.error('3. Port 8000 is already in use');
-          console.error('4. Antivirus software blocking the process');
-        }
-        reject(new Error(`Server exited with code ${code} before becoming ready`));
-      }
-    });
-    
-    // 设置超时，防止无限等待
-    setTimeout(() => {
-      if (!serverReady) {
-        console.warn('⚠️ Server startup timeout after 30 seconds');
-        console.warn('   The server may still be starting. If the app does not load,');
-        console.warn('   please check that Python and dependencies are properly installed.');
-        resolve(); // 超时后仍然继续，而不是失败
+  pythonProcess.on('error', (err) => {
+    exitError = err;
+  });
+
+  pythonProcess.on('close', (code) => {
+    console.log(`FastAPI process exited with code ${code}`);
+    if (!serverReady) {
+      // 在Windows环境下，如果服务器启动失败，显示错误信息
+      if (process.platform === 'win32') {
+        console.error('FastAPI server failed to start on Windows. This may be due to:');
+        console.error('1. Python is not installed or not in PATH');
+        console.error('2. Required Python packages are not installed');
+        console.error('3. Port 8000 is already in use');
+        console.error('4. Antivirus software blocking the process');
       }
-    }, 30000); // 30秒超时
+      exitError = new Error(`Server exited with code ${code} before becoming ready`);
+    }
+  });
+
+  // 轮询就绪接口，而不是等待固定时间或匹配日志输出
+  const startedAt = Date.now();
+  return waitForServer(SERVER_START_TIMEOUT, () => exitError).then(() => {
+    serverReady = true;
+    console.log(`FastAPI server is ready after ${Date.now() - startedAt} ms`);
   });
 }
 
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response
+from ..services.background_cache import BackgroundCache, CONTENT_TYPES
+from typing import Optional
+
+router = APIRouter(prefix="/api/v1", tags=["background"])
+
+# 背景图片缓存实例
+background_cache = BackgroundCache()
+
+# 图片文件以内容哈希命名，内容不会变化，可以长期缓存
+_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@router.get("/background")
+async def get_background(w: Optional[int] = Query(None, ge=1, le=10000, description="窗口宽度（像素）")):
+    """
+    随机选一张本地缓存的背景图片，重定向到该图片的固定地址
+    - 指定w时返回适合该宽度的缩小版本（需要安装Pillow）
+    - 没有可用的图片（如离线且从未缓存过）时返回404
+    """
+    name = await background_cache.pick()
+    if name is None:
+        raise HTTPException(status_code=404, detail="没有可用的背景图片")
+    if w:
+        name = await background_cache.variant(name, w)
+    return RedirectResponse(f"/api/v1/background/{name}", status_code=302, headers={"Cache-Control": "no-store"})
+
+
+@router.get("/background-cache/stats")
+async def get_background_cache_stats():
+    """
+    获取背景图片缓存的统计信息
+    """
+    return background_cache.stats()
+
+
+@router.get("/background/{name}")
+async def get_background_image(name: str, request: Request):
+    """
+    返回缓存的背景图片，带ETag和长期缓存头
+    """
+    path = background_cache.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="图片不存在")
+    etag = f'"{name}"'
+    headers = {"ETag": etag, "Cache-Control": _IMMUTABLE}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=CONTENT_TYPES[name.rsplit(".", 1)[-1]], headers=headers)
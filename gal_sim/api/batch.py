@@ -0,0 +1,159 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from ..models.dialogue import BatchItem, BatchRequest
+from ..services.metrics import stage, stage_timings
+from ..services.session_manager import SessionEvicted, SessionNotFound
+from ..utils.config import BATCH_MAX_ITEMS, BATCH_MAX_CONCURRENCY
+from .dialogue import admission, dialogue_service
+from typing import Any, AsyncIterator, Dict, List, Tuple
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/v1", tags=["batch"])
+
+
+class BatchItemError(Exception):
+    """批量请求中单项的错误，带有对应的HTTP状态码"""
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+async def _start(item: BatchItem) -> Dict[str, Any]:
+    session_id = str(uuid.uuid4())
+    result = await dialogue_service.start_new_dialogue(session_id, item.theme, item.custom_theme)
+    return {
+        "session_id": session_id,
+        "theme": result["theme"],
+        "initial_dialogue": result["initial_dialogue"],
+        "choices": result["choices"],
+        "affection": result["affection"],
+    }
+
+
+async def _continue(item: BatchItem) -> Dict[str, Any]:
+    if item.choice_index is None and not item.user_input:
+        raise BatchItemError(400, "需要提供choice_index或user_input")
+    result = await dialogue_service.continue_dialogue(
+        item.session_id, item.user_input, item.theme, item.choice_index
+    )
+    return {
+        "session_id": item.session_id,
+        "character_response": result["character_response"],
+        "choices": result["choices"],
+        "affection": result["affection"],
+    }
+
+
+async def _run_item(item: BatchItem) -> Dict[str, Any]:
+    """
+    执行一项，与单个请求一样占用准入名额；批量请求已由自身的并发数限制，
+    名额不足时排队等待而不是拒绝，避免大批量请求中的项被429拒绝后连带跳过同一会话的后续项
+    """
+    try:
+        async with admission.admit(wait=True):
+            if item.session_id:
+                return await _continue(item)
+            return await _start(item)
+    except BatchItemError:
+        raise
+    except SessionEvicted as e:
+        raise BatchItemError(410, str(e))
+    except SessionNotFound as e:
+        raise BatchItemError(404, str(e))
+    except ValueError as e:
+        raise BatchItemError(400, str(e))
+    except Exception as e:
+        raise BatchItemError(500, f"{'对话继续' if item.session_id else '开始对话'}失败: {str(e)}")
+
+
+def _group_items(items: List[BatchItem]) -> List[List[Tuple[int, BatchItem]]]:
+    """按会话分组：同一会话的多项保持提交顺序，新对话各自成组"""
+    groups: Dict[str, List[Tuple[int, BatchItem]]] = {}
+    singles: List[List[Tuple[int, BatchItem]]] = []
+    for index, item in enumerate(items):
+        if item.session_id:
+            groups.setdefault(item.session_id, []).append((index, item))
+        else:
+            singles.append([(index, item)])
+    return list(groups.values()) + singles
+
+
+def _ndjson(data: Dict[str, Any]) -> str:
+    with stage("serialize"):
+        return json.dumps(jsonable_encoder(data), ensure_ascii=False) + "\n"
+
+
+async def run_batch(items: List[BatchItem], concurrency: int) -> AsyncIterator[str]:
+    """
+    并发执行批量请求，每完成一项输出一行NDJSON，最后输出一行汇总
+    同一会话的多项依次执行，前一项失败时跳过该会话后续的项
+    """
+    # 批量请求持续时间较长，各项耗时不计入本次请求的Server-Timing
+    stage_timings.set(None)
+    start = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def run_group(group: List[Tuple[int, BatchItem]]):
+        failed = False
+        for index, item in group:
+            line = {"index": index, "id": item.id}
+            if failed:
+                line.update(ok=False, status=409, detail="同一会话的前一项失败，已跳过")
+            else:
+                try:
+                    async with semaphore:
+                        line.update(ok=True, result=await _run_item(item))
+                except BatchItemError as e:
+                    failed = True
+                    line.update(ok=False, status=e.status, detail=e.detail)
+            await results.put(line)
+
+    groups = _group_items(items)
+    tasks = [asyncio.create_task(run_group(group)) for group in groups]
+    succeeded = 0
+    try:
+        for _ in range(len(items)):
+            line = await results.get()
+            succeeded += line["ok"]
+            yield _ndjson(line)
+    finally:
+        # 客户端断开时取消尚未完成的项
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    yield _ndjson({
+        "done": True,
+        "total": len(items),
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "elapsed": round(time.monotonic() - start, 3),
+    })
+
+
+@router.post("/batch")
+async def batch(request: BatchRequest):
+    """
+    批量开始对话和继续对话，供自动化测试使用
+    - 带session_id的项继续该会话，否则开始新对话
+    - 同一会话的多项按提交顺序执行，不同会话之间并发执行
+    - 以NDJSON逐行返回结果（按完成顺序，index为该项在items中的位置），最后一行为汇总
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交{BATCH_MAX_ITEMS}项")
+    concurrency = min(request.concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    logger.info(f"Running batch of {len(request.items)} items with concurrency {concurrency}")
+    return StreamingResponse(
+        run_batch(request.items, max(1, concurrency)),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,7 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import StreamingResponse
 from ..models.dialogue import DialogueRequest, DialogueResponse, ThemeRequest, ThemeResponse
+from ..services.admission import AdmissionController, AdmissionRejected, IdempotencyCache
 from ..services.dialogue_service import DialogueService
-from typing import Dict
+from ..services.metrics import stage
+from ..services.session_manager import SessionEvicted, SessionNotFound, session_manager
+from typing import Dict, Any, AsyncIterator, Optional, Tuple
+import json
+import time
 import uuid
 
 router = APIRouter(prefix="/api/v1", tags=["dialogue"])
@@ -9,50 +15,171 @@ router = APIRouter(prefix="/api/v1", tags=["dialogue"])
 # 对话服务实例
 dialogue_service = DialogueService()
 
+# 准入控制与幂等键缓存
+admission = AdmissionController()
+idempotency = IdempotencyCache()
+
+
+def _too_many_requests(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _session_evicted(e: SessionEvicted) -> HTTPException:
+    """会话因内存压力被淘汰时返回410，客户端可据此重新开始对话，而不是当作服务器错误"""
+    return HTTPException(status_code=410, detail=str(e), headers={"X-Session-Evicted": "1"})
+
 
 @router.post("/start", response_model=ThemeResponse)
-async def start_dialogue(request: ThemeRequest):
+async def start_dialogue(request: ThemeRequest, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
     开始新的对话
     - 如果theme为空，则自动生成主题
     - 返回初始对话和四个选项
+    - 带相同Idempotency-Key的重试返回同一个会话
     """
-    try:
+    async def start() -> ThemeResponse:
         session_id = str(uuid.uuid4())
         result = await dialogue_service.start_new_dialogue(session_id, request.theme, request.custom_theme)
-        return ThemeResponse(
-            session_id=session_id,
-            theme=result["theme"],
-            initial_dialogue=result["initial_dialogue"],
-            choices=result["choices"],
-            affection=result["affection"]
-        )
+        with stage("serialize"):
+            return ThemeResponse(
+                session_id=session_id,
+                theme=result["theme"],
+                initial_dialogue=result["initial_dialogue"],
+                choices=result["choices"],
+                affection=result["affection"]
+            )
+
+    try:
+        async with admission.admit():
+            return await idempotency.run("start", idempotency_key, start)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"开始对话失败: {str(e)}")
 
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条Server-Sent Event"""
+    with stage("serialize"):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_stream(events: AsyncIterator[Tuple[str, Dict[str, Any]]], error_prefix: str) -> AsyncIterator[str]:
+    """将服务产出的事件转换为SSE文本流，出错时发送error事件"""
+    try:
+        async for event, data in events:
+            yield _sse_event(event, data)
+    except SessionEvicted as e:
+        yield _sse_event("error", {"detail": str(e), "code": "session_evicted"})
+    except Exception as e:
+        yield _sse_event("error", {"detail": f"{error_prefix}: {str(e)}"})
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """
+    持有一个准入名额的流式响应，响应结束时归还名额
+    在ASGI调用外层归还：客户端在响应头发出前断开时生成器根本不会开始执行，不能依赖生成器的finally
+    """
+    async def __call__(self, scope, receive, send):
+        start = time.monotonic()
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(time.monotonic() - start)
+
+
+async def _admit_stream():
+    """流式接口在返回响应前获取准入名额，以便队列满时仍能返回429"""
+    try:
+        await admission.acquire()
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+
+
+def _sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """构建SSE响应，调用前需已通过_admit_stream获取准入名额"""
+    return _AdmittedStreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/start/stream")
+async def start_dialogue_stream(request: ThemeRequest):
+    """
+    以SSE流式开始新的对话
+    - meta事件: 会话ID和主题
+    - delta事件: 逐段生成的开场白
+    - done事件: 完整开场白、四个选项和好感度
+    """
+    await _admit_stream()
+    session_id = str(uuid.uuid4())
+    events = dialogue_service.stream_new_dialogue(session_id, request.theme, request.custom_theme)
+    return _sse_response(_sse_stream(events, "开始对话失败"))
+
+
+def _validate_dialogue_request(request: DialogueRequest):
+    if not request.session_id:
+        raise HTTPException(status_code=400, detail="会话ID不能为空")
+    if request.choice_index is None and not request.user_input:
+        raise HTTPException(status_code=400, detail="需要提供choice_index或user_input")
+
+
 @router.post("/dialogue", response_model=DialogueResponse)
-async def continue_dialogue(request: DialogueRequest):
+async def continue_dialogue(request: DialogueRequest, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
     继续对话
-    - 根据用户的选择继续剧情
+    - 根据用户选择的选项序号（choice_index）或自由输入的文本（user_input）继续剧情
     - 返回角色回应和新的四个选项
+    - 带相同Idempotency-Key的重试不会重复推进剧情
     """
-    try:
-        if not request.session_id:
-            raise HTTPException(status_code=400, detail="会话ID不能为空")
-        
-        result = await dialogue_service.continue_dialogue(request.session_id, request.user_input, request.theme)
-        return DialogueResponse(
-            session_id=request.session_id,
-            character_response=result["character_response"],
-            choices=result["choices"],
-            affection=result["affection"]
+    _validate_dialogue_request(request)
+
+    async def proceed() -> DialogueResponse:
+        result = await dialogue_service.continue_dialogue(
+            request.session_id, request.user_input, request.theme, request.choice_index
         )
+        with stage("serialize"):
+            return DialogueResponse(
+                session_id=request.session_id,
+                character_response=result["character_response"],
+                choices=result["choices"],
+                affection=result["affection"]
+            )
+
+    try:
+        async with admission.admit():
+            return await idempotency.run(f"dialogue:{request.session_id}", idempotency_key, proceed)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    except SessionEvicted as e:
+        raise _session_evicted(e)
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"对话继续失败: {str(e)}")
 
 
+@router.post("/dialogue/stream")
+async def continue_dialogue_stream(request: DialogueRequest):
+    """
+    以SSE流式继续对话
+    - delta事件: 逐段生成的角色回应
+    - done事件: 完整回应、新的四个选项和好感度
+    """
+    _validate_dialogue_request(request)
+    if session_manager.was_evicted(request.session_id):
+        raise _session_evicted(SessionEvicted(request.session_id))
+    await _admit_stream()
+    events = dialogue_service.stream_dialogue(
+        request.session_id, request.user_input, request.theme, request.choice_index
+    )
+    return _sse_response(_sse_stream(events, "对话继续失败"))
+
+
 @router.get("/session/{session_id}")
 async def get_session_info(session_id: str):
     """
@@ -61,7 +188,79 @@ async def get_session_info(session_id: str):
     try:
         session_data = await dialogue_service.get_session_data(session_id)
         if not session_data:
+            if session_manager.was_evicted(session_id):
+                raise _session_evicted(SessionEvicted(session_id))
             raise HTTPException(status_code=404, detail="会话不存在")
         return session_data
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取会话信息失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"获取会话信息失败: {str(e)}")
+
+
+@router.get("/speculation/stats")
+async def get_speculation_stats():
+    """
+    获取推测生成的统计信息（命中率、取消数、token消耗等）
+    """
+    return dialogue_service.speculator.stats()
+
+
+@router.get("/theme-pool/stats")
+async def get_theme_pool_stats():
+    """
+    获取自动主题预热池的统计信息
+    """
+    return dialogue_service.theme_pool.stats()
+
+
+@router.get("/llm-cache/stats")
+async def get_llm_cache_stats():
+    """
+    获取LLM响应缓存的统计信息
+    """
+    return dialogue_service.llm_service.cache.stats()
+
+
+@router.get("/llm-protocol/stats")
+async def get_llm_protocol_stats():
+    """
+    获取LLM协议的统计信息（精简协议每轮节省的输入/输出token、当前的max_tokens）
+    """
+    return dialogue_service.llm_service.protocol_stats()
+
+
+@router.get("/llm-profiles/stats")
+async def get_llm_profile_stats():
+    """
+    获取各类请求（主题、开场白、回应、剧情概要）使用的模型、是否已切换到备用模型，以及每个模型的延迟和token用量
+    """
+    return dialogue_service.llm_service.profile_stats()
+
+
+@router.get("/llm-endpoints/stats")
+async def get_llm_endpoint_stats():
+    """
+    获取各LLM endpoint的健康状况、延迟和重试/对冲统计
+    """
+    return dialogue_service.llm_service.router.stats()
+
+
+@router.get("/sessions/stats")
+async def get_session_stats():
+    """
+    获取内存中会话的统计信息（会话数、估算的内存占用、淘汰和过期数）
+    """
+    return session_manager.stats()
+
+
+@router.get("/admission/stats")
+async def get_admission_stats():
+    """
+    获取准入控制的统计信息（处理中、排队、拒绝数等）
+    """
+    return {
+        **admission.stats(),
+        "deduplicated_turns": dialogue_service.deduplicated_turns,
+        "idempotent_replays": idempotency.replayed,
+    }
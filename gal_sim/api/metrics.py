@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from ..services.metrics import Gauge, registry
+from ..services.session_manager import session_manager
+from .dialogue import admission, dialogue_service
+
+router = APIRouter(tags=["metrics"])
+
+registry.register(Gauge(
+    "gal_sim_active_sessions", "内存中的活跃会话数", lambda: len(session_manager.sessions)
+))
+registry.register(Gauge(
+    "gal_sim_session_resident_bytes", "内存中会话的估算总占用（字节）", lambda: session_manager.resident_bytes
+))
+registry.register(Gauge(
+    "gal_sim_llm_in_flight", "进行中的LLM请求数",
+    lambda: sum(endpoint.in_flight for endpoint in dialogue_service.llm_service.router.endpoints)
+))
+registry.register(Gauge(
+    "gal_sim_admission_active", "正在处理的对话请求数", lambda: admission.active
+))
+registry.register(Gauge(
+    "gal_sim_admission_waiting", "排队等待处理的对话请求数", lambda: admission.waiting
+))
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus文本格式的指标
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,176 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+from ..models.dialogue import CHOICE_AFFECTION_DELTAS, SaveRequest, ThemeResponse
+from ..services.session_manager import SessionData, SessionEvicted, session_manager
+from ..services.session_snapshot import SaveSlots, dump_save, load_save
+from ..utils.config import SESSION_SNAPSHOT_PATH
+from typing import Any, Dict
+from datetime import datetime
+import asyncio
+import math
+import uuid
+
+router = APIRouter(prefix="/api/v1", tags=["saves"])
+
+# 存档槽实例
+save_slots = SaveSlots()
+
+# 导入的存档文件大小上限
+MAX_IMPORT_BYTES = 8 * 1024 * 1024
+
+
+async def _dump(session_id: str) -> bytes:
+    session_data = await session_manager.get_session(session_id)
+    if not session_data:
+        if session_manager.was_evicted(session_id):
+            raise HTTPException(status_code=410, detail=str(SessionEvicted(session_id)))
+        raise HTTPException(status_code=404, detail="会话不存在")
+    # 等待进行中的对话轮次结束，避免存下只有玩家输入没有角色回应的状态
+    async with session_data.lock:
+        return dump_save(session_data)
+
+
+def _sanitize(record: Dict[str, Any]):
+    """
+    存档文件来自客户端，不能信任其中的数值：好感度、选项的好感度变化和历史记录长度限制在正常范围内，
+    时间戳必须是有限值
+    """
+    record["affection"] = max(0, min(100, record["affection"]))
+    record["max_history_length"] = max(1, min(SessionData.max_history_length, record["max_history_length"]))
+    texts = [text for text, _ in record["offered_choices"]]
+    record["offered_choices"] = list(zip(texts, CHOICE_AFFECTION_DELTAS))
+    if not math.isfinite(record["summarized_until"]) or record["summarized_until"] < 0:
+        raise ValueError("剧情概要位置无效")
+    if any(not math.isfinite(message.timestamp) for message in record["history"]):
+        raise ValueError("历史记录时间戳无效")
+
+
+def _resume(record: Dict[str, Any]) -> ThemeResponse:
+    """以新的会话ID载入存档中的会话，返回与开始对话相同的格式"""
+    record["session_id"] = str(uuid.uuid4())
+    record["last_accessed"] = datetime.now()
+    # 剧情树可能已经更换，读档后的对话实时生成
+    record["story_node"] = -1
+    session_data = session_manager.add_restored_session(record)
+    last_line = next(
+        (message.content for message in reversed(list(session_data.history)) if message.role == "character"), ""
+    )
+    return ThemeResponse(
+        session_id=session_data.session_id,
+        theme=session_data.theme,
+        initial_dialogue=last_line,
+        choices=[text for text, _ in session_data.offered_choices],
+        affection=session_data.affection
+    )
+
+
+@router.post("/saves")
+async def create_save(request: SaveRequest):
+    """
+    把会话保存到存档槽，同名存档会被覆盖
+    """
+    slot = request.slot or datetime.now().strftime("%Y%m%d-%H%M%S")
+    content = await _dump(request.session_id)
+    try:
+        await asyncio.to_thread(save_slots.save, slot, content)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"保存存档失败: {str(e)}")
+    return {"slot": slot, "size": len(content)}
+
+
+@router.get("/saves")
+async def list_saves():
+    """
+    列出所有存档，按保存时间从新到旧排列
+    """
+    return {"saves": await asyncio.to_thread(save_slots.list)}
+
+
+@router.post("/saves/{slot}/load", response_model=ThemeResponse)
+async def load_save_slot(slot: str):
+    """
+    读取存档，以新的会话继续对话
+    """
+    if not save_slots.valid_name(slot):
+        raise HTTPException(status_code=400, detail="存档名无效")
+    content = await asyncio.to_thread(save_slots.load, slot)
+    if content is None:
+        raise HTTPException(status_code=404, detail="存档不存在")
+    try:
+        _, record = load_save(content)
+        _sanitize(record)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"读取存档失败: {str(e)}")
+    return _resume(record)
+
+
+@router.delete("/saves/{slot}")
+async def delete_save_slot(slot: str):
+    """
+    删除存档
+    """
+    if not save_slots.valid_name(slot):
+        raise HTTPException(status_code=400, detail="存档名无效")
+    if not await asyncio.to_thread(save_slots.delete, slot):
+        raise HTTPException(status_code=404, detail="存档不存在")
+    return {"deleted": slot}
+
+
+@router.get("/session/{session_id}/export")
+async def export_session(session_id: str):
+    """
+    导出会话为存档文件（与存档槽中的文件格式相同）
+    """
+    content = await _dump(session_id)
+    return Response(
+        content, media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="gal-sim-{session_id[:8]}.sav"'}
+    )
+
+
+@router.post("/session/import", response_model=ThemeResponse)
+async def import_session(request: Request):
+    """
+    导入存档文件（请求体为文件内容），以新的会话继续对话
+    """
+    content = await request.body()
+    if len(content) > MAX_IMPORT_BYTES:
+        raise HTTPException(status_code=413, detail="存档文件过大")
+    try:
+        _, record = load_save(content)
+        _sanitize(record)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"导入存档失败: {str(e)}")
+    return _resume(record)
+
+
+def _snapshot_path() -> str:
+    if not SESSION_SNAPSHOT_PATH:
+        raise HTTPException(status_code=400, detail="未配置SESSION_SNAPSHOT_PATH")
+    return SESSION_SNAPSHOT_PATH
+
+
+@router.post("/snapshot")
+async def create_snapshot():
+    """
+    把所有内存中的会话写入全量快照文件（SESSION_SNAPSHOT_PATH）
+    """
+    path = _snapshot_path()
+    try:
+        return await session_manager.snapshot(path)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"写入快照失败: {str(e)}")
+
+
+@router.post("/snapshot/restore")
+async def restore_snapshot():
+    """
+    从全量快照文件恢复会话，已存在和已过期的会话会被跳过
+    """
+    path = _snapshot_path()
+    try:
+        return await session_manager.restore(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="快照文件不存在")
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"恢复快照失败: {str(e)}")
@@ -1,26 +1,91 @@
 """
 Galgame对话模拟器主应用
 """
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, FileResponse
-from .api.dialogue import router as dialogue_router
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from .api.dialogue import router as dialogue_router, dialogue_service
+from .api.background import router as background_router, background_cache
+from .api.batch import router as batch_router
+from .api.metrics import router as metrics_router
+from .api.saves import router as saves_router
+from .services.session_manager import session_manager
+from .services.http_client import close_http_clients, preload_llm_sdk
+from .services.metrics import ServerTimingMiddleware
+from .utils.config import SESSION_SNAPSHOT_PATH
 
-app = FastAPI(title="GAL-SIM", description="基于LLM的Galgame对话模拟器")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动后台任务（会话过期清理、主题预热池等）
+    session_manager.start_sweeper()
+    if SESSION_SNAPSHOT_PATH and os.path.isfile(SESSION_SNAPSHOT_PATH):
+        try:
+            result = await session_manager.restore(SESSION_SNAPSHOT_PATH)
+            logger.info(f"Restored {result['restored']} sessions from {SESSION_SNAPSHOT_PATH}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to restore session snapshot {SESSION_SNAPSHOT_PATH}: {str(e)}")
+    await dialogue_service.startup()
+    background_cache.start()
+    # openai SDK在后台线程中导入，不阻塞启动
+    preload = asyncio.create_task(preload_llm_sdk())
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    await preload
+    if SESSION_SNAPSHOT_PATH:
+        try:
+            await session_manager.snapshot(SESSION_SNAPSHOT_PATH)
+        except OSError as e:
+            logger.error(f"Failed to write session snapshot {SESSION_SNAPSHOT_PATH}: {str(e)}")
+    await dialogue_service.shutdown()
+    await background_cache.stop()
+    await session_manager.stop_sweeper()
+    await close_http_clients()
+
+
+app = FastAPI(title="GAL-SIM", description="基于LLM的Galgame对话模拟器", lifespan=lifespan)
+app.state.ready = False
+
+# 各阶段耗时写入Server-Timing响应头
+app.add_middleware(ServerTimingMiddleware)
 
 # 挂载API路由
 app.include_router(dialogue_router)
+app.include_router(batch_router)
+app.include_router(saves_router)
+app.include_router(background_router)
+app.include_router(metrics_router)
 
 # 挂载静态文件目录
 app.mount("/static", StaticFiles(directory="gal_sim/static"), name="static")
 
-# 配置模板目录
-templates = Jinja2Templates(directory="gal_sim/templates")
+
+@lru_cache(maxsize=None)
+def get_templates():
+    """模板目录，Jinja2在第一次访问页面时才导入"""
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory="gal_sim/templates")
+
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return get_templates().TemplateResponse("index.html", {"request": request})
+
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """就绪检查：启动任务完成后返回200，Electron轮询此接口再加载页面"""
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ok"}
 
 
 @app.get("/favicon.ico", include_in_schema=False)
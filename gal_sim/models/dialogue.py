@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 import uuid
@@ -6,8 +6,9 @@ from enum import Enum
 
 
 class DialogueRequest(BaseModel):
-    """对话请求模型"""
-    user_input: str
+    """对话请求模型，choice_index和user_input至少提供一个"""
+    user_input: Optional[str] = None  # 自由输入的文本
+    choice_index: Optional[int] = Field(None, ge=0, le=3)  # 选择的选项序号，0-3对应A-D
     session_id: Optional[str] = None
     theme: Optional[str] = None
 
@@ -37,9 +38,35 @@ class ThemeResponse(BaseModel):
     affection: int = 50  # 初始好感度为50
 
 
+class BatchItem(BaseModel):
+    """批量请求中的一项：带session_id时继续该会话，否则开始新对话"""
+    id: Optional[str] = None  # 调用方自定义的标识，原样返回
+    session_id: Optional[str] = None
+    user_input: Optional[str] = None
+    choice_index: Optional[int] = Field(None, ge=0, le=3)
+    theme: Optional[str] = None
+    custom_theme: Optional[str] = None  # 仅开始新对话时使用
+
+
+class BatchRequest(BaseModel):
+    """批量请求模型，同一会话的多项按顺序执行，不同会话之间并发执行"""
+    items: List[BatchItem] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, ge=1)  # 同时执行的条数，不超过BATCH_MAX_CONCURRENCY
+
+
+class SaveRequest(BaseModel):
+    """存档请求模型"""
+    session_id: str
+    slot: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,64}$")  # 存档名，为空时按当前时间命名
+
+
 class ChoiceType(Enum):
     """选项类型枚举"""
     PLUS_3 = "PLUS_3"  # 好感度+3
     PLUS_1 = "PLUS_1"  # 好感度+1
     MINUS_1 = "MINUS_1"  # 好感度-1
-    MINUS_3 = "MINUS_3"  # 好感度-3
\ No newline at end of file
+    MINUS_3 = "MINUS_3"  # 好感度-3
+
+
+# 选项A-D对应的好感度变化
+CHOICE_AFFECTION_DELTAS = (3, 1, -1, -3)
@@ -0,0 +1,98 @@
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Optional
+
+
+class Message:
+    """对话历史中的一条消息"""
+    __slots__ = ("role", "content", "timestamp")
+
+    def __init__(self, role: str, content: str, timestamp: float):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp  # Unix时间戳
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content!r}, timestamp={self.timestamp!r})"
+
+    def to_dict(self) -> dict:
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+
+def format_message(message: Message) -> str:
+    """格式化单条消息，用于提供给LLM的上下文"""
+    role = "用户" if message.role == "user" else "角色"
+    return f"{role}: {message.content}"
+
+
+# format_message中角色标签加冒号和空格的长度（"用户: "与"角色: "相同）
+_LABEL_LENGTH = 4
+
+
+class HistoryBuffer:
+    """
+    固定容量的对话历史环形缓冲区
+    写满后新消息直接覆盖最旧的一条，不会重建列表；同时增量维护最近若干条消息
+    格式化后的上下文字符串
+    """
+    __slots__ = ("capacity", "context_entries", "_items", "_start", "_context", "_context_count")
+
+    def __init__(self, capacity: int = 50, messages: Iterable[Message] = (), context_entries: int = 10):
+        self.capacity = max(1, capacity)
+        self.context_entries = max(1, min(context_entries, self.capacity))
+        self._items: List[Message] = []
+        self._start = 0  # 写满后最旧消息的位置
+        self._context: Optional[str] = None  # 首次使用时才构建
+        self._context_count = 0
+        for message in messages:
+            self.append(message)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Message]:
+        items = self._items
+        return chain(islice(items, self._start, None), islice(items, 0, self._start))
+
+    def __getitem__(self, index: int) -> Message:
+        n = len(self._items)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("history index out of range")
+        return self._items[(self._start + index) % n]
+
+    def recent(self, count: int) -> List[Message]:
+        """最近的count条消息，按时间顺序"""
+        n = len(self._items)
+        count = min(count, n)
+        return [self[i] for i in range(n - count, n)]
+
+    def append(self, message: Message):
+        if self._context is not None:
+            self._extend_context(message)
+        items = self._items
+        if len(items) < self.capacity:
+            items.append(message)
+        else:
+            items[self._start] = message
+            self._start = (self._start + 1) % self.capacity
+
+    @property
+    def context(self) -> str:
+        """最近context_entries条消息格式化后的文本"""
+        if self._context is None:
+            recent = self.recent(self.context_entries)
+            self._context = "\n".join(format_message(message) for message in recent)
+            self._context_count = len(recent)
+        return self._context
+
+    def _extend_context(self, message: Message):
+        line = format_message(message)
+        if self._context_count < self.context_entries:
+            self._context = self._context + "\n" + line if self._context_count else line
+            self._context_count += 1
+            return
+        # 去掉上下文中最旧的一行（追加前它是倒数第context_entries条）
+        dropped = self[-self.context_entries]
+        remainder = self._context[_LABEL_LENGTH + len(dropped.content) + 1:]
+        self._context = remainder + "\n" + line if remainder else line
@@ -0,0 +1,121 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from ..utils.config import (
+    ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS
+)
+
+
+class AdmissionRejected(Exception):
+    """队列已满，请求被拒绝"""
+    def __init__(self, retry_after: int):
+        super().__init__(f"服务繁忙，请在{retry_after}秒后重试")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    全局准入控制
+    同时处理的请求数不超过max_concurrent，超出的请求最多排队max_queue个，
+    队列也满时直接拒绝，并根据近期的平均处理时间给出建议的重试间隔
+    """
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.avg_duration = 1.0  # 请求处理时间的指数加权平均（秒）
+        # 统计指标
+        self.admitted = 0
+        self.rejected = 0
+
+    def retry_after(self) -> int:
+        """排在队尾的请求大约需要等待的秒数"""
+        return max(1, math.ceil(self.avg_duration * (self.waiting + 1) / self.max_concurrent))
+
+    async def acquire(self, wait: bool = False):
+        """
+        获取一个处理名额，队列已满时抛出AdmissionRejected；
+        wait为True时不受队列长度限制，一直等到有空闲名额（用于已自行限制并发的调用方，如批量请求）
+        """
+        if not wait and self.semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.retry_after())
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+
+    def release(self, duration: float):
+        """归还处理名额"""
+        self.active -= 1
+        self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        self.semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self, wait: bool = False) -> AsyncIterator[None]:
+        await self.acquire(wait)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_duration": self.avg_duration,
+        }
+
+
+class IdempotencyCache:
+    """
+    幂等键缓存
+    客户端重试时带上相同的Idempotency-Key，直接返回第一次请求的结果；
+    第一次请求仍在处理时，重试的请求等待同一个结果
+    """
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, asyncio.Task]]" = OrderedDict()
+        self.replayed = 0
+
+    async def run(self, scope: str, key: Optional[str], factory) -> Any:
+        """以幂等键执行factory()；key为空时直接执行"""
+        if not key:
+            return await factory()
+
+        entry_key = (scope, key)
+        now = time.time()
+        entry = self._entries.get(entry_key)
+        if entry is not None and entry[0] > now:
+            self.replayed += 1
+            return await asyncio.shield(entry[1])
+
+        # 在独立的任务中执行：第一次请求被取消（客户端断开、超时）时仍会完成，用同一个键重试的请求拿到同一个结果
+        task = asyncio.create_task(factory())
+        task.add_done_callback(lambda done: self._finished(entry_key, done))
+        self._entries[entry_key] = (now + self.ttl, task)
+        self._entries.move_to_end(entry_key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+        return await asyncio.shield(task)
+
+    def _finished(self, entry_key: Tuple[str, str], task: asyncio.Task):
+        # 失败的请求不缓存，允许客户端用同一个键重试；读取异常也避免了无人等待时的警告
+        if task.cancelled() or task.exception() is not None:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[1] is task:
+                del self._entries[entry_key]
@@ -0,0 +1,47 @@
+import json
+import logging
+from typing import Dict
+from ..utils.config import AFFECTION_LEXICON_PATH
+from ..utils.keyword_matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+# 默认词表：关键词 -> 好感度变化
+DEFAULT_AFFECTION_LEXICON: Dict[str, int] = {
+    "好感度 +3": 3, "好感度+3": 3,
+    "好感度 +1": 1, "好感度+1": 1,
+    "好感度 -1": -1, "好感度-1": -1,
+    "好感度 -3": -3, "好感度-3": -3,
+    "亲密": 1, "拥抱": 1, "喜欢": 1, "爱": 1, "支持": 1, "温柔": 1, "关心": 1, "理解": 1,
+    "冷漠": -1, "忽视": -1, "离开": -1, "生气": -1, "愤怒": -1, "讨厌": -1,
+}
+
+# 自由输入的单轮好感度变化范围，与选项A/D一致
+MAX_FREE_TEXT_CHANGE = 3
+
+
+def load_lexicon(path: str = AFFECTION_LEXICON_PATH) -> Dict[str, int]:
+    """读取好感度词表（JSON对象，关键词 -> 好感度变化），路径为空或读取失败时使用默认词表"""
+    if not path:
+        return dict(DEFAULT_AFFECTION_LEXICON)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {str(keyword).lower(): int(change) for keyword, change in json.load(f).items()}
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"Failed to load affection lexicon from {path}, using the default one: {str(e)}")
+        return dict(DEFAULT_AFFECTION_LEXICON)
+
+
+class AffectionScorer:
+    """
+    根据自由输入的文本计算好感度变化
+    词表在启动时编译为一个多关键词匹配器，每轮只需扫描一遍输入；
+    命中的关键词各计一次，总和限制在±MAX_FREE_TEXT_CHANGE之内
+    """
+    def __init__(self, lexicon: Dict[str, int] = None):
+        self.lexicon = load_lexicon() if lexicon is None else {k.lower(): v for k, v in lexicon.items()}
+        self.matcher = KeywordMatcher(self.lexicon)
+
+    def score(self, text: str) -> int:
+        change = sum(self.lexicon[keyword] for keyword in self.matcher.find(text.lower()))
+        return max(-MAX_FREE_TEXT_CHANGE, min(MAX_FREE_TEXT_CHANGE, change))
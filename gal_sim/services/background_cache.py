@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from ..utils.config import (
+    BACKGROUND_SOURCE_URL, BACKGROUND_CACHE_DIR, BACKGROUND_CACHE_MAX_MB, BACKGROUND_PREFETCH_COUNT,
+    BACKGROUND_REFRESH_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# 图片的Content-Type -> 扩展名
+IMAGE_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+CONTENT_TYPES = {ext: content_type for content_type, ext in IMAGE_EXTENSIONS.items()}
+# 缩小版本的宽度，请求的宽度向上取到其中之一，避免为每种窗口尺寸各生成一份
+VARIANT_WIDTHS = (640, 1280, 1920, 2560)
+# 单张图片的大小上限
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+# 预取失败后的最长等待时间（秒）
+_MAX_RETRY_DELAY = 300
+# 缓存为空时页面请求触发的即时下载：超时时间和失败后多久内不再尝试（秒），离线时不让每次加载页面都等待
+_ON_DEMAND_TIMEOUT = 10
+_ON_DEMAND_BACKOFF = 60
+
+
+def pillow_available() -> bool:
+    return importlib.util.find_spec("PIL") is not None
+
+
+class BackgroundCache:
+    """
+    背景图片的本地磁盘缓存
+    后台从图片API预取prefetch_count张图片，之后每隔refresh_interval换入一张新的并淘汰最久未用的一张；
+    文件以内容哈希命名，总大小超过max_bytes时按最近最少使用淘汰。
+    安装了Pillow时可按窗口宽度生成缩小版本
+    """
+    def __init__(self, directory: str = BACKGROUND_CACHE_DIR, source_url: str = BACKGROUND_SOURCE_URL,
+                 max_bytes: int = int(BACKGROUND_CACHE_MAX_MB * 1024 * 1024),
+                 prefetch_count: int = BACKGROUND_PREFETCH_COUNT,
+                 refresh_interval: int = BACKGROUND_REFRESH_INTERVAL):
+        self.directory = directory
+        self.source_url = source_url
+        self.max_bytes = max_bytes
+        self.prefetch_count = max(0, prefetch_count)
+        self.refresh_interval = max(1, refresh_interval)
+        # 文件名 -> 大小，按最近使用排序（最久未用的在前）
+        self.files: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._fetch_lock = asyncio.Lock()
+        self._variant_lock = asyncio.Lock()
+        self._no_variant: set = set()  # 原图已经不大于目标宽度的(文件名, 宽度)
+        self._on_demand_failed_at = -_ON_DEMAND_BACKOFF
+        # 统计指标
+        self.served = 0
+        self.fetched = 0
+        self.fetch_failures = 0
+        self.evicted = 0
+        self.variants_created = 0
+
+    @staticmethod
+    def is_variant(name: str) -> bool:
+        return name.count(".") > 1
+
+    def originals(self) -> List[str]:
+        return [name for name in self.files if not self.is_variant(name)]
+
+    def _scan(self):
+        """读取磁盘上已有的图片，按修改时间作为最近使用顺序"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.rsplit(".", 1)[-1] in CONTENT_TYPES:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self.files[name] = size
+            self.total_bytes += size
+        self._enforce_limit()
+
+    def start(self):
+        """加载已缓存的图片并启动后台预取"""
+        try:
+            self._scan()
+        except OSError as e:
+            logger.error(f"Background cache directory {self.directory} is not usable: {str(e)}")
+            return
+        if self.prefetch_count and self.source_url and self._task is None:
+            self._task = asyncio.create_task(self._prefetch_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(30, connect=5), follow_redirects=True,
+                headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) GAL-SIM"}
+            )
+        return self._client
+
+    def _write(self, name: str, content: bytes):
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _add(self, name: str, size: int):
+        self.files[name] = size
+        self.total_bytes += size
+        self._enforce_limit(keep=name)
+
+    def _remove(self, name: str):
+        size = self.files.pop(name, None)
+        if size is None:
+            return
+        self.total_bytes -= size
+        self.evicted += 1
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError as e:
+            logger.warning(f"Failed to remove cached background {name}: {str(e)}")
+
+    def _enforce_limit(self, keep: str = None):
+        """总大小超过上限时淘汰最久未用的文件"""
+        for name in list(self.files):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if name != keep:
+                self._remove(name)
+
+    def _touch(self, name: str):
+        self.files.move_to_end(name)
+
+    async def fetch(self) -> Optional[str]:
+        """从图片API下载一张图片，返回缓存中的文件名；与已缓存的图片内容相同时返回None"""
+        response = await self._get_client().get(self.source_url)
+        response.raise_for_status()
+        content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+        ext = IMAGE_EXTENSIONS.get(content_type)
+        if ext is None:
+            raise ValueError(f"图片API返回的不是图片: {content_type or '未知类型'}")
+        content = response.content
+        if len(content) > MAX_IMAGE_BYTES:
+            raise ValueError(f"图片过大: {len(content)}字节")
+        name = f"{hashlib.sha256(content).hexdigest()[:20]}.{ext}"
+        if name in self.files:
+            self._touch(name)
+            return None
+        await asyncio.to_thread(self._write, name, content)
+        self.fetched += 1
+        self._add(name, len(content))
+        return name
+
+    def _rotate(self):
+        """原图数量超过prefetch_count时淘汰最久未用的原图"""
+        originals = self.originals()
+        for name in originals[:max(0, len(originals) - self.prefetch_count)]:
+            self._remove(name)
+
+    async def _prefetch_loop(self):
+        # httpx在线程中导入，不阻塞启动
+        await asyncio.to_thread(importlib.import_module, "httpx")
+        delay = 5
+        while True:
+            try:
+                count = len(self.originals())
+                if count < self.prefetch_count:
+                    await self.fetch()
+                    delay = 5
+                    if len(self.originals()) > count:
+                        continue
+                    # 图片API返回了已有的图片，或大小上限容不下更多图片，之后按轮换间隔补充
+                await asyncio.sleep(self.refresh_interval)
+                if await self.fetch() is not None:
+                    self._rotate()
+                delay = 5
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.fetch_failures += 1
+                logger.warning(f"Failed to prefetch background image: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _MAX_RETRY_DELAY)
+
+    async def pick(self) -> Optional[str]:
+        """随机选一张缓存的原图；缓存为空时（首次启动）立即下载一张，离线时返回None"""
+        originals = self.originals()
+        if originals:
+            return random.choice(originals)
+        if not self.source_url or time.monotonic() - self._on_demand_failed_at < _ON_DEMAND_BACKOFF:
+            return None
+        async with self._fetch_lock:
+            originals = self.originals()
+            if originals:
+                return originals[0]
+            try:
+                return await asyncio.wait_for(self.fetch(), _ON_DEMAND_TIMEOUT) or next(iter(self.originals()), None)
+            except Exception as e:
+                self.fetch_failures += 1
+                self._on_demand_failed_at = time.monotonic()
+                logger.warning(f"Failed to fetch background image: {str(e)}")
+                return None
+
+    def path(self, name: str) -> Optional[str]:
+        """缓存中文件的路径，不存在时返回None；同时记为最近使用"""
+        if name not in self.files:
+            return None
+        self._touch(name)
+        self.served += 1
+        return os.path.join(self.directory, name)
+
+    def _resize(self, name: str, width: int, variant: str) -> bool:
+        from PIL import Image
+        with Image.open(os.path.join(self.directory, name)) as image:
+            if image.width <= width:
+                return False
+            height = round(image.height * width / image.width)
+            image = image.convert("RGB").resize((width, height), Image.LANCZOS)
+            tmp_path = os.path.join(self.directory, f"{variant}.tmp")
+            image.save(tmp_path, "JPEG", quality=85, optimize=True, progressive=True)
+        os.replace(tmp_path, os.path.join(self.directory, variant))
+        return True
+
+    async def variant(self, name: str, width: int) -> str:
+        """
+        适合该窗口宽度的版本：宽度向上取到VARIANT_WIDTHS之一，按需生成缩小的JPEG；
+        没有安装Pillow、原图为GIF或原图不够大时返回原图
+        """
+        width = next((w for w in VARIANT_WIDTHS if w >= width), VARIANT_WIDTHS[-1])
+        stem, ext = name.rsplit(".", 1)
+        variant = f"{stem}.w{width}.jpg"
+        if variant in self.files:
+            return variant
+        if ext == "gif" or (name, width) in self._no_variant or not pillow_available():
+            return name
+        async with self._variant_lock:
+            if variant in self.files:
+                return variant
+            try:
+                created = await asyncio.to_thread(self._resize, name, width, variant)
+            except Exception as e:
+                logger.warning(f"Failed to resize background {name}: {str(e)}")
+                created = False
+            if not created:
+                self._no_variant.add((name, width))
+                return name
+            self.variants_created += 1
+            self._add(variant, os.path.getsize(os.path.join(self.directory, variant)))
+            return variant
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "images": len(self.originals()),
+            "variants": len(self.files) - len(self.originals()),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "served": self.served,
+            "fetched": self.fetched,
+            "fetch_failures": self.fetch_failures,
+            "evicted": self.evicted,
+            "variants_created": self.variants_created,
+            "resize_available": pillow_available(),
+        }
@@ -1,10 +1,15 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple
 from .llm_service import LLMService
-from .session_manager import session_manager, SessionData
-import logging
+from .session_manager import session_manager, SessionData, SessionEvicted, SessionNotFound
+from .speculation import SpeculativeGenerator
+from .theme_pool import ThemePool
+from .summarizer import HistorySummarizer
+from .affection import AffectionScorer
+from .metrics import timed_lock
+from .story_tree import NO_CHILD, StoryTree
+from ..utils.config import STORY_TREE_PATH
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import re
+import logging
 
 logger = logging.getLogger(__name__)
 
@@ -12,30 +17,102 @@ logger = logging.getLogger(__name__)
 class DialogueService:
     def __init__(self):
         self.llm_service = LLMService()
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.speculator = SpeculativeGenerator(self.llm_service)
+        # 会话不再可用时取消为它推测生成的分支
+        session_manager.on_remove.append(self.speculator.discard)
+        self.theme_pool = ThemePool(self.llm_service)
+        self.summarizer = HistorySummarizer(self.llm_service)
+        self.affection_scorer = AffectionScorer()
+        self.story_tree: Optional[StoryTree] = None
+        # 进行中的对话轮次，(会话ID, 用户输入或选项序号) -> 结果，重复提交的同一轮次共用一次LLM调用
+        self._inflight_turns: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.deduplicated_turns = 0
+
+    async def startup(self):
+        """应用启动时调用，加载剧情树并启动后台任务"""
+        if STORY_TREE_PATH:
+            try:
+                self.story_tree = StoryTree(STORY_TREE_PATH)
+                logger.info(f"Loaded story tree '{self.story_tree.theme}' with {self.story_tree.node_count} nodes")
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load story tree {STORY_TREE_PATH}: {str(e)}")
+        self.theme_pool.start()
+
+    async def shutdown(self):
+        """应用关闭时调用，停止后台任务"""
+        await self.theme_pool.stop()
+        if self.story_tree is not None:
+            self.story_tree.close()
+            self.story_tree = None
+
+    async def _resolve_theme(self, theme: str = None, custom_theme: str = None) -> str:
+        """确定主题"""
+        if custom_theme:
+            return custom_theme
+        if theme == "auto" or not theme:
+            return await self.llm_service.generate_theme()
+        return theme
+
+    def _pop_pooled_bundle(self, theme: str = None, custom_theme: str = None) -> Dict[str, Any]:
+        """
+        尝试取出现成的主题和开场白：自动主题或与剧情树相同的主题时使用剧情树的开场白，
+        其次在自动主题时从预热池中取出
+        """
+        tree = self.story_tree
+        if tree is not None and (custom_theme or theme or "auto") in (tree.theme, "auto"):
+            node = tree.node(0)
+            return {"theme": tree.theme, "dialogue": node["text"], "choices": node["choices"], "story_node": 0}
+        if custom_theme or (theme and theme != "auto"):
+            return None
+        return self.theme_pool.pop()
+
+    def _story_response(self, session_data: SessionData, chosen: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        用户的选择在剧情树上时直接返回预先生成的回应，并移动到对应节点；
+        否则离开剧情树（之后的轮次都实时生成），返回None
+        """
+        if self.story_tree is None or session_data.story_node < 0:
+            return None
+        child = NO_CHILD if chosen is None else self.story_tree.child(session_data.story_node, chosen)
+        session_data.story_node = child
+        if child == NO_CHILD:
+            return None
+        node = self.story_tree.node(child)
+        return {"response": node["text"], "choices": node["choices"]}
+
+    def _unprepared_choices(self, session_data: SessionData, choices: List[str]) -> List[str]:
+        """剧情树上没有对应节点的选项，只对这些选项做推测生成"""
+        if self.story_tree is None or session_data.story_node < 0:
+            return choices
+        children = self.story_tree.children(session_data.story_node)
+        return [choice if children[i] == NO_CHILD else "" for i, choice in enumerate(choices[:4])]
 
     async def start_new_dialogue(self, session_id: str, theme: str = None, custom_theme: str = None) -> Dict[str, Any]:
         """开始新的对话"""
         try:
-            # 确定主题
-            if custom_theme:
-                final_theme = custom_theme
-            elif theme == "auto" or not theme:
-                final_theme = self.llm_service.generate_theme()
+            bundle = self._pop_pooled_bundle(theme, custom_theme)
+            if bundle:
+                final_theme = bundle["theme"]
+                dialogue_data = bundle
             else:
-                final_theme = theme
-            
-            # 生成初始对话
-            dialogue_data = self.llm_service.generate_initial_dialogue(final_theme)
+                final_theme = await self._resolve_theme(theme, custom_theme)
+                
+                # 生成初始对话
+                dialogue_data = await self.llm_service.generate_initial_dialogue(final_theme)
             
             # 创建会话
             session_data = await session_manager.create_session(session_id, final_theme)
+            session_data.story_node = dialogue_data.get("story_node", NO_CHILD)
             
             # 添加初始对话到历史记录
             session_data.add_message("character", dialogue_data["dialogue"])
             
             logger.info(f"Started new dialogue session: {session_id} with theme: {final_theme}")
             
+            session_data.offer_choices(dialogue_data["choices"])
+            
+            self.speculator.schedule(session_data, self._unprepared_choices(session_data, dialogue_data["choices"]))
+            
             return {
                 "theme": final_theme,
                 "initial_dialogue": dialogue_data["dialogue"],
@@ -46,66 +123,235 @@ class DialogueService:
             logger.error(f"Error starting dialogue: {str(e)}")
             raise
 
-    async def continue_dialogue(self, session_id: str, user_input: str, theme: str = None) -> Dict[str, Any]:
-        """继续对话"""
+    async def stream_new_dialogue(self, session_id: str, theme: str = None, custom_theme: str = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """流式开始新的对话，依次产出meta、若干delta和done事件"""
         try:
-            # 获取会话
-            session_data = await session_manager.get_session(session_id)
-            if not session_data:
-                raise ValueError(f"Session {session_id} not found or expired")
-            
-            # 如果提供了新的主题，更新会话
-            if theme and session_data.theme != theme:
-                session_data.theme = theme
-            
-            # 计算好感度变化
-            affection_change = self._calculate_affection_change(user_input)
-            session_data.update_affection(affection_change)
+            bundle = self._pop_pooled_bundle(theme, custom_theme)
+            if bundle:
+                final_theme = bundle["theme"]
+                dialogue_data = bundle
+                yield "meta", {"session_id": session_id, "theme": final_theme}
+                yield "delta", {"text": dialogue_data["dialogue"]}
+            else:
+                final_theme = await self._resolve_theme(theme, custom_theme)
+                yield "meta", {"session_id": session_id, "theme": final_theme}
+                
+                dialogue_data = None
+                async for event, payload in self.llm_service.stream_initial_dialogue(final_theme):
+                    if event == "delta":
+                        yield "delta", {"text": payload}
+                    else:
+                        dialogue_data = payload
             
-            # 添加用户输入到历史记录
-            session_data.add_message("user", user_input)
+            session_data = await session_manager.create_session(session_id, final_theme)
+            session_data.story_node = dialogue_data.get("story_node", NO_CHILD)
+            session_data.add_message("character", dialogue_data["dialogue"])
             
-            # 获取AI回应
-            response_data = self.llm_service.generate_response(
-                session_data.theme,
-                session_data.history,
-                user_input
-            )
+            logger.info(f"Started new streaming dialogue session: {session_id} with theme: {final_theme}")
             
-            # 添加AI回应到历史记录
-            session_data.add_message("character", response_data["response"])
+            session_data.offer_choices(dialogue_data["choices"])
             
-            logger.info(f"Continued dialogue for session: {session_id}")
+            self.speculator.schedule(session_data, self._unprepared_choices(session_data, dialogue_data["choices"]))
             
-            return {
-                "character_response": response_data["response"],
-                "choices": response_data["choices"],
+            yield "done", {
+                "session_id": session_id,
+                "theme": final_theme,
+                "initial_dialogue": dialogue_data["dialogue"],
+                "choices": dialogue_data["choices"],
                 "affection": session_data.affection
             }
         except Exception as e:
-            logger.error(f"Error continuing dialogue: {str(e)}")
+            logger.error(f"Error starting streaming dialogue: {str(e)}")
             raise
 
-    def _calculate_affection_change(self, user_choice: str) -> int:
-        """根据用户选择计算好感度变化"""
-        # 检查选项文本中是否包含好感度变化的标记
-        if "A" in user_choice or "好感度 +3" in user_choice:
-            return 3
-        elif "B" in user_choice or "好感度 +1" in user_choice:
-            return 1
-        elif "C" in user_choice or "好感度 -1" in user_choice:
-            return -1
-        elif "D" in user_choice or "好感度 -3" in user_choice:
-            return -3
+    async def _get_session(self, session_id: str) -> SessionData:
+        """获取会话，不存在或已过期时抛出SessionNotFound，因内存压力被淘汰时抛出SessionEvicted"""
+        session_data = await session_manager.get_session(session_id)
+        if not session_data:
+            if session_manager.was_evicted(session_id):
+                raise SessionEvicted(session_id)
+            raise SessionNotFound(session_id)
+        return session_data
+
+    def _record_choice(self, session_data: SessionData, user_input: Optional[str], theme: str = None,
+                       choice_index: Optional[int] = None) -> Tuple[str, Optional[int]]:
+        """
+        记录用户的选择，返回(选择的文本, 对应的选项序号)，自由输入的文本不是提供的选项时序号为None；
+        需在持有会话锁时调用
+        """
+        # 如果提供了新的主题，更新会话
+        if theme and session_data.theme != theme:
+            session_data.theme = theme
+        
+        # 计算好感度变化：按序号选择时直接查表，自由输入的文本与提供的选项相同时也按选项计算
+        offered = session_data.offered_choices
+        if choice_index is not None:
+            if choice_index >= len(offered) or not offered[choice_index][0]:
+                raise ValueError(f"选项{choice_index}不存在")
+            user_input, affection_change = offered[choice_index]
         else:
-            # 如果没有明确标记，尝试通过关键词判断
-            lower_choice = user_choice.lower()
-            if any(keyword in lower_choice for keyword in ["亲密", "拥抱", "喜欢", "爱", "支持", "温柔", "关心", "理解"]):
-                return 1
-            elif any(keyword in lower_choice for keyword in ["冷漠", "忽视", "忽视", "离开", "忽视", "生气", "愤怒", "讨厌"]):
-                return -1
+            choice_index = next((i for i, (text, _) in enumerate(offered) if text == user_input), None)
+            if choice_index is not None:
+                affection_change = offered[choice_index][1]
             else:
-                return 0  # 无变化
+                affection_change = self.affection_scorer.score(user_input)
+        session_data.update_affection(affection_change)
+        
+        # 添加用户输入到历史记录
+        session_data.add_message("user", user_input)
+        return user_input, choice_index
+
+    @staticmethod
+    def _turn_key(user_input: Optional[str], choice_index: Optional[int]) -> str:
+        return f"#{choice_index}" if choice_index is not None else user_input
+
+    def _register_turn(self, key: Tuple[str, str], future: asyncio.Future):
+        """登记进行中的对话轮次，完成后自动移除"""
+        self._inflight_turns[key] = future
+        future.add_done_callback(lambda done: self._release_turn(key, done))
+
+    def _release_turn(self, key: Tuple[str, str], future: asyncio.Future):
+        if self._inflight_turns.get(key) is future:
+            del self._inflight_turns[key]
+
+    async def continue_dialogue(self, session_id: str, user_input: Optional[str], theme: str = None,
+                                choice_index: Optional[int] = None) -> Dict[str, Any]:
+        """继续对话，重复提交的同一轮次会等待并共用进行中的结果"""
+        key = (session_id, self._turn_key(user_input, choice_index))
+        while True:
+            shared = self._inflight_turns.get(key)
+            if shared is None:
+                # 轮次在独立的任务中执行：发起的请求被取消（客户端断开、超时）时轮次仍会完成，重试的请求拿到同一个结果
+                shared = asyncio.create_task(self._continue_dialogue(session_id, user_input, theme, choice_index))
+                # 发起的请求已被取消且没有重复请求时，由此读取异常，避免未取回异常的警告
+                shared.add_done_callback(lambda task: task.cancelled() or task.exception())
+                self._register_turn(key, shared)
+            else:
+                self.deduplicated_turns += 1
+            result = await asyncio.shield(shared)
+            if result is not None:
+                return dict(result)
+            # 进行中的流式轮次被中断（结果为None），重新执行本轮
+
+    async def _continue_dialogue(self, session_id: str, user_input: Optional[str], theme: str = None,
+                                 choice_index: Optional[int] = None) -> Dict[str, Any]:
+        try:
+            session_data = await self._get_session(session_id)
+            
+            # 同一会话的对话轮次串行执行，保证历史记录和好感度的一致
+            async with timed_lock(session_data.lock):
+                user_input, chosen = self._record_choice(session_data, user_input, theme, choice_index)
+                
+                # 获取AI回应，优先使用剧情树和推测生成的结果
+                response_data = self._story_response(session_data, chosen)
+                if response_data is None:
+                    response_data = await self.speculator.take(session_data)
+                if response_data is None:
+                    response_data = await self.llm_service.generate_response(
+                        session_data.theme,
+                        session_data.unsummarized_history(),
+                        user_input,
+                        session_data.summary
+                    )
+                
+                # 添加AI回应到历史记录
+                session_data.add_message("character", response_data["response"])
+                
+                logger.info(f"Continued dialogue for session: {session_id}")
+                
+                session_data.offer_choices(response_data["choices"])
+                
+                self.speculator.schedule(session_data, self._unprepared_choices(session_data, response_data["choices"]))
+                if session_data.story_node == NO_CHILD:
+                    # 剧情树上的轮次不需要概要，离开剧情树后再补上
+                    self.summarizer.maybe_schedule(session_data)
+                
+                return {
+                    "character_response": response_data["response"],
+                    "choices": response_data["choices"],
+                    "affection": session_data.affection
+                }
+        except Exception as e:
+            logger.error(f"Error continuing dialogue: {str(e)}")
+            raise
+
+    async def stream_dialogue(self, session_id: str, user_input: Optional[str], theme: str = None,
+                              choice_index: Optional[int] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """流式继续对话，先产出若干delta事件，最后产出done事件"""
+        key = (session_id, self._turn_key(user_input, choice_index))
+        while True:
+            shared = self._inflight_turns.get(key)
+            if shared is None:
+                break
+            self.deduplicated_turns += 1
+            result = await asyncio.shield(shared)
+            if result is not None:
+                yield "delta", {"text": result["character_response"]}
+                yield "done", {"session_id": session_id, **result}
+                return
+        # 流式轮次由客户端驱动，不能脱离请求执行；被中断时以None结束，等待中的重复请求据此重新执行本轮
+        future = asyncio.get_running_loop().create_future()
+        self._register_turn(key, future)
+        result = None
+        try:
+            async for event, payload in self._stream_dialogue(session_id, user_input, theme, choice_index):
+                if event == "done":
+                    result = {name: value for name, value in payload.items() if name != "session_id"}
+                yield event, payload
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 标记为已读取，避免没有重复请求时的警告
+            raise
+        finally:
+            if not future.done():
+                future.set_result(result)
+
+    async def _stream_dialogue(self, session_id: str, user_input: Optional[str], theme: str = None,
+                               choice_index: Optional[int] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        try:
+            session_data = await self._get_session(session_id)
+            
+            async with timed_lock(session_data.lock):
+                user_input, chosen = self._record_choice(session_data, user_input, theme, choice_index)
+                
+                response_data = self._story_response(session_data, chosen)
+                if response_data is None:
+                    response_data = await self.speculator.take(session_data)
+                if response_data is not None:
+                    # 剧情树或推测生成已有结果，一次性发送
+                    yield "delta", {"text": response_data["response"]}
+                else:
+                    async for event, payload in self.llm_service.stream_response(
+                        session_data.theme,
+                        session_data.unsummarized_history(),
+                        user_input,
+                        session_data.summary
+                    ):
+                        if event == "delta":
+                            yield "delta", {"text": payload}
+                        else:
+                            response_data = payload
+                
+                session_data.add_message("character", response_data["response"])
+                
+                logger.info(f"Continued streaming dialogue for session: {session_id}")
+                
+                session_data.offer_choices(response_data["choices"])
+                
+                self.speculator.schedule(session_data, self._unprepared_choices(session_data, response_data["choices"]))
+                if session_data.story_node == NO_CHILD:
+                    # 剧情树上的轮次不需要概要，离开剧情树后再补上
+                    self.summarizer.maybe_schedule(session_data)
+                
+                yield "done", {
+                    "session_id": session_id,
+                    "character_response": response_data["response"],
+                    "choices": response_data["choices"],
+                    "affection": session_data.affection
+                }
+        except Exception as e:
+            logger.error(f"Error continuing streaming dialogue: {str(e)}")
+            raise
 
     async def get_session_data(self, session_id: str) -> Dict[str, Any]:
         """获取会话数据"""
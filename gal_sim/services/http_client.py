@@ -0,0 +1,91 @@
+import asyncio
+import importlib
+import importlib.util
+import logging
+import sys
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from ..utils.config import (
+    LLM_API_KEY, LLM_BASE_URL, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_WRITE_TIMEOUT, LLM_POOL_TIMEOUT,
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY, LLM_HTTP2
+)
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# 进程内共用的HTTP客户端和按(endpoint, api_key)复用的LLM客户端
+_http_client: Optional["httpx.AsyncClient"] = None
+_llm_clients: Dict[Tuple[str, str], "AsyncOpenAI"] = {}
+
+# openai SDK导入耗时较长（数百毫秒），推迟到第一次使用时导入，不拖慢应用启动
+_SDK_MODULES = ("httpx", "openai")
+
+
+def _llm_timeout() -> "httpx.Timeout":
+    import httpx
+    return httpx.Timeout(
+        connect=LLM_CONNECT_TIMEOUT, read=LLM_READ_TIMEOUT, write=LLM_WRITE_TIMEOUT, pool=LLM_POOL_TIMEOUT
+    )
+
+
+def llm_sdk_loaded() -> bool:
+    return all(name in sys.modules for name in _SDK_MODULES)
+
+
+async def preload_llm_sdk():
+    """在线程中导入openai SDK，避免第一次LLM请求时在事件循环里同步导入"""
+    if not llm_sdk_loaded():
+        await asyncio.to_thread(lambda: [importlib.import_module(name) for name in _SDK_MODULES])
+
+
+def _http2_available() -> bool:
+    if not LLM_HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.info("h2 is not installed, LLM requests will use HTTP/1.1")
+        return False
+    return True
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """获取进程内共用的HTTP客户端，连接池和keep-alive连接在所有LLM请求之间复用"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        import httpx
+        _http_client = httpx.AsyncClient(
+            http2=_http2_available(),
+            timeout=_llm_timeout(),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _http_client
+
+
+def get_llm_client(base_url: str = LLM_BASE_URL, api_key: str = LLM_API_KEY) -> "AsyncOpenAI":
+    """获取指定endpoint的LLM客户端，同一endpoint只创建一次并共用HTTP连接池"""
+    key = (base_url or "", api_key or "")
+    client = _llm_clients.get(key)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = _llm_clients[key] = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url or None,
+            timeout=_llm_timeout(),
+            max_retries=0,  # 重试由LLMRouter负责，以便失败后换一个endpoint
+            http_client=get_http_client(),
+        )
+    return client
+
+
+async def close_http_clients():
+    """关闭共用的HTTP客户端，应用关闭时调用"""
+    global _http_client
+    _llm_clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
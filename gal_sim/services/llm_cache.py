@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from ..utils.config import LLM_CACHE_ENABLED, LLM_CACHE_SIZE, LLM_CACHE_TTL, LLM_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# 参与缓存键计算的请求参数
+_KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "response_format")
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """根据请求参数计算内容寻址的缓存键"""
+    material = {name: params.get(name) for name in _KEY_FIELDS}
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    LLM响应缓存
+    内存中是带过期时间的LRU，可选的磁盘层（SQLite）在内存未命中时查询，
+    进程重启后仍然有效，也可用于在测试中回放录制的会话
+    """
+    def __init__(self, enabled: bool = LLM_CACHE_ENABLED, max_size: int = LLM_CACHE_SIZE,
+                 ttl: int = LLM_CACHE_TTL, path: str = LLM_CACHE_PATH):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()  # 磁盘操作在线程池中执行，共用同一个连接
+        if enabled and path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, content TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        # 统计指标
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期时返回None"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            del self._memory[key]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[1]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, content: str):
+        """写入缓存"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, content)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, content, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存的统计信息"""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._memory),
+            "max_size": self.max_size,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "disk": bool(self._db is not None),
+        }
+
+    def _remember(self, key: str, expires_at: float, content: str):
+        self._memory[key] = (expires_at, content)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT expires_at, content FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] <= now:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            return row
+
+    def _disk_set(self, key: str, content: str, expires_at: float):
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, content, expires_at) VALUES (?, ?, ?)",
+                    (key, content, expires_at)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write LLM cache entry: {str(e)}")
@@ -0,0 +1,173 @@
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+from ..utils.config import LLM_PROFILES, LLM_FAST_MODEL, LLM_LATENCY_SLO, LLM_FALLBACK_COOLDOWN
+from .metrics import record_fallback
+
+logger = logging.getLogger(__name__)
+
+# 各类请求的默认参数：主题是很短的创意文本，剧情概要需要稳定
+DEFAULT_PROFILES = {
+    "theme": {"max_tokens": 100, "temperature": 0.8},
+    "initial": {"max_tokens": 500, "temperature": 0.7},
+    "response": {"max_tokens": 500, "temperature": 0.7},
+    "summary": {"max_tokens": 300, "temperature": 0.3},
+}
+# 模型延迟的指数加权平均系数
+_LATENCY_ALPHA = 0.2
+
+
+def model_label(model: Optional[str]) -> str:
+    """统计和指标中模型的名称，default表示使用endpoint配置的模型"""
+    return model or "default"
+
+
+class ModelStats:
+    """一个模型在某类请求上的用量和延迟"""
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency: Optional[float] = None  # 首token耗时（非流式为总耗时）的指数加权平均（秒）
+        self.samples = deque(maxlen=200)
+
+    def observe(self, latency: float, prompt_tokens: int, completion_tokens: int):
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.latency = latency if self.latency is None else (1 - _LATENCY_ALPHA) * self.latency + _LATENCY_ALPHA * latency
+        self.samples.append(latency)
+
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency": self.latency,
+            "p95": ordered[max(0, int(len(ordered) * 0.95) - 1)] if ordered else None,
+        }
+
+
+class ModelProfile:
+    """
+    一类LLM请求（主题、开场白、回应、剧情概要）使用的模型和补全参数
+    model为空时使用各endpoint自己的模型；设置了fallback_model和latency_slo时，主模型近期的首token耗时
+    （非流式为总耗时）超过latency_slo后改用备用模型，cooldown秒后放一个请求回主模型探测，恢复则切回
+    """
+    def __init__(self, operation: str, model: str = None, temperature: float = 0.7, max_tokens: int = 500,
+                 fallback_model: str = None, latency_slo: float = LLM_LATENCY_SLO,
+                 cooldown: float = LLM_FALLBACK_COOLDOWN):
+        self.operation = operation
+        self.model = model or None
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.fallback_model = fallback_model if fallback_model and fallback_model != model else None
+        self.latency_slo = latency_slo
+        self.cooldown = cooldown
+        self.degraded_until: Optional[float] = None  # 不为None时正在使用备用模型
+        self.probing = False  # 是否有探测请求正在发往主模型
+        self.models: Dict[str, ModelStats] = {}
+        # 统计指标
+        self.fallbacks = 0
+
+    @property
+    def primary(self) -> str:
+        return model_label(self.model)
+
+    def completion_args(self) -> Dict[str, Any]:
+        return {"max_tokens": self.max_tokens, "temperature": self.temperature}
+
+    def choose(self) -> Optional[str]:
+        """本次请求使用的模型，None表示使用endpoint的模型；降级的冷却时间过后、没有探测请求时选择主模型"""
+        if self.degraded_until is None or (time.monotonic() >= self.degraded_until and not self.probing):
+            return self.model
+        return self.fallback_model
+
+    def start(self, model: Optional[str]):
+        """请求即将发往上游（未命中缓存），降级期间发往主模型的请求是探测请求"""
+        if model == self.model and self.degraded_until is not None:
+            self.probing = True
+
+    def _stats_for(self, model: Optional[str]) -> ModelStats:
+        name = model_label(model)
+        if name not in self.models:
+            self.models[name] = ModelStats()
+        return self.models[name]
+
+    def observe(self, model: Optional[str], latency: float, prompt_tokens: int, completion_tokens: int):
+        """记录一次成功的请求，主模型超出延迟目标时切换到备用模型"""
+        stats = self._stats_for(model)
+        if model == self.model and self.probing:
+            # 探测请求的耗时直接作为主模型的新估计，不被降级前的慢请求拖累
+            stats.latency = None
+        stats.observe(latency, prompt_tokens, completion_tokens)
+        if model != self.model or self.fallback_model is None or self.latency_slo <= 0:
+            return
+        self.probing = False
+        if stats.latency > self.latency_slo:
+            if self.degraded_until is None:
+                self.fallbacks += 1
+                record_fallback(self.operation)
+                logger.warning(f"LLM model {self.primary} for {self.operation} exceeded latency SLO "
+                               f"({stats.latency:.2f}s > {self.latency_slo}s), falling back to {self.fallback_model}")
+            self.degraded_until = time.monotonic() + self.cooldown
+        elif self.degraded_until is not None:
+            self.degraded_until = None
+            logger.info(f"LLM model {self.primary} for {self.operation} recovered ({stats.latency:.2f}s)")
+
+    def failed(self, model: Optional[str]):
+        """请求失败或被取消，探测请求失败时继续使用备用模型"""
+        self._stats_for(model).failures += 1
+        if model == self.model and self.probing:
+            self.probing = False
+            self.degraded_until = time.monotonic() + self.cooldown
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.primary,
+            "fallback_model": self.fallback_model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "latency_slo": self.latency_slo,
+            "degraded": self.degraded_until is not None,
+            "fallbacks": self.fallbacks,
+            "models": {name: stats.stats() for name, stats in self.models.items()},
+        }
+
+
+def parse_profiles(raw: str = LLM_PROFILES, fast_model: str = LLM_FAST_MODEL) -> Dict[str, ModelProfile]:
+    """
+    解析LLM_PROFILES配置（JSON对象，键为请求类型），未配置的字段使用默认值；
+    设置了LLM_FAST_MODEL时，主题默认使用它，其余请求默认以它作为备用模型
+    """
+    try:
+        overrides = json.loads(raw) if raw.strip() else {}
+        if not isinstance(overrides, dict):
+            raise ValueError("应为JSON对象")
+        unknown = set(overrides) - set(DEFAULT_PROFILES)
+        if unknown:
+            raise ValueError(f"未知的请求类型 {', '.join(sorted(unknown))}")
+        profiles = {}
+        for operation, defaults in DEFAULT_PROFILES.items():
+            entry = {**defaults, **overrides.get(operation, {})}
+            if operation == "theme":
+                entry.setdefault("model", fast_model)
+            else:
+                entry.setdefault("fallback_model", fast_model)
+            profiles[operation] = ModelProfile(
+                operation,
+                model=entry.get("model"),
+                temperature=float(entry["temperature"]),
+                max_tokens=int(entry["max_tokens"]),
+                fallback_model=entry.get("fallback_model"),
+                latency_slo=float(entry.get("latency_slo", LLM_LATENCY_SLO)),
+                cooldown=float(entry.get("cooldown", LLM_FALLBACK_COOLDOWN)),
+            )
+    except (ValueError, TypeError, AttributeError) as e:
+        raise Exception(f"LLM_PROFILES格式错误: {str(e)}")
+    return profiles
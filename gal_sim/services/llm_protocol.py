@@ -0,0 +1,119 @@
+import json
+from collections import deque
+from typing import Any, Dict
+from ..utils.dialogue_utils import estimate_tokens
+
+# 精简协议：固定的系统提示词（可被上游的前缀缓存复用），每轮只发送主题、对话和玩家的选择；
+# 模型输出短键名的紧凑JSON，解析后映射回dialogue/response和choices
+COMPACT_SYSTEM_PROMPT = (
+    "你是Galgame中的角色。根据主题和对话续写剧情，只输出一行JSON："
+    '{"t":"角色的台词","c":["选项A","选项B","选项C","选项D"]}。'
+    "c是玩家接下来的四个选择，按对好感度的影响排列：A非常符合角色喜好(+3)，B比较符合(+1)，"
+    "C可能让角色不开心(-1)，D严重冒犯角色(-3)。"
+)
+TEXT_KEY = "t"
+CHOICES_KEY = "c"
+
+# 支持结构化输出的endpoint使用JSON Schema约束输出，其余endpoint退回到json_object
+TURN_SCHEMA_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "galgame_turn",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                TEXT_KEY: {"type": "string"},
+                CHOICES_KEY: {"type": "array", "items": {"type": "string"}, "minItems": 4, "maxItems": 4},
+            },
+            "required": [TEXT_KEY, CHOICES_KEY],
+            "additionalProperties": False,
+        },
+    },
+}
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+
+
+def compact_initial_prompt(theme: str) -> str:
+    return f"主题：{theme}\n请写开场白。"
+
+
+def compact_response_prompt(theme: str, history_text: str, user_choice: str) -> str:
+    return f"主题：{theme}\n{history_text}\n玩家选择：{user_choice}"
+
+
+def expand_compact(result: Dict[str, Any], field: str) -> Dict[str, Any]:
+    """把短键名映射回原有的字段名；模型没有遵守短键名时保留原字段"""
+    return {
+        field: result.get(TEXT_KEY, result.get(field)),
+        "choices": result.get(CHOICES_KEY, result.get("choices")),
+    }
+
+
+def verbose_output_tokens(field: str, text: str, choices) -> int:
+    """同样内容按原有协议（长键名、带缩进的JSON）输出时的估算token数"""
+    return estimate_tokens(json.dumps({field: text, "choices": choices}, ensure_ascii=False, indent=2))
+
+
+class AdaptiveMaxTokens:
+    """
+    根据近期实际输出长度调整max_tokens：样本足够后取p95加余量，限制在[floor, ceiling]之间；
+    输出被截断时按当前上限的两倍记一个样本，使上限很快回升
+    """
+    def __init__(self, ceiling: int, floor: int = 128, window: int = 200, min_samples: int = 20,
+                 headroom: float = 1.25, enabled: bool = True):
+        self.ceiling = ceiling
+        self.floor = min(floor, ceiling)
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.enabled = enabled
+        self.samples = deque(maxlen=window)
+        self.current = ceiling
+        # 统计指标
+        self.truncated = 0
+
+    def limit(self) -> int:
+        return self.current if self.enabled else self.ceiling
+
+    def observe(self, completion_tokens: int, truncated: bool = False):
+        if truncated:
+            self.truncated += 1
+            completion_tokens = max(completion_tokens, self.current * 2)
+        self.samples.append(completion_tokens)
+        if len(self.samples) < self.min_samples:
+            return
+        ordered = sorted(self.samples)
+        p95 = ordered[int(len(ordered) * 0.95) - 1]
+        self.current = max(self.floor, min(self.ceiling, int(p95 * self.headroom) + 16))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_tokens": self.limit(),
+            "ceiling": self.ceiling,
+            "samples": len(self.samples),
+            "truncated": self.truncated,
+        }
+
+
+class ProtocolSavings:
+    """精简协议相对原有协议节省的token数（两者都按同一方法估算）"""
+    def __init__(self):
+        self.turns = 0
+        self.input_saved = 0
+        self.output_saved = 0
+
+    def record(self, input_saved: int, output_saved: int):
+        self.turns += 1
+        self.input_saved += input_saved
+        self.output_saved += output_saved
+
+    def stats(self) -> Dict[str, Any]:
+        turns = max(self.turns, 1)
+        return {
+            "turns": self.turns,
+            "input_tokens_saved": self.input_saved,
+            "output_tokens_saved": self.output_saved,
+            "input_tokens_saved_per_turn": round(self.input_saved / turns, 1),
+            "output_tokens_saved_per_turn": round(self.output_saved / turns, 1),
+        }
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+from ..utils.config import (
+    LLM_API_KEY, LLM_BASE_URL, LLM_MODEL, LLM_ENDPOINTS, LLM_MAX_RETRIES, LLM_RETRY_BACKOFF,
+    LLM_ENDPOINT_FAILURE_THRESHOLD, LLM_ENDPOINT_COOLDOWN, LLM_HEDGE_ENABLED, LLM_HEDGE_MIN_DELAY,
+    LLM_STRUCTURED_OUTPUT
+)
+from .http_client import get_llm_client, preload_llm_sdk
+from .llm_protocol import JSON_OBJECT_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# 单次退避等待的上限（秒）
+_MAX_BACKOFF = 10.0
+# 超过这个时间（秒）没有被选中的endpoint会被重新探测一次，避免一次慢请求让它永远不被选中
+_PROBE_INTERVAL = 30.0
+# 计算p95所需的最少样本数，样本不足时不发对冲请求
+_MIN_HEDGE_SAMPLES = 20
+
+
+def is_retryable(error: BaseException) -> bool:
+    """连接错误、超时、限流和上游5xx可以重试，其余错误（如参数错误）重试也不会成功"""
+    import openai
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: BaseException) -> float:
+    """上游通过Retry-After要求的等待时间（秒），没有时为0"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LLMEndpoint:
+    """一个OpenAI兼容的endpoint及其近期的延迟和健康状况"""
+    def __init__(self, base_url: str, api_key: str, model: str, weight: float = 1.0, name: str = None,
+                 structured_output: bool = LLM_STRUCTURED_OUTPUT):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.structured_output = structured_output  # 是否支持JSON Schema结构化输出
+        self.weight = max(weight, 0.01)
+        self.name = name or urlparse(base_url).netloc or base_url
+        self.latency: Optional[float] = None  # 响应耗时的指数加权平均（秒），流式请求按首个分片计
+        self.samples = deque(maxlen=200)  # 近期非流式请求的耗时，用于计算p95
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        # 统计指标
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def client(self):
+        return get_llm_client(self.base_url, self.api_key)
+
+    def request_params(self, params: Dict[str, Any], model: str = None) -> Dict[str, Any]:
+        """
+        发往该endpoint的请求参数：使用指定的模型（为空时使用该endpoint的模型），
+        不支持结构化输出时退回到json_object
+        """
+        params = {**params, "model": model or self.model}
+        response_format = params.get("response_format")
+        if not self.structured_output and response_format and response_format.get("type") == "json_schema":
+            params["response_format"] = JSON_OBJECT_FORMAT
+        return params
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self, now: float) -> float:
+        """选择endpoint时的得分，越小越优先；没有样本或长时间未使用的endpoint优先探测"""
+        if self.latency is None or now - self.last_used > _PROBE_INTERVAL:
+            return -self.weight
+        return self.latency * (1 + self.in_flight) / self.weight
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < _MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def record_success(self, latency: float, sample: bool = False):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if sample:
+            self.samples.append(latency)
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= LLM_ENDPOINT_FAILURE_THRESHOLD:
+            self.cooldown_until = time.monotonic() + LLM_ENDPOINT_COOLDOWN
+            logger.warning(f"LLM endpoint {self.name} failed {self.consecutive_failures} times, cooling down")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "model": self.model,
+            "weight": self.weight,
+            "structured_output": self.structured_output,
+            "healthy": self.available(time.monotonic()),
+            "latency": self.latency,
+            "p95": self.p95(),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+def parse_endpoints(raw: str = LLM_ENDPOINTS) -> List[LLMEndpoint]:
+    """解析LLM_ENDPOINTS配置，为空时使用单个默认endpoint"""
+    if not raw.strip():
+        return [LLMEndpoint(LLM_BASE_URL, LLM_API_KEY, LLM_MODEL)]
+    try:
+        entries = json.loads(raw)
+        endpoints = [
+            LLMEndpoint(
+                entry.get("base_url") or LLM_BASE_URL,
+                entry.get("api_key") or LLM_API_KEY,
+                entry.get("model") or LLM_MODEL,
+                float(entry.get("weight", 1.0)),
+                entry.get("name"),
+                bool(entry.get("structured_output", LLM_STRUCTURED_OUTPUT)),
+            )
+            for entry in entries
+        ]
+    except (ValueError, TypeError, AttributeError) as e:
+        raise Exception(f"LLM_ENDPOINTS格式错误: {str(e)}")
+    if not endpoints:
+        raise Exception("LLM_ENDPOINTS格式错误: 至少需要一个endpoint")
+    return endpoints
+
+
+class LLMRouter:
+    """
+    在多个endpoint之间分发LLM请求
+    优先选择近期延迟最低（按权重和进行中的请求数折算）的endpoint，可重试错误带抖动退避后换一个endpoint重试，
+    连续失败的endpoint暂停使用一段时间；开启对冲后，非流式请求超过该endpoint的p95耗时仍未返回时
+    再向另一个endpoint发一份，取先成功的结果
+    """
+    def __init__(self, endpoints: Iterable[LLMEndpoint] = None, max_retries: int = LLM_MAX_RETRIES,
+                 backoff: float = LLM_RETRY_BACKOFF, hedge: bool = LLM_HEDGE_ENABLED,
+                 hedge_min_delay: float = LLM_HEDGE_MIN_DELAY):
+        self.endpoints = list(endpoints) if endpoints is not None else parse_endpoints()
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        # 统计指标
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def select(self, exclude: Iterable[LLMEndpoint] = ()) -> LLMEndpoint:
+        """选择一个endpoint；所有endpoint都被排除或暂停时，退回到最早恢复的那个"""
+        now = time.monotonic()
+        excluded = set(map(id, exclude))
+        candidates = [e for e in self.endpoints if id(e) not in excluded] or self.endpoints
+        available = [e for e in candidates if e.available(now)]
+        if not available:
+            return min(candidates, key=lambda e: e.cooldown_until)
+        return min(available, key=lambda e: e.score(now))
+
+    def _backoff_delay(self, attempt: int, error: BaseException) -> float:
+        """指数退避加全抖动，上游给出Retry-After时至少等待该时间"""
+        delay = random.uniform(0, min(_MAX_BACKOFF, self.backoff * (2 ** attempt)))
+        return min(_MAX_BACKOFF, max(delay, _retry_after(error)))
+
+    async def _call(self, endpoint: LLMEndpoint, params: Dict[str, Any], model: str = None):
+        endpoint.requests += 1
+        endpoint.in_flight += 1
+        endpoint.last_used = time.monotonic()
+        start = time.monotonic()
+        try:
+            response = await endpoint.client.chat.completions.create(**endpoint.request_params(params, model))
+        except Exception as e:
+            if is_retryable(e):
+                endpoint.record_failure()
+            raise
+        finally:
+            endpoint.in_flight -= 1
+        endpoint.record_success(time.monotonic() - start, sample=True)
+        return response
+
+    async def _hedged_call(self, endpoint: LLMEndpoint, params: Dict[str, Any], model: str = None):
+        """发送请求，超过p95仍未返回时向另一个endpoint再发一份"""
+        p95 = endpoint.p95() if self.hedge else None
+        if p95 is None:
+            return await self._call(endpoint, params, model)
+
+        primary = asyncio.create_task(self._call(endpoint, params, model))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(p95, self.hedge_min_delay))
+            if not done:
+                backup = asyncio.create_task(self._call(self.select(exclude=[endpoint]), params, model))
+                tasks.add(backup)
+                self.hedged += 1
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def complete(self, params: Dict[str, Any], model: str = None):
+        """发送一次非流式补全请求，返回SDK的响应对象；model为空时使用各endpoint的模型"""
+        await preload_llm_sdk()
+        tried: List[LLMEndpoint] = []
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.select(exclude=tried)
+            try:
+                return await self._hedged_call(endpoint, params, model)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                tried.append(endpoint)
+                logger.warning(f"LLM request to {endpoint.name} failed, retrying: {str(e)}")
+                await asyncio.sleep(self._backoff_delay(attempt, e))
+
+    async def stream(self, params: Dict[str, Any], model: str = None) -> AsyncIterator[str]:
+        """发送流式补全请求，逐段产出文本；只有在收到第一个分片之前的失败才会重试"""
+        await preload_llm_sdk()
+        tried: List[LLMEndpoint] = []
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.select(exclude=tried)
+            endpoint.requests += 1
+            endpoint.in_flight += 1
+            endpoint.last_used = time.monotonic()
+            start = time.monotonic()
+            started = False
+            stream = None
+            try:
+                stream = await endpoint.client.chat.completions.create(
+                    stream=True, **endpoint.request_params(params, model)
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not started:
+                            started = True
+                            endpoint.record_success(time.monotonic() - start)
+                        yield delta
+                if not started:
+                    endpoint.record_success(time.monotonic() - start)
+                return
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    endpoint.record_failure()
+                if started or attempt == self.max_retries or not retryable:
+                    raise
+                self.retries += 1
+                tried.append(endpoint)
+                error = e
+                logger.warning(f"LLM stream from {endpoint.name} failed, retrying: {str(e)}")
+            finally:
+                endpoint.in_flight -= 1
+                # 调用方提前关闭生成器（客户端断开、请求被取消）时同样关闭上游连接，不再继续接收生成内容
+                if stream is not None:
+                    await stream.close()
+            await asyncio.sleep(self._backoff_delay(attempt, error))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+            "retries": self.retries,
+            "hedge_enabled": self.hedge,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
@@ -1,39 +1,223 @@
-from openai import OpenAI
-from typing import List, Dict, Any
-from ..utils.config import LLM_API_KEY, LLM_BASE_URL, LLM_MODEL
-from ..utils.dialogue_utils import validate_choices, sanitize_text, ensure_json_format
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Callable, Iterable, List, Dict, Any, AsyncIterator, Tuple, Optional
+from ..utils.config import (
+    LLM_MODEL, LLM_MAX_CONCURRENCY, CONTEXT_TOKEN_BUDGET, LLM_COMPACT_PROTOCOL, LLM_ADAPTIVE_MAX_TOKENS
+)
+from .llm_router import LLMRouter
+from .llm_cache import LLMResponseCache, cache_key
+from .llm_profiles import ModelProfile, model_label, parse_profiles
+from .llm_protocol import (
+    COMPACT_SYSTEM_PROMPT, TEXT_KEY, TURN_SCHEMA_FORMAT, JSON_OBJECT_FORMAT, AdaptiveMaxTokens, ProtocolSavings,
+    compact_initial_prompt, compact_response_prompt, expand_compact, verbose_output_tokens
+)
+from .metrics import record_llm_call, record_tokens, record_tokens_saved, stage
+from ..models.history import Message
+from ..utils.llm_json import loads
+from ..utils.dialogue_utils import (
+    validate_choices, sanitize_text, ensure_json_format, build_dialogue_context, format_dialogue_history,
+    estimate_tokens, JSONFieldStreamer
+)
+
+# 生成对话（开场白/回应）时使用的补全参数，max_tokens和temperature按各请求类型的配置（LLM_PROFILES）
+DIALOGUE_COMPLETION_ARGS = {
+    "response_format": JSON_OBJECT_FORMAT,
+}
+# 精简协议的补全参数：按JSON Schema约束输出（endpoint不支持时由路由退回到json_object）
+COMPACT_COMPLETION_ARGS = {**DIALOGUE_COMPLETION_ARGS, "response_format": TURN_SCHEMA_FORMAT}
+_COMPACT_SYSTEM_TOKENS = estimate_tokens(COMPACT_SYSTEM_PROMPT)
+
+# 累计当前上下文中LLM调用消耗的token数，由调用方设置一个计数字典后生效
+token_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("token_usage", default=None)
+
+
+def _record_usage(operation: str, model: str, response, prompt: str, content: str) -> Tuple[int, int]:
+    """记录一次请求的token用量，并累加到当前上下文的计数字典中，返回(输入token数, 输出token数)"""
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        prompt_tokens, completion_tokens = usage.prompt_tokens or 0, usage.completion_tokens or 0
+    else:
+        # 上游未返回用量（如流式请求）时粗略估算
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+    record_tokens(operation, prompt_tokens, completion_tokens, model)
+    sink = token_usage.get()
+    if sink is not None:
+        sink["total_tokens"] += prompt_tokens + completion_tokens
+    return prompt_tokens, completion_tokens
+
+
+def _is_json_object(content: str) -> bool:
+    """内容是否为完整的JSON对象；解析对话时会修复截断或格式错误的JSON，但这样的响应不应进入缓存"""
+    try:
+        return isinstance(loads(content), dict)
+    except ValueError:
+        return False
+
+
+def _messages(prompt: str, system: Optional[str]) -> List[Dict[str, str]]:
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    return messages
 
 
 class LLMService:
-    def __init__(self):
-        self.client = OpenAI(api_key=LLM_API_KEY)
-        if LLM_BASE_URL:
-            self.client.base_url = LLM_BASE_URL
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, compact: bool = LLM_COMPACT_PROTOCOL,
+                 adaptive_max_tokens: bool = LLM_ADAPTIVE_MAX_TOKENS, profiles: Dict[str, ModelProfile] = None):
+        # 限制同时进行中的请求数，超出的请求在此排队而不是阻塞事件循环
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.cache = LLMResponseCache()
+        self.router = LLMRouter()
+        # 各类请求（主题、开场白、回应、剧情概要）的模型、补全参数和延迟目标
+        self.profiles = profiles if profiles is not None else parse_profiles()
+        # 精简协议：固定的系统提示词、短键名输出和结构化输出
+        self.compact = compact
+        self.savings = ProtocolSavings()
+        # 开场白和回应各自按近期的输出长度调整max_tokens
+        self.max_tokens = {
+            operation: AdaptiveMaxTokens(self.profiles[operation].max_tokens, enabled=adaptive_max_tokens)
+            for operation in ("initial", "response")
+        }
+
+    async def _cache_lookup(self, params: Dict[str, Any], cache: bool) -> Tuple[Optional[str], Optional[str]]:
+        """查询响应缓存，返回(缓存键, 命中的内容)；不使用缓存时键为None"""
+        if not self.cache.enabled:
+            return None, None
+        if not cache:
+            self.cache.bypassed += 1
+            return None, None
+        key = cache_key(params)
+        return key, await self.cache.get(key)
 
-    def generate_theme(self) -> str:
+    def _route(self, profile: ModelProfile, params: Dict[str, Any],
+               key: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        缓存未命中后确定本次请求的模型，返回(模型, 缓存键)；查询缓存期间其他请求可能已成为探测请求，
+        因此重新选择，调用方须紧接着（中间没有await）调用profile.start；模型改变时缓存键随之更新
+        """
+        model = profile.choose()
+        if params["model"] != (model or LLM_MODEL):
+            params["model"] = model or LLM_MODEL
+            if key is not None:
+                key = cache_key(params)
+        return model, key
+
+    async def _complete(self, prompt: str, operation: str, cache: bool = True, system: str = None,
+                        budget: AdaptiveMaxTokens = None, validate: Callable[[str], bool] = None, **kwargs) -> str:
+        """
+        发送一次对话补全请求并返回文本内容；operation决定使用的模型配置，并用于指标的分类，
+        cache为False时不读写响应缓存，指定budget时max_tokens按其当前上限发送（缓存键仍按配置的max_tokens计算）；
+        只有正常结束（finish_reason为stop）且通过validate检查的响应才写入缓存
+        """
+        profile = self.profiles[operation]
+        model = profile.choose()
+        params = {
+            "model": model or LLM_MODEL, "messages": _messages(prompt, system), **profile.completion_args(), **kwargs
+        }
+        key, cached = await self._cache_lookup(params, cache)
+        if cached is not None:
+            return cached
+        model, key = self._route(profile, params, key)
+        if budget is not None:
+            params["max_tokens"] = budget.limit()
+        
+        try:
+            # 包括排队等待并发名额时被取消，探测标记都会在failed中清除
+            profile.start(model)
+            async with self.semaphore:
+                start = time.perf_counter()
+                response = await self.router.complete(params, model)
+                elapsed = time.perf_counter() - start
+        except BaseException:
+            profile.failed(model)
+            raise
+        record_llm_call(operation, elapsed, elapsed, model_label(model))
+        # 直接获取内容并转换为字符串
+        content = response.choices[0].message.content
+        if content is None:
+            profile.failed(model)
+            raise Exception("API返回内容为空")
+        prompt_tokens, completion_tokens = _record_usage(
+            operation, model_label(model), response, f"{system or ''}{prompt}", content
+        )
+        profile.observe(model, elapsed, prompt_tokens, completion_tokens)
+        finish_reason = response.choices[0].finish_reason
+        if budget is not None:
+            budget.observe(completion_tokens, truncated=finish_reason == "length")
+        content = str(content).strip()
+        if key is not None and finish_reason == "stop" and (validate is None or validate(content)):
+            await self.cache.set(key, content)
+        return content
+
+    async def generate_theme(self) -> str:
         """生成对话主题"""
         prompt = """请生成一个适合Galgame对话的有趣主题。主题应该包含场景和人物关系的简要描述。
         例如：'校园恋爱'、'魔法学院的邂逅'、'未来世界的机器人伙伴'等。
         只返回主题名称，不要其他内容。"""
         
         try:
-            response = self.client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=100,
-                temperature=0.8
-            )
-            # 直接获取内容并转换为字符串
-            content = response.choices[0].message.content
-            if content is None:
-                raise Exception("API返回内容为空")
-            return str(content).strip()
+            # 自动主题每次都应不同，不使用缓存
+            return await self._complete(prompt, "theme", cache=False)
         except Exception as e:
             raise Exception(f"生成主题失败: {str(e)}")
 
-    def generate_initial_dialogue(self, theme: str) -> Dict[str, Any]:
-        """根据主题生成初始对话和选项"""
-        prompt = f"""你是Galgame中的角色，现在开始一个关于"{theme}"的对话。
+    async def _stream(self, prompt: str, operation: str, cache: bool = True, system: str = None,
+                      budget: AdaptiveMaxTokens = None, validate: Callable[[str], bool] = None,
+                      **kwargs) -> AsyncIterator[str]:
+        """
+        以流式方式发送补全请求，逐段产出文本；命中缓存时一次产出全部内容
+        流式响应拿不到finish_reason，只有流正常结束且内容通过validate检查时才写入缓存
+        """
+        profile = self.profiles[operation]
+        model = profile.choose()
+        params = {
+            "model": model or LLM_MODEL, "messages": _messages(prompt, system), **profile.completion_args(), **kwargs
+        }
+        key, cached = await self._cache_lookup(params, cache)
+        if cached is not None:
+            yield cached
+            return
+        model, key = self._route(profile, params, key)
+        if budget is not None:
+            params["max_tokens"] = budget.limit()
+        
+        parts = []
+        try:
+            # 包括排队等待并发名额时被取消、客户端断开后生成器被关闭，探测标记都会在failed中清除
+            profile.start(model)
+            async with self.semaphore:
+                start = time.perf_counter()
+                ttft = None
+                upstream = self.router.stream(params, model)
+                try:
+                    async for delta in upstream:
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                        parts.append(delta)
+                        yield delta
+                finally:
+                    # 本生成器被提前关闭时立即关闭上游的流，不等垃圾回收
+                    await upstream.aclose()
+                elapsed = time.perf_counter() - start
+        except BaseException:
+            profile.failed(model)
+            raise
+        ttft = elapsed if ttft is None else ttft
+        record_llm_call(operation, ttft, elapsed, model_label(model))
+        content = "".join(parts).strip()
+        prompt_tokens, completion_tokens = _record_usage(
+            operation, model_label(model), None, f"{system or ''}{prompt}", content
+        )
+        profile.observe(model, ttft, prompt_tokens, completion_tokens)
+        if budget is not None:
+            # 流式响应拿不到finish_reason，JSON没有闭合即视为被截断
+            budget.observe(completion_tokens, truncated=not content.endswith("}"))
+        if key is not None and content and (validate is None or validate(content)):
+            await self.cache.set(key, content)
+
+    def _initial_dialogue_prompt(self, theme: str) -> str:
+        return f"""你是Galgame中的角色，现在开始一个关于"{theme}"的对话。
         请生成一段吸引人的开场白，然后提供四个不同的选择（A、B、C、D）供用户选择。
         每个选项对好感度的影响：
         - 选项A: 好感度+3（非常符合角色喜好）
@@ -52,40 +236,9 @@ class LLMService:
           ]
         }}
         """
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500,
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
-            
-            # 处理响应，确保格式正确
-            raw_response = response.choices[0].message.content
-            if raw_response is None:
-                raise Exception("API返回内容为空")
-            raw_response = str(raw_response).strip()
-            
-            result = ensure_json_format(raw_response)
-            
-            dialogue = sanitize_text(result.get("dialogue", ""))
-            choices = validate_choices(result.get("choices", ["", "", "", ""]))
-            
-            return {
-                "dialogue": dialogue,
-                "choices": choices
-            }
-        except Exception as e:
-            raise Exception(f"生成初始对话失败: {str(e)}")
 
-    def generate_response(self, theme: str, history: List[Dict], user_choice: str) -> Dict[str, Any]:
-        """根据用户选择生成角色回应和新选项"""
-        from ..utils.dialogue_utils import format_dialogue_history
-        history_text = format_dialogue_history(history)
-        
-        prompt = f"""你是一个Galgame中的角色，当前故事主题是"{theme}"。
+    def _response_prompt(self, theme: str, history_text: str, user_choice: str) -> str:
+        return f"""你是一个Galgame中的角色，当前故事主题是"{theme}"。
         对话历史：
         {history_text}
         
@@ -109,30 +262,131 @@ class LLMService:
           ]
         }}
         """
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500,
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
-            
-            # 处理响应，确保格式正确
-            raw_response = response.choices[0].message.content
-            if raw_response is None:
-                raise Exception("API返回内容为空")
-            raw_response = str(raw_response).strip()
-            
-            result = ensure_json_format(raw_response)
-            
-            response_text = sanitize_text(result.get("response", ""))
-            choices = validate_choices(result.get("choices", ["", "", "", ""]))
+
+    def _turn_request(self, theme: str, history: Iterable[Message] = None, user_choice: str = None,
+                      summary: str = "") -> Tuple[str, Optional[str], Dict[str, Any], int]:
+        """
+        构建一轮对话的请求，user_choice为None时为开场白；
+        返回(提示词, 系统提示词, 补全参数, 精简协议下原有提示词的估算token数)
+        """
+        if user_choice is None:
+            legacy_prompt = self._initial_dialogue_prompt(theme)
+            compact_prompt = compact_initial_prompt(theme)
+        else:
+            with stage("prompt_build"):
+                history_text = build_dialogue_context(history, CONTEXT_TOKEN_BUDGET, summary)
+            legacy_prompt = self._response_prompt(theme, history_text, user_choice)
+            compact_prompt = compact_response_prompt(theme, history_text, user_choice)
+        if not self.compact:
+            return legacy_prompt, None, DIALOGUE_COMPLETION_ARGS, 0
+        return compact_prompt, COMPACT_SYSTEM_PROMPT, COMPACT_COMPLETION_ARGS, estimate_tokens(legacy_prompt)
+
+    def _parse_dialogue(self, raw_response: str, field: str) -> Dict[str, Any]:
+        """解析模型返回的JSON，提取指定文本字段和选项"""
+        with stage("parse"):
+            if self.compact:
+                result = expand_compact(ensure_json_format(raw_response, TEXT_KEY), field)
+            else:
+                result = ensure_json_format(raw_response, field)
             
             return {
-                "response": response_text,
-                "choices": choices
+                field: sanitize_text(str(result.get(field) or "")),
+                "choices": validate_choices(result.get("choices") or ["", "", "", ""])
             }
+
+    def _record_savings(self, operation: str, prompt: str, legacy_tokens: int, raw_response: str,
+                        result: Dict[str, Any], field: str):
+        """记录精简协议相对原有协议节省的输入和输出token数"""
+        if not self.compact:
+            return
+        input_saved = legacy_tokens - _COMPACT_SYSTEM_TOKENS - estimate_tokens(prompt)
+        output_saved = verbose_output_tokens(field, result[field], result["choices"]) - estimate_tokens(raw_response)
+        self.savings.record(input_saved, output_saved)
+        record_tokens_saved(operation, input_saved, output_saved)
+
+    async def _generate_turn(self, operation: str, field: str, theme: str, history: Iterable[Message] = None,
+                             user_choice: str = None, summary: str = "") -> Dict[str, Any]:
+        prompt, system, args, legacy_tokens = self._turn_request(theme, history, user_choice, summary)
+        raw_response = await self._complete(
+            prompt, operation, system=system, budget=self.max_tokens[operation], validate=_is_json_object, **args
+        )
+        result = self._parse_dialogue(raw_response, field)
+        self._record_savings(operation, prompt, legacy_tokens, raw_response, result, field)
+        return result
+
+    async def _stream_dialogue(self, operation: str, field: str, theme: str, history: Iterable[Message] = None,
+                               user_choice: str = None, summary: str = "") -> AsyncIterator[Tuple[str, Any]]:
+        """流式生成对话，先逐段产出("delta", 文本)，最后产出("result", 解析结果)"""
+        prompt, system, args, legacy_tokens = self._turn_request(theme, history, user_choice, summary)
+        streamer = JSONFieldStreamer(TEXT_KEY if self.compact else field)
+        parts = []
+        deltas = self._stream(
+            prompt, operation, system=system, budget=self.max_tokens[operation], validate=_is_json_object, **args
+        )
+        async for delta in deltas:
+            parts.append(delta)
+            text = streamer.feed(delta)
+            if text:
+                yield "delta", text
+        raw_response = "".join(parts).strip()
+        result = self._parse_dialogue(raw_response, field)
+        self._record_savings(operation, prompt, legacy_tokens, raw_response, result, field)
+        yield "result", result
+
+    async def generate_initial_dialogue(self, theme: str) -> Dict[str, Any]:
+        """根据主题生成初始对话和选项"""
+        try:
+            return await self._generate_turn("initial", "dialogue", theme)
+        except Exception as e:
+            raise Exception(f"生成初始对话失败: {str(e)}")
+
+    async def stream_initial_dialogue(self, theme: str) -> AsyncIterator[Tuple[str, Any]]:
+        """流式生成初始对话和选项"""
+        try:
+            async for event in self._stream_dialogue("initial", "dialogue", theme):
+                yield event
+        except Exception as e:
+            raise Exception(f"生成初始对话失败: {str(e)}")
+
+    async def generate_response(self, theme: str, history: Iterable[Message], user_choice: str, summary: str = "") -> Dict[str, Any]:
+        """根据用户选择生成角色回应和新选项"""
+        try:
+            return await self._generate_turn("response", "response", theme, history, user_choice, summary)
+        except Exception as e:
+            raise Exception(f"生成对话回应失败: {str(e)}")
+
+    async def stream_response(self, theme: str, history: Iterable[Message], user_choice: str, summary: str = "") -> AsyncIterator[Tuple[str, Any]]:
+        """流式生成角色回应和新选项"""
+        try:
+            async for event in self._stream_dialogue("response", "response", theme, history, user_choice, summary):
+                yield event
+        except Exception as e:
+            raise Exception(f"生成对话回应失败: {str(e)}")
+
+    def protocol_stats(self) -> Dict[str, Any]:
+        return {
+            "compact": self.compact,
+            **self.savings.stats(),
+            "max_tokens": {operation: budget.stats() for operation, budget in self.max_tokens.items()},
+        }
+
+    def profile_stats(self) -> Dict[str, Any]:
+        return {operation: profile.stats() for operation, profile in self.profiles.items()}
+
+    async def summarize_history(self, theme: str, summary: str, history: List[Message]) -> str:
+        """将较早的对话合并进剧情概要"""
+        history_text = format_dialogue_history(history, max_entries=len(history))
+        prompt = f"""你在为一个主题为"{theme}"的Galgame整理剧情概要。
+        已有的剧情概要：
+        {summary or "（无）"}
+        
+        新的对话：
+        {history_text}
+        
+        请把新的对话合并进剧情概要，保留人物关系、重要事件和角色的情绪变化，不超过200字。
+        只返回概要内容，不要其他内容。"""
+        
+        try:
+            return sanitize_text(await self._complete(prompt, "summary"))
         except Exception as e:
-            raise Exception(f"生成对话回应失败: {str(e)}")
\ No newline at end of file
+            raise Exception(f"生成剧情概要失败: {str(e)}")
@@ -0,0 +1,250 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 当前请求各阶段的累计耗时（秒），由ServerTimingMiddleware设置，用于生成Server-Timing响应头；
+# 后台任务（推测生成、剧情概要等）应将其置为None，避免把耗时算进触发它的请求
+stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        # 没有标签的计数器从0开始输出，使抓取方能区分"尚未发生"和"指标不存在"
+        self.values: Dict[Tuple[str, ...], float] = {} if self.label_names else {(): 0}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """取值在抓取时由回调函数计算的指标"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.func())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> (各分桶的计数（非累计，最后一个为+Inf）, 总和)
+        self.values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "gal_sim_http_request_duration_seconds", "HTTP请求耗时（流式接口为发出响应头之前的耗时）",
+    ("method", "path", "status")
+))
+STAGE_SECONDS = registry.register(Histogram(
+    "gal_sim_stage_duration_seconds", "对话轮次各阶段的耗时", ("stage",)
+))
+LLM_TTFT_SECONDS = registry.register(Histogram(
+    "gal_sim_llm_time_to_first_token_seconds", "LLM请求的首token耗时（非流式请求为总耗时）", ("operation", "model")
+))
+LLM_SECONDS = registry.register(Histogram(
+    "gal_sim_llm_duration_seconds", "LLM请求的总耗时", ("operation", "model")
+))
+LLM_TOKENS = registry.register(Counter(
+    "gal_sim_llm_tokens_total", "LLM消耗的token数（上游未返回用量时为估算值）", ("operation", "model", "type")
+))
+LLM_TOKENS_SAVED = registry.register(Counter(
+    "gal_sim_llm_tokens_saved_total", "精简协议相对原有协议节省的token数（估算值）", ("operation", "type")
+))
+LLM_FALLBACKS = registry.register(Counter(
+    "gal_sim_llm_fallbacks_total", "主模型超出延迟目标后切换到备用模型的次数", ("operation",)
+))
+SESSIONS_EVICTED = registry.register(Counter(
+    "gal_sim_sessions_evicted_total", "因内存预算或会话数上限被淘汰的会话数"
+))
+
+
+def add_timing(name: str, seconds: float):
+    """把一段耗时累加到当前请求的Server-Timing中"""
+    timings = stage_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """记录一个阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        add_timing(name, elapsed)
+
+
+@asynccontextmanager
+async def timed_lock(lock: asyncio.Lock):
+    """获取锁并记录等待时间（lock_wait阶段）"""
+    with stage("lock_wait"):
+        await lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def record_llm_call(operation: str, ttft: float, total: float, model: str = "default"):
+    LLM_TTFT_SECONDS.observe(ttft, operation=operation, model=model)
+    LLM_SECONDS.observe(total, operation=operation, model=model)
+    add_timing("llm_ttft", ttft)
+    add_timing("llm", total)
+
+
+def record_tokens(operation: str, prompt_tokens: int, completion_tokens: int, model: str = "default"):
+    LLM_TOKENS.inc(prompt_tokens, operation=operation, model=model, type="prompt")
+    LLM_TOKENS.inc(completion_tokens, operation=operation, model=model, type="completion")
+
+
+def record_tokens_saved(operation: str, prompt_tokens: int, completion_tokens: int):
+    # 计数器不能减少，个别轮次精简协议反而更长时按0计
+    LLM_TOKENS_SAVED.inc(max(0, prompt_tokens), operation=operation, type="prompt")
+    LLM_TOKENS_SAVED.inc(max(0, completion_tokens), operation=operation, type="completion")
+
+
+def record_fallback(operation: str):
+    LLM_FALLBACKS.inc(operation=operation)
+
+
+def record_evictions(count: int):
+    SESSIONS_EVICTED.inc(count)
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """格式化Server-Timing响应头，耗时单位为毫秒"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI中间件：为每个请求收集各阶段耗时，写入Server-Timing响应头并记录请求耗时
+    流式响应在开始生成之前就已发出响应头，只包含此前的阶段
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = stage_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timings["total"] = time.perf_counter() - start
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", format_server_timing(timings).encode("latin-1")))
+                message = {**message, "headers": headers}
+                REQUEST_SECONDS.observe(
+                    timings["total"], method=scope["method"],
+                    path=getattr(scope.get("route"), "path", "other"), status=str(message["status"])
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            stage_timings.reset(token)
@@ -1,8 +1,50 @@
 import asyncio
+import heapq
+import logging
+import sys
 import time
-from typing import Dict, List, Optional, Any
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Any, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from itertools import islice
+from .session_store import SessionStore, create_session_store
+from .session_snapshot import SnapshotWriter, decode_session, encode_session, iter_snapshot
+from .metrics import record_evictions
+from ..models.dialogue import CHOICE_AFFECTION_DELTAS
+from ..models.history import HistoryBuffer, Message
+from ..utils.config import (
+    SESSION_TIMEOUT, SESSION_SWEEP_INTERVAL, SESSION_STORE, SESSION_STORE_PATH, SESSION_STORE_FLUSH_INTERVAL,
+    SESSION_MEMORY_BUDGET_MB, SESSION_MAX_COUNT
+)
+
+logger = logging.getLogger(__name__)
+
+# 全量快照每批编码/写入的会话数
+_SNAPSHOT_BATCH = 1000
+# 内存占用估算：会话对象本身（数据类、锁、历史缓冲区等）和每条消息除内容字符串外的开销（字节）
+_SESSION_OVERHEAD = 600
+_MESSAGE_OVERHEAD = 90
+# 记住最近多少个因内存压力被淘汰的会话ID，用于向客户端返回可识别的错误
+_EVICTED_TOMBSTONES = 100000
+
+
+class SessionEvicted(Exception):
+    """会话因内存压力被淘汰（与不存在或已过期区分），客户端应重新开始对话或读取存档"""
+    def __init__(self, session_id: str):
+        super().__init__("会话因服务器内存不足已被释放，请重新开始对话或读取存档")
+        self.session_id = session_id
+
+
+class SessionNotFound(ValueError):
+    """会话不存在或已过期"""
+    def __init__(self, session_id: str):
+        super().__init__("会话不存在或已过期")
+        self.session_id = session_id
+
+
+def _message_size(message: Message) -> int:
+    return _MESSAGE_OVERHEAD + sys.getsizeof(message.content)
 
 
 @dataclass
@@ -10,25 +52,90 @@ class SessionData:
     """会话数据类"""
     session_id: str
     theme: str
-    history: List[Dict[str, str]] = field(default_factory=list)
+    history: HistoryBuffer = None  # 为空时按max_history_length创建
     created_at: datetime = field(default_factory=datetime.now)
     last_accessed: datetime = field(default_factory=datetime.now)
     max_history_length: int = 50  # 最大历史记录数
     affection: int = 50  # 好感度，初始值为50
+    summary: str = ""  # 较早对话的滚动剧情概要
+    summarized_until: int = 0  # history中从最旧一条起已合并进概要的消息数，最旧的消息被覆盖时随之减少
+    offered_choices: List[Tuple[str, int]] = field(default_factory=list)  # 最近一次提供的(选项, 好感度变化)
+    story_node: int = -1  # 当前所在的剧情树节点，-1表示不在预先生成的剧情树上
+    # 串行化同一会话上的并发对话请求
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+    # 持久化存储，为None时会话只保存在内存中
+    store: Optional[SessionStore] = field(default=None, repr=False, compare=False)
+    # 估算的内存占用（字节）及其变化时的回调(会话, 变化量)，由SessionManager用于统计总占用
+    size: int = field(default=0, repr=False, compare=False)
+    on_resize: Optional[Callable[["SessionData", int], None]] = field(default=None, repr=False, compare=False)
+    
+    def __post_init__(self):
+        if not isinstance(self.history, HistoryBuffer):
+            self.history = HistoryBuffer(self.max_history_length, self.history or ())
+        if self.summarized_until > len(self.history):
+            # 旧版本保存的是最后一条已概要消息的时间戳
+            self.summarized_until = sum(1 for message in self.history if message.timestamp <= self.summarized_until)
+        self.summarized_until = int(self.summarized_until)
+        self._history_bytes = sum(_message_size(message) for message in self.history)
+        self.size = self._estimate_size()
+    
+    def _estimate_size(self) -> int:
+        return (_SESSION_OVERHEAD + self._history_bytes + sys.getsizeof(self.session_id) + sys.getsizeof(self.theme)
+                + sys.getsizeof(self.summary) + sum(sys.getsizeof(text) for text, _ in self.offered_choices))
+    
+    def _account(self):
+        """重新估算内存占用并通知管理器，历史记录部分是增量维护的，不需要遍历"""
+        size = self._estimate_size()
+        delta = size - self.size
+        if delta:
+            self.size = size
+            if self.on_resize is not None:
+                self.on_resize(self, delta)
     
     def add_message(self, role: str, content: str):
-        """添加消息到历史记录"""
-        self.history.append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # 限制历史记录长度
-        if len(self.history) > self.max_history_length:
-            self.history = self.history[-self.max_history_length:]
+        """添加消息到历史记录，超出max_history_length时覆盖最旧的消息"""
+        message = Message(role, content, time.time())
+        history = self.history
+        if len(history) >= history.capacity:
+            # 写满后新消息覆盖最旧的一条
+            self._history_bytes -= _message_size(history[0])
+            if self.summarized_until:
+                self.summarized_until -= 1
+        history.append(message)
+        self._history_bytes += _message_size(message)
         
         self.last_accessed = datetime.now()
+        
+        # 只追加新消息，不重写整个会话
+        if self.store is not None:
+            self.store.append_message(self, message)
+        self._account()
+    
+    def offer_choices(self, choices: List[str]):
+        """记录提供给用户的选项及其好感度变化"""
+        self.offered_choices = list(zip(choices, CHOICE_AFFECTION_DELTAS))
+        if self.store is not None:
+            self.store.save_session(self)
+        self._account()
+    
+    def update_summary(self, summary: str, last_folded: Message):
+        """
+        更新滚动剧情概要，last_folded为合并进概要的最后一条消息；
+        按对象在历史记录中的位置确定概要边界，不依赖可能相同的时间戳
+        """
+        position = next((i for i, message in enumerate(self.history) if message is last_folded), None)
+        self.summary = summary
+        # 概要生成期间最后一条已被覆盖时，历史记录中剩下的消息都在边界之后
+        self.summarized_until = 0 if position is None else position + 1
+        if self.store is not None:
+            self.store.save_session(self)
+        self._account()
+    
+    def unsummarized_history(self) -> Iterable[Message]:
+        """尚未合并进剧情概要的历史消息，按时间顺序"""
+        if not self.summarized_until:
+            return self.history
+        return self.history.recent(len(self.history) - self.summarized_until)
     
     def update_affection(self, change: int):
         """更新好感度"""
@@ -38,68 +145,297 @@ class SessionData:
 
 
 class SessionManager:
-    """会话管理器"""
-    def __init__(self, session_timeout: int = 3600):  # 1小时超时
-        self.sessions: Dict[str, SessionData] = {}
+    """
+    会话管理器
+    字典操作在事件循环中是原子的，不需要全局锁；每个会话自带一把锁，
+    用于串行化同一会话上的对话轮次。过期清理基于截止时间小顶堆，
+    由后台任务定期执行；估算的总内存占用超过memory_budget或会话数超过max_sessions时，
+    立即按最近最少使用淘汰（跳过正在进行对话的会话）
+    """
+    def __init__(self, session_timeout: int = SESSION_TIMEOUT, sweep_interval: int = SESSION_SWEEP_INTERVAL,
+                 store: Optional[SessionStore] = None,
+                 memory_budget: int = int(SESSION_MEMORY_BUDGET_MB * 1024 * 1024),
+                 max_sessions: int = SESSION_MAX_COUNT):
+        # 内存中的会话，按最近使用排序（最久未用的在前），使用持久化存储时作为热会话缓存
+        self.sessions: "OrderedDict[str, SessionData]" = OrderedDict()
         self.session_timeout = session_timeout
-        self.lock = asyncio.Lock()
+        self.sweep_interval = sweep_interval
+        self.store = store if store is not None else SessionStore()
+        self.memory_budget = memory_budget  # 为0时不限制
+        self.max_sessions = max_sessions  # 为0时不限制
+        self.resident_bytes = 0
+        # 因内存压力淘汰的会话ID（只在会话无法从持久化存储重新读取时记录）
+        self._evicted_ids: "OrderedDict[str, None]" = OrderedDict()
+        # 统计指标
+        self.evicted = 0
+        self.expired = 0
+        self.peak_bytes = 0
+        # (截止时间戳, 会话ID)，会话被访问后堆中的截止时间可能已过时，弹出时再校正
+        self._deadlines: List[Tuple[float, str]] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self._snapshot_lock = asyncio.Lock()  # 同时只写一个全量快照
+        # 会话被删除、过期、淘汰或由存档/快照替换时的回调(会话ID)，用于清理其他服务中按会话保存的状态
+        self.on_remove: List[Callable[[str], None]] = []
+    
+    def _deadline(self, session_data: SessionData) -> float:
+        return session_data.last_accessed.timestamp() + self.session_timeout
+    
+    def _is_expired(self, session_data: SessionData, now: float) -> bool:
+        return self._deadline(session_data) < now
+    
+    def _cache(self, session_data: SessionData):
+        if self.store.persistent:
+            session_data.store = self.store
+        session_id = session_data.session_id
+        self._uncache(session_id)
+        self.sessions[session_id] = session_data
+        session_data.on_resize = self._on_resize
+        self._on_resize(session_data, session_data.size)
+        heapq.heappush(self._deadlines, (self._deadline(session_data), session_id))
+    
+    def _uncache(self, session_id: str) -> Optional[SessionData]:
+        """从内存中移除会话，返回被移除的会话"""
+        session_data = self.sessions.pop(session_id, None)
+        if session_data is not None:
+            session_data.on_resize = None
+            self.resident_bytes -= session_data.size
+        return session_data
+    
+    def _removed(self, session_id: str):
+        for callback in self.on_remove:
+            callback(session_id)
+    
+    def _over_budget(self) -> bool:
+        return ((self.memory_budget > 0 and self.resident_bytes > self.memory_budget)
+                or (self.max_sessions > 0 and len(self.sessions) > self.max_sessions))
+    
+    def _on_resize(self, session_data: SessionData, delta: int):
+        self.resident_bytes += delta
+        if self.resident_bytes > self.peak_bytes:
+            self.peak_bytes = self.resident_bytes
+        if delta > 0 and self._over_budget():
+            self._evict(keep=session_data.session_id)
+    
+    def _evict(self, keep: str = None) -> int:
+        """超出内存预算或会话数上限时，从最久未用的会话开始淘汰，直到回到限制以内"""
+        victims = []
+        excess_bytes = self.resident_bytes - self.memory_budget if self.memory_budget > 0 else 0
+        excess_count = len(self.sessions) - self.max_sessions if self.max_sessions > 0 else 0
+        for session_id, session_data in self.sessions.items():
+            if excess_bytes <= 0 and excess_count <= 0:
+                break
+            if session_id == keep or session_data.lock.locked():
+                continue
+            victims.append(session_id)
+            excess_bytes -= session_data.size
+            excess_count -= 1
+        for session_id in victims:
+            self._uncache(session_id)
+            self._removed(session_id)
+            # 持久化存储中的会话下次访问时会重新读取，不算丢失
+            if not self.store.persistent:
+                self._evicted_ids[session_id] = None
+                if len(self._evicted_ids) > _EVICTED_TOMBSTONES:
+                    self._evicted_ids.popitem(last=False)
+        if victims:
+            self.evicted += len(victims)
+            record_evictions(len(victims))
+            logger.info(f"Evicted {len(victims)} sessions under memory pressure "
+                        f"({self.resident_bytes} bytes, {len(self.sessions)} sessions resident)")
+        return len(victims)
+    
+    def was_evicted(self, session_id: str) -> bool:
+        """会话是否因内存压力被淘汰（而不是不存在或已过期）"""
+        return session_id in self._evicted_ids
+    
+    async def _load(self, session_id: str) -> Optional[SessionData]:
+        """在线程中从持久化存储读取会话并放入缓存"""
+        record = await asyncio.to_thread(self.store.load_session, session_id)
+        cached = self.sessions.get(session_id)
+        # 读取期间其他请求已放入缓存或开始使用缓存中的会话时，以缓存为准
+        if cached is not None and (record is None or cached.lock.locked()
+                                   or cached.last_accessed >= record["last_accessed"]):
+            return cached
+        if record is None:
+            return None
+        session_data = SessionData(**record)
+        self._cache(session_data)
+        return session_data
     
     async def create_session(self, session_id: str, theme: str) -> SessionData:
         """创建新会话"""
-        async with self.lock:
-            session_data = SessionData(session_id=session_id, theme=theme)
-            self.sessions[session_id] = session_data
-            return session_data
+        session_data = SessionData(session_id=session_id, theme=theme)
+        self._cache(session_data)
+        self.store.save_session(session_data)
+        return session_data
+    
+    def add_restored_session(self, record: Dict[str, Any]) -> SessionData:
+        """加入从存档或快照恢复的会话，使用持久化存储时同时写入其元数据和历史记录"""
+        session_data = SessionData(**record)
+        self._removed(session_data.session_id)
+        self._cache(session_data)
+        self.store.save_session(session_data)
+        for message in session_data.history:
+            self.store.append_message(session_data, message)
+        return session_data
+    
+    async def snapshot(self, path: str, codec: Optional[int] = None) -> Dict[str, Any]:
+        """
+        把内存中的所有会话写入全量快照文件
+        会话在事件循环中分批编码（每个会话的编码是一致的），压缩和写文件在线程中进行，
+        内存中只保留当前一批的编码，不复制全部会话；codec为空时按SNAPSHOT_COMPRESSION选择压缩方式
+        """
+        async with self._snapshot_lock:
+            return await self._snapshot(path, codec)
+    
+    async def _snapshot(self, path: str, codec: Optional[int]) -> Dict[str, Any]:
+        start = time.monotonic()
+        session_ids = list(self.sessions)
+        writer = await asyncio.to_thread(SnapshotWriter, path, codec)
+        try:
+            for i in range(0, len(session_ids), _SNAPSHOT_BATCH):
+                batch = []
+                for session_id in session_ids[i:i + _SNAPSHOT_BATCH]:
+                    session_data = self.sessions.get(session_id)
+                    if session_data is not None:
+                        batch.append(encode_session(session_data))
+                await asyncio.to_thread(writer.write, batch)
+            size = await asyncio.to_thread(writer.close)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+        return {"sessions": writer.count, "bytes": size, "raw_bytes": writer.raw_bytes,
+                "elapsed": round(time.monotonic() - start, 3)}
+    
+    async def restore(self, path: str) -> Dict[str, Any]:
+        """
+        从全量快照恢复会话，文件按块流式读取；已过期的会话和当前已存在的会话会被跳过
+        """
+        start = time.monotonic()
+        records = iter_snapshot(path)
+        expired_before = time.time() - self.session_timeout
+        restored = skipped = 0
+        while True:
+            batch = await asyncio.to_thread(list, islice(records, _SNAPSHOT_BATCH))
+            if not batch:
+                break
+            for data in batch:
+                record = decode_session(data)
+                session_id = record["session_id"]
+                if (record["last_accessed"].timestamp() < expired_before or session_id in self.sessions
+                        or (self.store.persistent and self.store.last_accessed(session_id) is not None)):
+                    skipped += 1
+                    continue
+                self.add_restored_session(record)
+                restored += 1
+        return {"restored": restored, "skipped": skipped, "elapsed": round(time.monotonic() - start, 3)}
     
     async def get_session(self, session_id: str) -> Optional[SessionData]:
         """获取会话"""
-        async with self.lock:
-            session_data = self.sessions.get(session_id)
-            if session_data:
-                # 检查会话是否超时
-                time_since_access = datetime.now() - session_data.last_accessed
-                if time_since_access.total_seconds() > self.session_timeout:
-                    await self.delete_session(session_id)
-                    return None
-                return session_data
-            return None
+        session_data = self.sessions.get(session_id)
+        if session_data and self.store.persistent and not session_data.lock.locked():
+            # 其他进程更新过该会话，或读取期间会话被移出缓存时重新读取
+            stored = await asyncio.to_thread(self.store.last_accessed, session_id)
+            if ((stored is not None and stored > session_data.last_accessed.timestamp())
+                    or self.sessions.get(session_id) is not session_data):
+                session_data = await self._load(session_id)
+        elif session_data is None and self.store.persistent:
+            session_data = await self._load(session_id)
+        if session_data:
+            # 检查会话是否超时
+            if self._is_expired(session_data, time.time()) and not session_data.lock.locked():
+                self._uncache(session_id)
+                self._removed(session_id)
+                self.expired += 1
+                self.store.delete_session(session_id, expired_before=time.time() - self.session_timeout)
+                return None
+            self.sessions.move_to_end(session_id)
+            return session_data
+        return None
     
     async def update_session(self, session_id: str, **kwargs) -> bool:
         """更新会话数据"""
-        async with self.lock:
-            session_data = self.sessions.get(session_id)
-            if session_data:
-                for key, value in kwargs.items():
-                    if hasattr(session_data, key):
-                        setattr(session_data, key, value)
-                session_data.last_accessed = datetime.now()
-                return True
-            return False
+        session_data = self.sessions.get(session_id)
+        if session_data:
+            for key, value in kwargs.items():
+                if hasattr(session_data, key):
+                    setattr(session_data, key, value)
+            session_data.last_accessed = datetime.now()
+            self.store.save_session(session_data)
+            return True
+        return False
     
     async def delete_session(self, session_id: str) -> bool:
         """删除会话"""
-        async with self.lock:
-            if session_id in self.sessions:
-                del self.sessions[session_id]
-                return True
-            return False
-    
-    async def cleanup_expired_sessions(self):
-        """清理过期会话"""
-        async with self.lock:
-            expired_sessions = []
-            current_time = datetime.now()
-            
-            for session_id, session_data in self.sessions.items():
-                time_since_access = current_time - session_data.last_accessed
-                if time_since_access.total_seconds() > self.session_timeout:
-                    expired_sessions.append(session_id)
-            
-            for session_id in expired_sessions:
-                del self.sessions[session_id]
-                
-            return len(expired_sessions)
+        self.store.delete_session(session_id)
+        self._evicted_ids.pop(session_id, None)
+        self._removed(session_id)
+        return self._uncache(session_id) is not None
+    
+    async def cleanup_expired_sessions(self) -> int:
+        """清理过期会话，只检查截止时间已到的堆顶条目"""
+        now = time.time()
+        removed = 0
+        while self._deadlines and self._deadlines[0][0] < now:
+            _, session_id = heapq.heappop(self._deadlines)
+            session_data = self.sessions.get(session_id)
+            if session_data is None:
+                continue
+            if session_data.lock.locked():
+                # 正在进行对话的会话延后检查
+                heapq.heappush(self._deadlines, (now + self.session_timeout, session_id))
+            elif self._is_expired(session_data, now):
+                self._uncache(session_id)
+                self._removed(session_id)
+                self.store.delete_session(session_id, expired_before=now - self.session_timeout)
+                removed += 1
+            else:
+                heapq.heappush(self._deadlines, (self._deadline(session_data), session_id))
+        # 持久化存储中可能还有未被本进程缓存的过期会话
+        self.store.delete_expired(now - self.session_timeout)
+        self.expired += removed
+        return removed
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.sessions),
+            "resident_bytes": self.resident_bytes,
+            "peak_bytes": self.peak_bytes,
+            "memory_budget": self.memory_budget,
+            "max_sessions": self.max_sessions,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+    
+    def start_sweeper(self):
+        """启动后台过期清理任务和持久化存储的写入任务"""
+        self.store.start()
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+    
+    async def stop_sweeper(self):
+        """停止后台任务，并写入持久化存储中剩余的数据"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        await self.store.close()
+    
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = await self.cleanup_expired_sessions()
+                if removed:
+                    logger.info(f"Cleaned up {removed} expired sessions")
+            except Exception as e:
+                logger.error(f"Error cleaning up sessions: {str(e)}")
 
 
 # 全局会话管理器实例
-session_manager = SessionManager()
\ No newline at end of file
+session_manager = SessionManager(
+    store=create_session_store(SESSION_STORE, SESSION_STORE_PATH, SESSION_STORE_FLUSH_INTERVAL)
+)
@@ -0,0 +1,403 @@
+import importlib.util
+import json
+import logging
+import os
+import re
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from ..models.history import Message
+from ..utils.config import SAVE_DIR, SNAPSHOT_COMPRESSION
+
+logger = logging.getLogger(__name__)
+
+# 单个会话的二进制编码（小端），字符串均为 长度(u32) | UTF-8：
+#   头部    好感度(i32) | 创建时间(f64) | 最后访问时间(f64) | 最大历史记录数(u32) | 已概要消息数(f64，旧版本为时间戳)
+#           | 剧情树节点(i32) | 选项数(u32) | 消息数(u32)
+#   字符串  会话ID | 主题 | 剧情概要
+#   选项    每个选项：文本 | 好感度变化(i32)
+#   消息    每条消息：角色(u8，见ROLES) | 时间戳(f64) | 内容
+_HEAD = struct.Struct("<iddIdiII")
+_LENGTH = struct.Struct("<I")
+_DELTA = struct.Struct("<i")
+_MESSAGE = struct.Struct("<Bd")
+ROLES = ("user", "character")
+_ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+# 存档文件：magic(6) | 版本(u8) | 压缩方式(u8) | 元数据长度(u32) | 元数据(UTF-8 JSON，不压缩，列出存档时只读这部分) | 压缩后的会话
+SAVE_MAGIC = b"GSSAVE"
+# 全量快照文件：magic(6) | 版本(u8) | 压缩方式(u8) | 压缩流（内容为依次排列的 会话编码长度(u32) | 会话编码）
+SNAPSHOT_MAGIC = b"GSSNAP"
+FORMAT_VERSION = 1
+_FILE_HEADER = struct.Struct("<6sBB")
+
+CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD = 0, 1, 2
+CODEC_NAMES = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+# 存档名只允许字母、数字、下划线和连字符，直接用作文件名
+_SLOT_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# 读取快照文件的块大小
+_READ_CHUNK = 64 * 1024
+# 单个会话编码解压后的大小上限，防止导入的存档是压缩炸弹
+MAX_SESSION_BYTES = 32 * 1024 * 1024
+
+
+def zstd_available() -> bool:
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def resolve_codec(name: str = SNAPSHOT_COMPRESSION) -> int:
+    """根据配置选择压缩方式：auto时安装了zstandard用zstd，否则用zlib"""
+    name = (name or "auto").lower()
+    if name == "auto":
+        return CODEC_ZSTD if zstd_available() else CODEC_ZLIB
+    codec = CODEC_NAMES.get(name)
+    if codec is None:
+        logger.warning(f"Unknown snapshot compression '{name}', falling back to zlib")
+        return CODEC_ZLIB
+    if codec == CODEC_ZSTD and not zstd_available():
+        logger.warning("zstandard is not installed, falling back to zlib")
+        return CODEC_ZLIB
+    return codec
+
+
+def _compressor(codec: int):
+    """流式压缩对象（compress/flush），不压缩时返回None"""
+    if codec == CODEC_ZLIB:
+        return zlib.compressobj(6)
+    if codec == CODEC_ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def _decompressor(codec: int):
+    """流式解压对象（decompress），不压缩时返回None"""
+    if codec == CODEC_ZLIB:
+        return zlib.decompressobj()
+    if codec == CODEC_ZSTD:
+        if not zstd_available():
+            raise ValueError("该文件使用zstd压缩，需要安装zstandard")
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == CODEC_NONE:
+        return None
+    raise ValueError(f"未知的压缩方式: {codec}")
+
+
+def _compress(codec: int, data: bytes) -> bytes:
+    compressor = _compressor(codec)
+    if compressor is None:
+        return data
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(codec: int, data: bytes, max_size: int = MAX_SESSION_BYTES) -> bytes:
+    """一次性解压，解压后超过max_size字节时报错，不会先把全部内容解压到内存"""
+    if codec == CODEC_NONE:
+        result = data
+    elif codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"解压后超过{max_size}字节")
+        if not decompressor.eof:
+            raise ValueError("压缩数据不完整")
+    else:
+        # 先经_decompressor校验压缩方式和zstandard是否安装；zstd帧头中的原始大小不可信，按块解压并累计大小
+        _decompressor(codec)
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(data)
+        parts, size = [], 0
+        while True:
+            chunk = reader.read(_READ_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError(f"解压后超过{max_size}字节")
+            parts.append(chunk)
+        result = b"".join(parts)
+    if len(result) > max_size:
+        raise ValueError(f"解压后超过{max_size}字节")
+    return result
+
+
+def _pack_str(parts: List[bytes], value: str):
+    encoded = value.encode("utf-8")
+    parts.append(_LENGTH.pack(len(encoded)))
+    parts.append(encoded)
+
+
+def encode_session(session_data) -> bytes:
+    """把会话编码为紧凑的二进制记录"""
+    history = list(session_data.history)
+    parts = [_HEAD.pack(
+        session_data.affection,
+        session_data.created_at.timestamp(),
+        session_data.last_accessed.timestamp(),
+        session_data.max_history_length,
+        session_data.summarized_until,
+        session_data.story_node,
+        len(session_data.offered_choices),
+        len(history),
+    )]
+    _pack_str(parts, session_data.session_id)
+    _pack_str(parts, session_data.theme)
+    _pack_str(parts, session_data.summary)
+    for text, delta in session_data.offered_choices:
+        _pack_str(parts, text)
+        parts.append(_DELTA.pack(delta))
+    for message in history:
+        parts.append(_MESSAGE.pack(_ROLE_CODES.get(message.role, 0), message.timestamp))
+        _pack_str(parts, message.content)
+    return b"".join(parts)
+
+
+def decode_session(data: bytes) -> Dict[str, Any]:
+    """解码会话记录，返回可直接传给SessionData(**record)的字典"""
+    unpack_length = _LENGTH.unpack_from
+    unpack_message = _MESSAGE.unpack_from
+    try:
+        (affection, created_at, last_accessed, max_history_length, summarized_until, story_node,
+         choice_count, message_count) = _HEAD.unpack_from(data, 0)
+        offset = _HEAD.size
+        strings = []
+        for _ in range(3):
+            end = offset + 4 + unpack_length(data, offset)[0]
+            strings.append(data[offset + 4:end].decode("utf-8"))
+            offset = end
+        offered_choices = []
+        for _ in range(choice_count):
+            end = offset + 4 + unpack_length(data, offset)[0]
+            offered_choices.append((data[offset + 4:end].decode("utf-8"), _DELTA.unpack_from(data, end)[0]))
+            offset = end + 4
+        history = []
+        for _ in range(message_count):
+            role, timestamp = unpack_message(data, offset)
+            offset += 9
+            end = offset + 4 + unpack_length(data, offset)[0]
+            history.append(Message(ROLES[role], data[offset + 4:end].decode("utf-8"), timestamp))
+            offset = end
+        if offset != len(data):
+            raise ValueError("记录长度不符")
+        # 时间戳来自文件，超出范围或为NaN时同样视为损坏
+        created_at = datetime.fromtimestamp(created_at)
+        last_accessed = datetime.fromtimestamp(last_accessed)
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError, OverflowError, OSError) as e:
+        raise ValueError(f"会话记录已损坏: {str(e)}")
+    session_id, theme, summary = strings
+    return {
+        "session_id": session_id,
+        "theme": theme,
+        "affection": affection,
+        "created_at": created_at,
+        "last_accessed": last_accessed,
+        "max_history_length": max_history_length,
+        "summary": summary,
+        "summarized_until": summarized_until,
+        "offered_choices": offered_choices,
+        "story_node": story_node,
+        "history": history,
+    }
+
+
+def _read_header(data: bytes, magic: bytes, kind: str) -> int:
+    """校验文件头，返回压缩方式"""
+    if len(data) < _FILE_HEADER.size:
+        raise ValueError(f"不是{kind}文件")
+    file_magic, version, codec = _FILE_HEADER.unpack_from(data, 0)
+    if file_magic != magic:
+        raise ValueError(f"不是{kind}文件")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"{kind}文件版本{version}过新，请升级程序")
+    return codec
+
+
+def save_metadata(session_data) -> Dict[str, Any]:
+    """存档列表中显示的信息"""
+    last_line = next(
+        (message.content for message in reversed(list(session_data.history)) if message.role == "character"), ""
+    )
+    return {
+        "theme": session_data.theme,
+        "affection": session_data.affection,
+        "turns": sum(1 for message in session_data.history if message.role == "user"),
+        "preview": last_line[:60],
+        "saved_at": datetime.now().isoformat(),
+    }
+
+
+def dump_save(session_data, codec: Optional[int] = None) -> bytes:
+    """把单个会话序列化为存档文件内容（也用于导出）"""
+    codec = resolve_codec() if codec is None else codec
+    metadata = json.dumps(save_metadata(session_data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return b"".join((
+        _FILE_HEADER.pack(SAVE_MAGIC, FORMAT_VERSION, codec),
+        _LENGTH.pack(len(metadata)),
+        metadata,
+        _compress(codec, encode_session(session_data)),
+    ))
+
+
+def read_save_metadata(data: bytes) -> Tuple[Dict[str, Any], int]:
+    """读取存档的元数据，返回(元数据, 会话数据的起始位置)"""
+    _read_header(data, SAVE_MAGIC, "存档")
+    try:
+        (length,) = _LENGTH.unpack_from(data, _FILE_HEADER.size)
+        start = _FILE_HEADER.size + _LENGTH.size
+        return json.loads(data[start:start + length]), start + length
+    except (struct.error, ValueError) as e:
+        raise ValueError(f"存档已损坏: {str(e)}")
+
+
+def load_save(data: bytes) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """解析存档文件内容，返回(元数据, 会话记录)"""
+    codec = _read_header(data, SAVE_MAGIC, "存档")
+    metadata, offset = read_save_metadata(data)
+    try:
+        body = _decompress(codec, data[offset:])
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"存档已损坏: {str(e)}")
+    return metadata, decode_session(body)
+
+
+class SaveSlots:
+    """
+    存档槽：每个存档是目录下的一个 <存档名>.sav 文件
+    """
+    def __init__(self, directory: str = SAVE_DIR):
+        self.directory = directory
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        return bool(_SLOT_NAME.match(name))
+
+    def _path(self, name: str) -> str:
+        if not self.valid_name(name):
+            raise ValueError("存档名只能包含字母、数字、下划线和连字符（最多64个字符）")
+        return os.path.join(self.directory, f"{name}.sav")
+
+    def save(self, name: str, content: bytes):
+        """写入存档，先写临时文件再替换，覆盖同名存档时不会留下损坏的文件"""
+        path = self._path(name)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def load(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, name: str) -> bool:
+        try:
+            os.remove(self._path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self) -> List[Dict[str, Any]]:
+        """所有存档的元数据，按保存时间从新到旧排列"""
+        if not os.path.isdir(self.directory):
+            return []
+        slots = []
+        for entry in os.scandir(self.directory):
+            name, ext = os.path.splitext(entry.name)
+            if ext != ".sav" or not entry.is_file() or not self.valid_name(name):
+                continue
+            try:
+                with open(entry.path, "rb") as f:
+                    head = f.read(_FILE_HEADER.size + _LENGTH.size)
+                    (length,) = _LENGTH.unpack_from(head, _FILE_HEADER.size)
+                    metadata, _ = read_save_metadata(head + f.read(length))
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Skipping unreadable save {entry.name}: {str(e)}")
+                continue
+            slots.append({"slot": name, "size": entry.stat().st_size, **metadata})
+        slots.sort(key=lambda slot: slot.get("saved_at", ""), reverse=True)
+        return slots
+
+
+class SnapshotWriter:
+    """
+    全量快照的流式写入：会话分批编码后压缩写入临时文件，close时替换目标文件，
+    任何时候内存中只有当前一批的编码
+    """
+    def __init__(self, path: str, codec: Optional[int] = None):
+        self.path = path
+        self.codec = resolve_codec() if codec is None else codec
+        self.count = 0
+        self.raw_bytes = 0
+        self._tmp_path = f"{path}.tmp"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(_FILE_HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, self.codec))
+        self._compressor = _compressor(self.codec)
+
+    def write(self, records: Iterable[bytes]):
+        """写入一批已编码的会话"""
+        parts = []
+        for record in records:
+            parts.append(_LENGTH.pack(len(record)))
+            parts.append(record)
+            self.count += 1
+            self.raw_bytes += _LENGTH.size + len(record)
+        chunk = b"".join(parts)
+        self._file.write(self._compressor.compress(chunk) if self._compressor is not None else chunk)
+
+    def close(self) -> int:
+        """写完并替换目标文件，返回文件大小"""
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def iter_snapshot(path: str) -> Iterator[bytes]:
+    """逐条读取全量快照中的会话编码，按块读取和解压，不把整个文件读进内存"""
+    with open(path, "rb") as f:
+        codec = _read_header(f.read(_FILE_HEADER.size), SNAPSHOT_MAGIC, "快照")
+        decompressor = _decompressor(codec)
+        buffer = bytearray()
+        offset = 0
+        while True:
+            chunk = f.read(_READ_CHUNK)
+            if not chunk:
+                break
+            if decompressor is not None:
+                try:
+                    chunk = decompressor.decompress(chunk)
+                except Exception as e:
+                    raise ValueError(f"快照已损坏: {str(e)}")
+            # 丢弃已经读取的部分，保留不完整的最后一条
+            del buffer[:offset]
+            offset = 0
+            buffer += chunk
+            while offset + _LENGTH.size <= len(buffer):
+                (length,) = _LENGTH.unpack_from(buffer, offset)
+                end = offset + _LENGTH.size + length
+                if end > len(buffer):
+                    break
+                yield bytes(buffer[offset + _LENGTH.size:end])
+                offset = end
+        if offset != len(buffer):
+            raise ValueError("快照文件不完整")
+
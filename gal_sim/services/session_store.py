@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple
+from ..models.history import Message
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    会话存储接口
+    默认实现只保存在内存中（即SessionManager.sessions本身），所有方法均为空操作；
+    持久化后端需实现这些方法，写入应尽量缓冲后批量执行
+    """
+    persistent = False
+
+    def start(self):
+        """启动后台写入任务"""
+
+    async def close(self):
+        """写入剩余数据并关闭存储"""
+
+    async def flush(self):
+        """立即写入所有缓冲的数据"""
+
+    def save_session(self, session_data):
+        """保存会话的元数据（主题、好感度、时间等）"""
+
+    def append_message(self, session_data, message: Message):
+        """追加一条消息，同时更新会话元数据"""
+
+    def delete_session(self, session_id: str, expired_before: Optional[float] = None):
+        """删除会话；指定expired_before时只在存储中的最后访问时间早于该时间戳时删除"""
+
+    def delete_expired(self, expired_before: float):
+        """删除最后访问时间早于该时间戳的所有会话"""
+
+    def last_accessed(self, session_id: str) -> Optional[float]:
+        """存储中会话的最后访问时间戳，用于判断内存中的缓存是否过时"""
+        return None
+
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话，返回元数据和最近的历史记录"""
+        return None
+
+
+class MemorySessionStore(SessionStore):
+    """内存存储，会话只存在于进程内"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    基于SQLite（WAL模式）的会话存储
+    消息只追加不重写，每个会话只保留最近max_history_length条；写入先进入内存缓冲，
+    由后台任务按固定间隔在线程中批量提交；读取是同步的，调用方应放到线程中执行
+    """
+    persistent = True
+
+    def __init__(self, path: str, flush_interval: float = 0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._writer = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                theme TEXT NOT NULL,
+                affection INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL,
+                max_history_length INTEGER NOT NULL,
+                summary TEXT NOT NULL DEFAULT '',
+                summarized_until REAL NOT NULL DEFAULT 0,
+                offered_choices TEXT NOT NULL DEFAULT '[]',
+                story_node INTEGER NOT NULL DEFAULT -1
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_accessed ON sessions (last_accessed);
+        """)
+        # 旧版本创建的数据库缺少后来加入的列
+        columns = {row[1] for row in self._writer.execute("PRAGMA table_info(sessions)")}
+        for column, definition in (("offered_choices", "TEXT NOT NULL DEFAULT '[]'"),
+                                   ("story_node", "INTEGER NOT NULL DEFAULT -1")):
+            if column not in columns:
+                self._writer.execute(f"ALTER TABLE sessions ADD COLUMN {column} {definition}")
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._read_lock = threading.Lock()  # 读取连接可能被多个线程同时使用
+        # 待写入的缓冲
+        self._pending_meta: Dict[str, Tuple] = {}
+        self._pending_messages: List[Tuple] = []
+        self._pending_deletes: List[Tuple[str, Optional[float]]] = []
+        self._pending_expiry: Optional[float] = None
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self._writer.close()
+        self._reader.close()
+
+    def save_session(self, session_data):
+        self._pending_meta[session_data.session_id] = (
+            session_data.session_id,
+            session_data.theme,
+            session_data.affection,
+            session_data.created_at.timestamp(),
+            session_data.last_accessed.timestamp(),
+            session_data.max_history_length,
+            session_data.summary,
+            session_data.summarized_until,
+            json.dumps(session_data.offered_choices, ensure_ascii=False),
+            session_data.story_node,
+        )
+
+    def append_message(self, session_data, message: Message):
+        self._pending_messages.append(
+            (session_data.session_id, message.role, message.content, message.timestamp)
+        )
+        self.save_session(session_data)
+
+    def delete_session(self, session_id: str, expired_before: Optional[float] = None):
+        self._pending_deletes.append((session_id, expired_before))
+
+    def delete_expired(self, expired_before: float):
+        self._pending_expiry = expired_before
+
+    def last_accessed(self, session_id: str) -> Optional[float]:
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT last_accessed FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT theme, affection, created_at, last_accessed, max_history_length, summary, summarized_until, "
+                "offered_choices, story_node FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            (theme, affection, created_at, last_accessed, max_history_length, summary, summarized_until, offered,
+             story_node) = row
+            messages = self._reader.execute(
+                "SELECT role, content, timestamp FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, max_history_length)
+            ).fetchall()
+        return {
+            "session_id": session_id,
+            "theme": theme,
+            "affection": affection,
+            "created_at": datetime.fromtimestamp(created_at),
+            "last_accessed": datetime.fromtimestamp(last_accessed),
+            "max_history_length": max_history_length,
+            "summary": summary,
+            "summarized_until": summarized_until,
+            "offered_choices": [(text, delta) for text, delta in json.loads(offered)],
+            "story_node": story_node,
+            "history": [Message(role, content, timestamp) for role, content, timestamp in reversed(messages)],
+        }
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not (self._pending_meta or self._pending_messages or self._pending_deletes or self._pending_expiry):
+                return
+            meta = list(self._pending_meta.values())
+            messages = self._pending_messages
+            deletes = self._pending_deletes
+            expiry = self._pending_expiry
+            self._pending_meta = {}
+            self._pending_messages = []
+            self._pending_deletes = []
+            self._pending_expiry = None
+            try:
+                await asyncio.to_thread(self._write_batch, meta, messages, deletes, expiry)
+            except Exception:
+                # 写入失败时放回缓冲，下次重试；期间更新过的元数据以新值为准
+                for row in meta:
+                    self._pending_meta.setdefault(row[0], row)
+                self._pending_messages[:0] = messages
+                self._pending_deletes[:0] = deletes
+                if self._pending_expiry is None:
+                    self._pending_expiry = expiry
+                raise
+
+    def _write_batch(self, meta: List[Tuple], messages: List[Tuple],
+                     deletes: List[Tuple[str, Optional[float]]], expiry: Optional[float]):
+        cursor = self._writer.cursor()
+        cursor.execute("BEGIN")
+        try:
+            cursor.executemany(
+                "INSERT INTO sessions (session_id, theme, affection, created_at, last_accessed, max_history_length, "
+                "summary, summarized_until, offered_choices, story_node) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET "
+                "theme = excluded.theme, affection = excluded.affection, "
+                "last_accessed = excluded.last_accessed, max_history_length = excluded.max_history_length, "
+                "summary = excluded.summary, summarized_until = excluded.summarized_until, "
+                "offered_choices = excluded.offered_choices, story_node = excluded.story_node",
+                meta
+            )
+            cursor.executemany(
+                "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)", messages
+            )
+            # 超出历史长度的旧消息不会再被读取，删除本批次中有新消息的会话的多余行
+            # （追加消息时会同时保存元数据，本批次中有这些会话的max_history_length）
+            history_lengths = {row[0]: row[5] for row in meta}
+            for session_id in {row[0] for row in messages} & history_lengths.keys():
+                cursor.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id <= "
+                    "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (session_id, session_id, history_lengths[session_id])
+                )
+            # 删除放在写入之后，使同一批次中被访问过的会话不会因过期条件被误删
+            for session_id, expired_before in deletes:
+                if expired_before is None:
+                    cursor.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                elif cursor.execute(
+                    "DELETE FROM sessions WHERE session_id = ? AND last_accessed < ?", (session_id, expired_before)
+                ).rowcount:
+                    cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            if expiry is not None:
+                cursor.execute(
+                    "DELETE FROM messages WHERE session_id IN "
+                    "(SELECT session_id FROM sessions WHERE last_accessed < ?)", (expiry,)
+                )
+                cursor.execute("DELETE FROM sessions WHERE last_accessed < ?", (expiry,))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing session store: {str(e)}")
+
+
+def create_session_store(backend: str, path: str, flush_interval: float) -> SessionStore:
+    """根据配置创建会话存储"""
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, flush_interval)
+    if backend != "memory":
+        logger.warning(f"Unknown session store backend '{backend}', falling back to memory")
+    return MemorySessionStore()
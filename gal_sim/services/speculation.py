@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, List, Optional
+from .llm_service import LLMService, token_usage
+from .metrics import stage_timings
+from .session_manager import SessionData
+from ..models.history import Message
+from ..utils.config import (
+    SPECULATIVE_ENABLED, SPECULATIVE_MAX_CONCURRENCY, SPECULATIVE_TOKEN_BUDGET, SPECULATIVE_MAX_SESSIONS
+)
+
+logger = logging.getLogger(__name__)
+
+
+def history_state_key(theme: str, history: Iterable[Message]) -> str:
+    """根据主题和对话历史计算状态键，相同的历史状态得到相同的键"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(theme.encode("utf-8"))
+    for entry in history:
+        digest.update(b"\x00" + entry.role.encode("utf-8") + b"\x01" + entry.content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _consume_exception(task: asyncio.Task):
+    """读取被丢弃分支的异常，避免未取回异常的警告"""
+    if not task.cancelled():
+        task.exception()
+
+
+class _SessionSpeculation:
+    """单个会话的推测生成状态"""
+    __slots__ = ("branches", "tokens_used")
+
+    def __init__(self):
+        self.branches: Dict[str, asyncio.Task] = {}  # 历史状态键 -> 生成任务
+        self.tokens_used = 0
+
+
+class SpeculativeGenerator:
+    """
+    推测生成器
+    返回选项后立即在后台为每个选项生成下一轮对话，用户选择后直接取用对应结果，
+    并取消其余分支
+    """
+    def __init__(self, llm_service: LLMService, enabled: bool = SPECULATIVE_ENABLED,
+                 max_concurrency: int = SPECULATIVE_MAX_CONCURRENCY,
+                 token_budget: int = SPECULATIVE_TOKEN_BUDGET,
+                 max_sessions: int = SPECULATIVE_MAX_SESSIONS):
+        self.llm_service = llm_service
+        self.enabled = enabled
+        self.token_budget = token_budget
+        self.max_sessions = max_sessions
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.sessions: "OrderedDict[str, _SessionSpeculation]" = OrderedDict()
+        # 统计指标
+        self.scheduled = 0
+        self.hits = 0
+        self.ready_hits = 0  # 用户选择时结果已经生成完毕的命中
+        self.misses = 0
+        self.cancelled = 0
+        self.budget_skipped = 0
+        self.tokens_used = 0
+
+    def schedule(self, session_data: SessionData, choices: List[str]):
+        """为当前会话的每个选项启动后台生成任务"""
+        if not self.enabled:
+            return
+        state = self._get_state(session_data.session_id)
+        self._cancel_branches(state)
+        if state.tokens_used >= self.token_budget:
+            self.budget_skipped += 1
+            return
+
+        theme = session_data.theme
+        # 与历史缓冲区写满后覆盖最旧消息的行为一致，使键与用户选择后的会话历史相同
+        base_history = list(session_data.history)
+        if len(base_history) >= session_data.history.capacity:
+            base_history = base_history[len(base_history) - session_data.history.capacity + 1:]
+        for choice in choices:
+            if not choice:
+                continue
+            history = base_history + [Message("user", choice, time.time())]
+            key = history_state_key(theme, history)
+            if key in state.branches:
+                continue
+            # 已合并进剧情概要的消息不再逐条放入上下文
+            folded = max(0, session_data.summarized_until - (len(session_data.history) - len(base_history)))
+            context = history[folded:]
+            task = asyncio.create_task(self._generate(state, theme, context, choice, session_data.summary))
+            task.add_done_callback(_consume_exception)
+            state.branches[key] = task
+            self.scheduled += 1
+
+    async def take(self, session_data: SessionData) -> Optional[Dict[str, Any]]:
+        """
+        取出与当前历史状态匹配的推测结果（历史中应已包含用户本轮的选择），
+        未命中时返回None；其余分支会被取消
+        """
+        if not self.enabled:
+            return None
+        state = self.sessions.get(session_data.session_id)
+        if state is None or not state.branches:
+            return None
+
+        key = history_state_key(session_data.theme, session_data.history)
+        task = state.branches.pop(key, None)
+        self._cancel_branches(state)
+        if task is None:
+            self.misses += 1
+            return None
+
+        ready = task.done()
+        try:
+            result = await task
+        except Exception as e:
+            logger.warning(f"Speculative branch failed for session {session_data.session_id}: {str(e)}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if ready:
+            self.ready_hits += 1
+        return result
+
+    def discard(self, session_id: str):
+        """丢弃会话的推测状态并取消未完成的任务"""
+        state = self.sessions.pop(session_id, None)
+        if state is not None:
+            self._cancel_branches(state)
+
+    def stats(self) -> Dict[str, Any]:
+        """推测生成的统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "scheduled": self.scheduled,
+            "hits": self.hits,
+            "ready_hits": self.ready_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cancelled": self.cancelled,
+            "budget_skipped": self.budget_skipped,
+            "tokens_used": self.tokens_used,
+            "token_budget_per_session": self.token_budget,
+            "tracked_sessions": len(self.sessions),
+        }
+
+    def _get_state(self, session_id: str) -> _SessionSpeculation:
+        state = self.sessions.get(session_id)
+        if state is None:
+            state = self.sessions[session_id] = _SessionSpeculation()
+            # 超出跟踪上限时丢弃最久未使用的会话
+            while len(self.sessions) > self.max_sessions:
+                _, oldest = self.sessions.popitem(last=False)
+                self._cancel_branches(oldest)
+        else:
+            self.sessions.move_to_end(session_id)
+        return state
+
+    def _cancel_branches(self, state: _SessionSpeculation):
+        for task in state.branches.values():
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+        state.branches = {}
+
+    async def _generate(self, state: _SessionSpeculation, theme: str, history: List[Message], choice: str,
+                        summary: str) -> Dict[str, Any]:
+        usage = {"total_tokens": 0}
+        token_usage.set(usage)
+        stage_timings.set(None)  # 后台生成不计入触发它的请求的Server-Timing
+        try:
+            async with self.semaphore:
+                # 排队期间预算可能已被其他分支用完
+                if state.tokens_used >= self.token_budget:
+                    self.budget_skipped += 1
+                    raise Exception("推测生成token预算已用完")
+                return await self.llm_service.generate_response(theme, history, choice, summary)
+        finally:
+            state.tokens_used += usage["total_tokens"]
+            self.tokens_used += usage["total_tokens"]
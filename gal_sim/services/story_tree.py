@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, List, Tuple
+from ..models.history import Message
+
+logger = logging.getLogger(__name__)
+
+# 文件格式（小端）：
+#   头部    magic(8) | 节点数(u32) | 主题长度(u32) | 主题(UTF-8)
+#   索引    每个节点一条定长记录：内容偏移(u64) | 内容长度(u32) | 选项A-D对应的子节点序号(4 x i32，-1为没有)
+#   内容    每个节点的 {"text": ..., "choices": [...]}（UTF-8 JSON）
+# 节点0为开场白，其余节点为选择某个选项后的角色回应
+MAGIC = b"GSTREE01"
+_HEADER = struct.Struct("<8sII")
+_NODE = struct.Struct("<QI4i")
+NO_CHILD = -1
+
+# 展开过程的断点记录中，路径为从开场白开始依次选择的选项序号
+Path = Tuple[int, ...]
+
+
+class StoryTree:
+    """
+    预先生成的剧情树（只读，内存映射）
+    按序号读取节点只需一次定长索引查找和一次JSON解码，不需要把整棵树读进内存
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mmap) < _HEADER.size:
+                raise ValueError(f"{path} 不是剧情树文件")
+            magic, self.node_count, theme_length = _HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} 不是剧情树文件")
+            self._index_offset = _HEADER.size + theme_length
+            # 写了一半或被截断的文件在启动时报错，由调用方退回到实时生成
+            if self._index_offset + self.node_count * _NODE.size > len(self._mmap):
+                raise ValueError(f"{path} 不完整")
+            self.theme = self._mmap[_HEADER.size:self._index_offset].decode("utf-8")
+        except ValueError:
+            self._mmap.close()
+            raise
+
+    def _record(self, index: int) -> Tuple[int, int, int, int, int, int]:
+        if not 0 <= index < self.node_count:
+            raise IndexError(f"剧情树节点{index}不存在")
+        return _NODE.unpack_from(self._mmap, self._index_offset + index * _NODE.size)
+
+    def node(self, index: int) -> Dict[str, Any]:
+        """节点的文本和选项"""
+        offset, length, *_ = self._record(index)
+        return json.loads(self._mmap[offset:offset + length])
+
+    def child(self, index: int, choice_index: int) -> int:
+        """选择某个选项后到达的节点，没有预先生成时返回NO_CHILD"""
+        if not 0 <= choice_index < 4:
+            return NO_CHILD
+        return self._record(index)[2 + choice_index]
+
+    def children(self, index: int) -> Tuple[int, int, int, int]:
+        return self._record(index)[2:]
+
+    def close(self):
+        self._mmap.close()
+
+
+def write_story_tree(path: str, theme: str, nodes: List[Tuple[str, List[str], List[int]]]):
+    """
+    写入剧情树文件，nodes按序号排列，每项为(文本, 选项, 子节点序号)
+    先写临时文件再替换，写入中断不会留下损坏的文件
+    """
+    theme_bytes = theme.encode("utf-8")
+    payloads = [
+        json.dumps({"text": text, "choices": choices}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for text, choices, _ in nodes
+    ]
+    offset = _HEADER.size + len(theme_bytes) + len(nodes) * _NODE.size
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(nodes), len(theme_bytes)))
+        f.write(theme_bytes)
+        for (_, _, children), payload in zip(nodes, payloads):
+            f.write(_NODE.pack(offset, len(payload), *(list(children) + [NO_CHILD] * 4)[:4]))
+            offset += len(payload)
+        for payload in payloads:
+            f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class StoryTreeBuilder:
+    """
+    从开场白开始按层展开A-D选项，生成指定深度的剧情树
+    每生成一个节点就追加到断点记录（JSONL）中，中断后重新运行会跳过已生成的节点
+    """
+    def __init__(self, llm_service, theme: str, depth: int, journal_path: str,
+                 concurrency: int = 4, max_nodes: int = 2000):
+        self.llm_service = llm_service
+        self.theme = theme
+        self.depth = max(0, depth)
+        self.journal_path = journal_path
+        self.concurrency = max(1, concurrency)
+        self.max_nodes = max_nodes
+        self.nodes: Dict[Path, Dict[str, Any]] = {}  # 路径 -> {"text", "choices"}
+        self.generated = 0
+        self.failures = 0
+
+    def _load_journal(self):
+        if not os.path.exists(self.journal_path):
+            with open(self.journal_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"theme": self.theme}, ensure_ascii=False) + "\n")
+            return
+        with open(self.journal_path, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("theme") != self.theme:
+                raise ValueError(f"断点记录的主题是\"{header.get('theme')}\"，与\"{self.theme}\"不一致")
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 中断时写了一半的最后一行
+                    continue
+                self.nodes[tuple(entry["path"])] = {"text": entry["text"], "choices": entry["choices"]}
+
+    def _append_journal(self, path: Path, node: Dict[str, Any]):
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"path": list(path), **node}, ensure_ascii=False) + "\n")
+
+    def _history(self, path: Path) -> List[Message]:
+        """到达该路径时的对话历史（包含最后一次选择）"""
+        now = time.time()
+        node = self.nodes[()]
+        history = [Message("character", node["text"], now)]
+        for depth, choice_index in enumerate(path):
+            history.append(Message("user", node["choices"][choice_index], now + 2 * depth + 1))
+            child = self.nodes.get(path[:depth + 1])
+            if child is None:
+                break
+            history.append(Message("character", child["text"], now + 2 * depth + 2))
+            node = child
+        return history
+
+    async def _generate(self, path: Path, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                if not path:
+                    result = await self.llm_service.generate_initial_dialogue(self.theme)
+                    node = {"text": result["dialogue"], "choices": result["choices"]}
+                else:
+                    parent = self.nodes[path[:-1]]
+                    result = await self.llm_service.generate_response(
+                        self.theme, self._history(path), parent["choices"][path[-1]]
+                    )
+                    node = {"text": result["response"], "choices": result["choices"]}
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Failed to generate story node {list(path)}: {str(e)}")
+                return
+        if not node["text"]:
+            self.failures += 1
+            return
+        self.nodes[path] = node
+        self.generated += 1
+        self._append_journal(path, node)
+
+    def _frontier(self, depth: int) -> List[Path]:
+        """第depth层中尚未生成、但父节点已生成的路径"""
+        if depth == 0:
+            return [] if () in self.nodes else [()]
+        paths = []
+        for path, node in self.nodes.items():
+            if len(path) != depth - 1:
+                continue
+            for choice_index, choice in enumerate(node["choices"][:4]):
+                child = path + (choice_index,)
+                if choice and child not in self.nodes:
+                    paths.append(child)
+        return sorted(paths)
+
+    async def build(self, progress=None):
+        """展开剧情树；progress(层, 已有节点数)在每层结束后调用"""
+        self._load_journal()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        for depth in range(self.depth + 1):
+            frontier = self._frontier(depth)[:max(0, self.max_nodes - len(self.nodes))]
+            await asyncio.gather(*(self._generate(path, semaphore) for path in frontier))
+            if progress is not None:
+                progress(depth, len(self.nodes))
+            if len(self.nodes) >= self.max_nodes:
+                logger.warning(f"Story tree reached max_nodes={self.max_nodes}, stopping at depth {depth}")
+                break
+
+    def write(self, path: str) -> int:
+        """按广度优先编号写入剧情树文件，返回节点数"""
+        if () not in self.nodes:
+            raise ValueError("开场白尚未生成")
+        paths = sorted(self.nodes, key=lambda p: (len(p), p))
+        index = {p: i for i, p in enumerate(paths)}
+        nodes = []
+        for p in paths:
+            node = self.nodes[p]
+            children = [index.get(p + (i,), NO_CHILD) for i in range(4)]
+            nodes.append((node["text"], node["choices"], children))
+        write_story_tree(path, self.theme, nodes)
+        return len(nodes)
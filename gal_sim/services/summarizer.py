@@ -0,0 +1,53 @@
+import asyncio
+import logging
+from typing import Set
+from .llm_service import LLMService
+from .metrics import stage_timings
+from .session_manager import SessionData
+from ..utils.config import CONTEXT_SUMMARY_INTERVAL, CONTEXT_KEEP_RECENT
+
+logger = logging.getLogger(__name__)
+
+
+class HistorySummarizer:
+    """
+    滚动剧情概要
+    未概要的消息在保留最近keep_recent条之外又积累了interval条时，在后台把它们
+    合并进会话的剧情概要，使提示词长度不随故事变长而增长
+    """
+    def __init__(self, llm_service: LLMService, interval: int = CONTEXT_SUMMARY_INTERVAL,
+                 keep_recent: int = CONTEXT_KEEP_RECENT):
+        self.llm_service = llm_service
+        self.interval = interval
+        self.keep_recent = max(0, keep_recent)
+        self._inflight: Set[str] = set()
+        # 持有后台任务的引用，事件循环只保存弱引用，未完成的任务可能被垃圾回收
+        self._tasks: Set[asyncio.Task] = set()
+        # 统计指标
+        self.completed = 0
+        self.failures = 0
+
+    def maybe_schedule(self, session_data: SessionData):
+        """需要时启动后台概要任务，每个会话同时最多一个"""
+        if self.interval <= 0 or session_data.session_id in self._inflight:
+            return
+        pending = list(session_data.unsummarized_history())
+        if len(pending) - self.keep_recent < self.interval:
+            return
+        to_fold = pending[:len(pending) - self.keep_recent]
+        self._inflight.add(session_data.session_id)
+        task = asyncio.create_task(self._summarize(session_data, to_fold))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, session_data: SessionData, to_fold):
+        stage_timings.set(None)  # 后台生成不计入触发它的请求的Server-Timing
+        try:
+            summary = await self.llm_service.summarize_history(session_data.theme, session_data.summary, to_fold)
+            session_data.update_summary(summary, to_fold[-1])
+            self.completed += 1
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Failed to summarize history for session {session_data.session_id}: {str(e)}")
+        finally:
+            self._inflight.discard(session_data.session_id)
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+from .llm_service import LLMService
+from ..utils.config import THEME_POOL_SIZE, THEME_POOL_TTL, THEME_POOL_REFILL_CONCURRENCY, THEME_POOL_PERSIST_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class ThemePool:
+    """
+    预热的自动主题池
+    后台预先生成(主题, 开场白, 选项)组合，自动主题的开始请求可直接取用，
+    池为空时由调用方回退到实时生成
+    """
+    def __init__(self, llm_service: LLMService, size: int = THEME_POOL_SIZE, ttl: int = THEME_POOL_TTL,
+                 refill_concurrency: int = THEME_POOL_REFILL_CONCURRENCY,
+                 persist_path: str = THEME_POOL_PERSIST_PATH):
+        self.llm_service = llm_service
+        self.size = size
+        self.ttl = ttl
+        self.refill_concurrency = max(1, refill_concurrency)
+        self.persist_path = persist_path
+        self.bundles: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # 统计指标
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.expired = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def pop(self) -> Optional[Dict[str, Any]]:
+        """取出一个未过期的组合，池为空时返回None"""
+        if not self.enabled:
+            return None
+        self._purge_expired()
+        self._wakeup.set()
+        if not self.bundles:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.bundles.popleft()
+
+    def start(self):
+        """加载持久化的组合并启动后台补充任务"""
+        if not self.enabled or self._task is not None:
+            return
+        self._load()
+        self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        """停止后台补充任务并持久化当前的组合"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        """主题池的统计信息"""
+        return {
+            "enabled": self.enabled,
+            "size": len(self.bundles),
+            "capacity": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "generated": self.generated,
+            "expired": self.expired,
+            "failures": self.failures,
+        }
+
+    def _purge_expired(self):
+        # 组合按生成时间先后入队，只需检查队首
+        deadline = time.time() - self.ttl
+        while self.bundles and self.bundles[0]["created_at"] < deadline:
+            self.bundles.popleft()
+            self.expired += 1
+
+    async def _generate_bundle(self) -> Dict[str, Any]:
+        theme = await self.llm_service.generate_theme()
+        dialogue_data = await self.llm_service.generate_initial_dialogue(theme)
+        return {
+            "theme": theme,
+            "dialogue": dialogue_data["dialogue"],
+            "choices": dialogue_data["choices"],
+            "created_at": time.time(),
+        }
+
+    async def _refill_loop(self):
+        backoff = 1
+        while True:
+            self._purge_expired()
+            missing = self.size - len(self.bundles)
+            if missing <= 0:
+                self._wakeup.clear()
+                try:
+                    # 定期醒来清理过期组合
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(self.ttl, 60))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = min(missing, self.refill_concurrency)
+            results = await asyncio.gather(*[self._generate_bundle() for _ in range(batch)], return_exceptions=True)
+            succeeded = 0
+            for result in results:
+                if isinstance(result, Exception):
+                    self.failures += 1
+                    logger.warning(f"Failed to pre-generate theme bundle: {str(result)}")
+                else:
+                    self.bundles.append(result)
+                    succeeded += 1
+            self.generated += succeeded
+
+            if succeeded:
+                backoff = 1
+                self._save()
+            else:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                bundles = json.load(f)
+            self.bundles.extend(sorted(bundles, key=lambda b: b["created_at"]))
+            self._purge_expired()
+            logger.info(f"Loaded {len(self.bundles)} theme bundles from {self.persist_path}")
+        except Exception as e:
+            logger.warning(f"Failed to load theme pool from {self.persist_path}: {str(e)}")
+
+    def _save(self):
+        if not self.persist_path:
+            return
+        try:
+            tmp_path = self.persist_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self.bundles), f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            logger.warning(f"Failed to save theme pool to {self.persist_path}: {str(e)}")
@@ -2,6 +2,7 @@
 let currentSessionId = null;
 let currentTheme = null;
 let currentAffection = 50;
+let requestInFlight = false;  // 防止连点重复提交
 
 // DOM元素
 const themeSelectionDiv = document.getElementById('theme-selection');
@@ -40,27 +41,22 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // 设置背景图片
 async function setBackgroundImage() {
+    // 从服务器的本地缓存加载，按窗口宽度请求合适尺寸的版本
+    const width = Math.ceil(window.innerWidth * (window.devicePixelRatio || 1));
     try {
-        // 从图片API获取背景图片
-        // 使用fetch来处理可能的重定向
-        const imageUrl = 'https://www.loliapi.com/acg/';  // Loliapi ACG图片API
-        
-        // 使用fetch来检查API响应
-        const response = await fetch(imageUrl, { 
-            method: 'GET',
-            redirect: 'follow'  // 自动跟随重定向
-        });
+        // /api/v1/background 每次随机重定向到一张图片，使用重定向后的固定地址，
+        // 该地址带长期缓存头，设置为背景时直接使用刚下载的缓存
+        const response = await fetch(`/api/v1/background?w=${width}`);
         
         if (response.ok) {
-            // 图片API请求成功，直接使用URL设置背景
-            document.body.style.backgroundImage = `url('${imageUrl}')`;
+            document.body.style.backgroundImage = `url('${response.url}')`;
             document.body.style.backgroundSize = 'cover';
             document.body.style.backgroundRepeat = 'no-repeat';
             document.body.style.backgroundAttachment = 'fixed';
             document.body.style.backgroundPosition = 'center';
-            console.log('背景图片设置成功:', imageUrl);
+            console.log('背景图片设置成功:', response.url);
         } else {
-            console.error('API请求失败，状态码:', response.status);
+            console.error('获取背景图片失败，状态码:', response.status);
             // 使用默认背景
             document.body.style.background = 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)';
         }
@@ -68,25 +64,73 @@ async function setBackgroundImage() {
         console.error('设置背景图片失败:', error);
         // 如果发生错误，使用默认背景
         document.body.style.background = 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)';
+    }
+}
+
+// 会话因服务器内存不足被释放的错误，可以重新开始对话
+function sessionEvictedError(detail) {
+    const error = new Error(detail || '会话已被释放，请重新开始对话');
+    error.code = 'session_evicted';
+    return error;
+}
+
+// 以POST方式请求SSE接口，逐个事件回调 onEvent(event, data)
+async function postEventStream(url, body, onEvent) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        },
+        body: JSON.stringify(body)
+    });
+    
+    if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After') || '1';
+        throw new Error(`服务繁忙，请在${retryAfter}秒后重试`);
+    }
+    if (response.status === 410) {
+        const data = await response.json().catch(() => ({}));
+        throw sessionEvictedError(data.detail);
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
         
-        // 作为备选方案，使用Image对象尝试加载
-        try {
-            const img = new Image();
-            img.onload = function() {
-                document.body.style.backgroundImage = `url('https://www.loliapi.com/acg/')`;
-                document.body.style.backgroundSize = 'cover';
-                document.body.style.backgroundRepeat = 'no-repeat';
-                document.body.style.backgroundAttachment = 'fixed';
-                document.body.style.backgroundPosition = 'center';
-            };
+        // 事件之间以空行分隔
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
             
-            img.onerror = function() {
-                document.body.style.background = 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)';
-            };
+            let event = 'message';
+            const dataLines = [];
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trim());
+                }
+            });
+            if (dataLines.length === 0) continue;
             
-            img.src = 'https://www.loliapi.com/acg/';
-        } catch (imgError) {
-            console.error('备选方案也失败:', imgError);
+            const data = JSON.parse(dataLines.join('\n'));
+            if (event === 'error') {
+                if (data.code === 'session_evicted') {
+                    throw sessionEvictedError(data.detail);
+                }
+                throw new Error(data.detail || '服务器错误');
+            }
+            onEvent(event, data);
         }
     }
 }
@@ -107,99 +151,121 @@ async function startNewDialogue() {
         }
     }
     
+    if (requestInFlight) return;
+    requestInFlight = true;
     showLoading(true);
     
     try {
-        const response = await fetch('/api/v1/start', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                theme: theme,
-                custom_theme: customTheme
-            })
-        });
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const data = await response.json();
-        currentSessionId = data.session_id;
-        currentTheme = data.theme;
-        currentAffection = data.affection;
-        
-        // 更新好感度显示
-        updateAffectionDisplay(currentAffection);
-        affectionDisplay.style.display = 'block';
+        let messageDiv = null;
         
-        // 更新UI
-        currentThemeSpan.textContent = currentTheme;
-        dialogueAreaDiv.style.display = 'block';
-        themeSelectionDiv.style.display = 'none';
-        
-        // 显示初始对话
-        addMessageToHistory('character', data.initial_dialogue);
-        
-        // 显示选项
-        displayChoices(data.choices);
+        await postEventStream('/api/v1/start/stream', {
+            theme: theme,
+            custom_theme: customTheme
+        }, (event, data) => {
+            if (event === 'meta') {
+                currentSessionId = data.session_id;
+                currentTheme = data.theme;
+                
+                // 更新UI
+                currentThemeSpan.textContent = currentTheme;
+                dialogueAreaDiv.style.display = 'block';
+                themeSelectionDiv.style.display = 'none';
+            } else if (event === 'delta') {
+                // 逐段显示开场白
+                if (!messageDiv) {
+                    loadingDiv.style.display = 'none';
+                    messageDiv = addMessageToHistory('character', '');
+                }
+                appendToMessage(messageDiv, data.text);
+            } else if (event === 'done') {
+                currentAffection = data.affection;
+                
+                // 更新好感度显示
+                updateAffectionDisplay(currentAffection);
+                affectionDisplay.style.display = 'block';
+                
+                // 以服务器整理后的完整文本为准
+                if (!messageDiv) {
+                    messageDiv = addMessageToHistory('character', '');
+                }
+                messageDiv.textContent = data.initial_dialogue;
+                
+                // 显示选项
+                displayChoices(data.choices);
+            }
+        });
         
     } catch (error) {
         console.error('开始对话失败:', error);
         alert('开始对话失败: ' + error.message);
     } finally {
+        requestInFlight = false;
         showLoading(false);
     }
 }
 
-// 继续对话
-async function continueDialogue(userChoice) {
+// 继续对话，choiceIndex为选项序号（0-3），自由输入时为null
+async function continueDialogue(userChoice, choiceIndex = null) {
     if (!currentSessionId) {
         alert('会话未开始，请先开始对话');
         return;
     }
+    if (requestInFlight) return;
+    requestInFlight = true;
     
     // 添加用户选择到历史记录
     addMessageToHistory('user', userChoice);
     
     showLoading(true);
+    let sessionEvicted = null;
     
     try {
-        const response = await fetch('/api/v1/dialogue', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                user_input: userChoice,
-                session_id: currentSessionId,
-                theme: currentTheme
-            })
-        });
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const data = await response.json();
-        
-        // 更新好感度
-        currentAffection = data.affection;
-        updateAffectionDisplay(currentAffection);
-        
-        // 显示角色回应
-        addMessageToHistory('character', data.character_response);
+        let messageDiv = null;
         
-        // 显示新选项
-        displayChoices(data.choices);
+        await postEventStream('/api/v1/dialogue/stream', {
+            user_input: userChoice,
+            choice_index: choiceIndex,
+            session_id: currentSessionId,
+            theme: currentTheme
+        }, (event, data) => {
+            if (event === 'delta') {
+                // 逐段显示角色回应
+                if (!messageDiv) {
+                    loadingDiv.style.display = 'none';
+                    messageDiv = addMessageToHistory('character', '');
+                }
+                appendToMessage(messageDiv, data.text);
+            } else if (event === 'done') {
+                // 更新好感度
+                currentAffection = data.affection;
+                updateAffectionDisplay(currentAffection);
+                
+                // 以服务器整理后的完整文本为准
+                if (!messageDiv) {
+                    messageDiv = addMessageToHistory('character', '');
+                }
+                messageDiv.textContent = data.character_response;
+                
+                // 显示新选项
+                displayChoices(data.choices);
+            }
+        });
         
     } catch (error) {
         console.error('继续对话失败:', error);
-        alert('继续对话失败: ' + error.message);
+        if (error.code !== 'session_evicted') {
+            alert('继续对话失败: ' + error.message);
+            return;
+        }
+        sessionEvicted = error;
     } finally {
+        requestInFlight = false;
         showLoading(false);
     }
+    
+    if (sessionEvicted && confirm(sessionEvicted.message + '\n是否重新开始对话？')) {
+        startNewDialogue();
+    }
 }
 
 // 添加消息到历史记录
@@ -212,6 +278,14 @@ function addMessageToHistory(role, content) {
     
     // 滚动到底部
     dialogueHistoryDiv.scrollTop = dialogueHistoryDiv.scrollHeight;
+    
+    return messageDiv;
+}
+
+// 向已显示的消息追加文本（流式输出）
+function appendToMessage(messageDiv, text) {
+    messageDiv.textContent += text;
+    dialogueHistoryDiv.scrollTop = dialogueHistoryDiv.scrollHeight;
 }
 
 // 显示选项
@@ -244,7 +318,7 @@ function displayChoices(choices) {
             ${choice}
         `;
         
-        choiceBtn.addEventListener('click', () => continueDialogue(choice));
+        choiceBtn.addEventListener('click', () => continueDialogue(choice, index));
         choicesAreaDiv.appendChild(choiceBtn);
     });
 }
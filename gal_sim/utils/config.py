@@ -1,22 +1,28 @@
 import os
-from dotenv import load_dotenv
 
-# 尝试加载环境变量，优先级：当前目录 -> 父目录 -> 应用根目录
+# 尝试加载环境变量，优先级：GAL_SIM_ENV_FILE -> 当前目录 -> 父目录 -> 应用根目录
 def load_env_vars():
     """尝试从多个可能的位置加载环境变量"""
-    possible_paths = [
+    # 启动方（如Electron）已知.env的位置时通过GAL_SIM_ENV_FILE直接指定，不再逐个探测
+    explicit_path = os.getenv("GAL_SIM_ENV_FILE")
+    possible_paths = [explicit_path] if explicit_path else [
         '.env',  # 当前目录
         '../.env',  # 父目录
         '../../.env',  # 上两级目录
         os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env'),  # 项目根目录
     ]
-    
+
     for env_path in possible_paths:
-        if os.path.exists(env_path):
+        if os.path.isfile(env_path):
+            from dotenv import load_dotenv
             load_dotenv(env_path)
             return True
-    
+
+    if explicit_path:
+        return False
+
     # 如果都找不到，尝试加载默认的环境变量
+    from dotenv import load_dotenv
     load_dotenv()  # 尝试加载当前工作目录下的 .env
     return False
 
@@ -27,6 +33,114 @@ LLM_API_KEY = os.getenv("LLM_API_KEY", "")
 LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
 LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
 
+# 多个OpenAI兼容endpoint（JSON数组），为空时只使用上面的LLM_BASE_URL/LLM_API_KEY/LLM_MODEL
+# 例如: [{"name": "a", "base_url": "https://...", "api_key": "sk-...", "model": "...", "weight": 2}]
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+
+# 同时进行中的LLM请求上限，避免单个进程向上游堆积过多请求
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# LLM的HTTP连接设置：所有服务共用一个连接池
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))  # 建立连接的超时（秒）
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))  # 等待响应数据的超时（秒）
+LLM_WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "10"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))  # 等待空闲连接的超时（秒）
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() in ("1", "true", "yes")  # 需要安装h2，未安装时使用HTTP/1.1
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # 可重试错误的重试次数，失败后换一个endpoint
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))  # 重试退避的基数（秒），实际等待带随机抖动
+LLM_ENDPOINT_FAILURE_THRESHOLD = int(os.getenv("LLM_ENDPOINT_FAILURE_THRESHOLD", "3"))  # 连续失败几次后暂停使用
+LLM_ENDPOINT_COOLDOWN = float(os.getenv("LLM_ENDPOINT_COOLDOWN", "30"))  # 暂停使用的时间（秒）
+# 对冲请求：非流式请求超过近期p95耗时仍未返回时，再发一份到另一个endpoint，取先返回的结果
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))  # 对冲前至少等待的时间（秒）
+
+# 精简协议：固定的系统提示词、短键名的紧凑JSON输出，节省每轮的输入和输出token
+LLM_COMPACT_PROTOCOL = os.getenv("LLM_COMPACT_PROTOCOL", "false").lower() in ("1", "true", "yes")
+# 默认endpoint是否支持JSON Schema结构化输出（response_format为json_schema），LLM_ENDPOINTS中可逐个设置structured_output
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "false").lower() in ("1", "true", "yes")
+# 按近期的实际输出长度调整对话生成的max_tokens（上限为对应LLM_PROFILES中的max_tokens），默认关闭以保持输出长度不变
+LLM_ADAPTIVE_MAX_TOKENS = os.getenv("LLM_ADAPTIVE_MAX_TOKENS", "false").lower() in ("1", "true", "yes")
+
+# 各类请求（theme/initial/response/summary）的模型和补全参数（JSON对象，未配置的字段使用默认值）
+# 例如: {"theme": {"model": "gpt-4o-mini", "temperature": 0.9}, "response": {"model": "gpt-4o", "fallback_model": "gpt-4o-mini", "latency_slo": 6}}
+LLM_PROFILES = os.getenv("LLM_PROFILES", "")
+# 便宜、快速的模型：设置后主题默认使用它，其余请求默认以它作为备用模型
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "")
+# 主模型近期的首token耗时（非流式为总耗时）超过该值（秒）后改用备用模型（0为不切换），以及多久后重新尝试主模型（秒）
+LLM_LATENCY_SLO = float(os.getenv("LLM_LATENCY_SLO", "10"))
+LLM_FALLBACK_COOLDOWN = float(os.getenv("LLM_FALLBACK_COOLDOWN", "60"))
+
+# LLM响应缓存：按(模型, 消息, 温度, max_tokens, 输出格式)的哈希缓存，磁盘层路径为空时只用内存
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+
+# 会话超时时间（秒）及后台过期清理间隔（秒）
+SESSION_TIMEOUT = int(os.getenv("SESSION_TIMEOUT", "3600"))
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+# 内存中会话的估算总占用上限（MB）和会话数上限，超出时立即按最近最少使用淘汰，为0时不限制
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "512"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "100000"))
+
+# 会话存储后端：memory（默认，仅进程内）或 sqlite（WAL模式，可跨重启和多个worker共享）
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "gal_sim_sessions.db")
+SESSION_STORE_FLUSH_INTERVAL = float(os.getenv("SESSION_STORE_FLUSH_INTERVAL", "0.05"))  # 批量写入间隔（秒）
+
+# 存档目录；存档、导出和全量快照的压缩方式：auto（安装了zstandard时用zstd，否则zlib）、zstd、zlib或none
+SAVE_DIR = os.getenv("SAVE_DIR", "gal_sim_saves")
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "auto").lower()
+# 全量会话快照文件，设置后启动时恢复、关闭时写入，为空时不自动快照
+SESSION_SNAPSHOT_PATH = os.getenv("SESSION_SNAPSHOT_PATH", "")
+
+# 对话上下文的token预算（为0时按固定10条历史构建），以及滚动剧情概要：
+# 未概要的消息超出最近保留的条数达到间隔数时，在后台把较早的消息合并进概要（间隔为0时关闭）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_SUMMARY_INTERVAL = int(os.getenv("CONTEXT_SUMMARY_INTERVAL", "12"))
+CONTEXT_KEEP_RECENT = int(os.getenv("CONTEXT_KEEP_RECENT", "6"))
+
+# 推测生成：返回选项后在后台预先生成四个选项对应的下一轮对话
+SPECULATIVE_ENABLED = os.getenv("SPECULATIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+SPECULATIVE_MAX_CONCURRENCY = int(os.getenv("SPECULATIVE_MAX_CONCURRENCY", "4"))
+SPECULATIVE_TOKEN_BUDGET = int(os.getenv("SPECULATIVE_TOKEN_BUDGET", "20000"))  # 每个会话的推测生成token预算
+SPECULATIVE_MAX_SESSIONS = int(os.getenv("SPECULATIVE_MAX_SESSIONS", "1000"))
+
+# 自动主题预热池：后台预先生成(主题, 开场白, 选项)，为0时关闭
+THEME_POOL_SIZE = int(os.getenv("THEME_POOL_SIZE", "0"))
+THEME_POOL_TTL = int(os.getenv("THEME_POOL_TTL", "86400"))  # 组合的有效期（秒）
+THEME_POOL_REFILL_CONCURRENCY = int(os.getenv("THEME_POOL_REFILL_CONCURRENCY", "2"))
+THEME_POOL_PERSIST_PATH = os.getenv("THEME_POOL_PERSIST_PATH", "")  # 为空时不持久化
+
+# 背景图片本地缓存：后台从图片API预取一组图片保存到磁盘，页面从 /api/v1/background 加载
+BACKGROUND_SOURCE_URL = os.getenv("BACKGROUND_SOURCE_URL", "https://www.loliapi.com/acg/")
+BACKGROUND_CACHE_DIR = os.getenv("BACKGROUND_CACHE_DIR", "gal_sim_backgrounds")
+BACKGROUND_CACHE_MAX_MB = float(os.getenv("BACKGROUND_CACHE_MAX_MB", "200"))  # 超出时按最近最少使用淘汰
+BACKGROUND_PREFETCH_COUNT = int(os.getenv("BACKGROUND_PREFETCH_COUNT", "8"))  # 轮换使用的图片数，为0时关闭预取
+BACKGROUND_REFRESH_INTERVAL = int(os.getenv("BACKGROUND_REFRESH_INTERVAL", "600"))  # 每隔多久（秒）换入一张新图片
+
+# 自由输入文本的好感度词表（JSON对象，关键词 -> 好感度变化），为空时使用内置词表
+AFFECTION_LEXICON_PATH = os.getenv("AFFECTION_LEXICON_PATH", "")
+
+# 准入控制：同时处理的对话请求数和排队上限，队列满时返回429
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+
+# Idempotency-Key的保留时间（秒）和最多保留的键数
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "300"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+# 批量接口（/api/v1/batch）单次请求的最大条数和同时执行的条数上限
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+
+# 预先生成的剧情树文件（由precompute_story.py生成），设置后自动主题和同主题的对话直接从剧情树返回，
+# 玩家输入了剧情树之外的内容时才实时生成
+STORY_TREE_PATH = os.getenv("STORY_TREE_PATH", "")
+
 # 验证必要的环境变量
 if not LLM_API_KEY or LLM_API_KEY == "your_api_key_here":
     print("⚠️  警告: LLM_API_KEY 未设置或仍为默认值，请在 .env 文件中配置")
@@ -1,53 +1,96 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable
 import re
+from ..models.history import HistoryBuffer, Message, format_message
+from .llm_json import extract_choices, parse_llm_output
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
 
 
 def validate_choices(choices: List[str]) -> List[str]:
     """
     验证并清理选项，确保有4个有效选项
     """
-    # 确保我们有4个选项
-    if len(choices) < 4:
-        # 补充空选项
-        choices.extend([""] * (4 - len(choices)))
-    elif len(choices) > 4:
-        # 只取前4个
-        choices = choices[:4]
+    # 模型返回的choices可能是单个字符串或其他类型
+    if isinstance(choices, str):
+        choices = [choices]
+    elif not isinstance(choices, list):
+        choices = []
     
-    # 清理选项内容，去除多余空白
-    cleaned_choices = []
-    for choice in choices:
-        if choice is None:
-            choice = ""
-        cleaned_choice = re.sub(r'\s+', ' ', str(choice).strip())
-        cleaned_choices.append(cleaned_choice)
+    # 确保我们有4个选项：不足时补充空选项，超出时只取前4个
+    choices = choices[:4] + [""] * (4 - len(choices))
     
-    return cleaned_choices
+    # 清理选项内容，去除多余空白
+    return [_WHITESPACE_PATTERN.sub(' ', str(choice).strip()) if choice is not None else "" for choice in choices]
 
 
-def format_dialogue_history(history: List[Dict[str, str]], max_entries: int = 10) -> str:
+def format_dialogue_history(history: Iterable[Message], max_entries: int = 10) -> str:
     """
     格式化对话历史，用于提供给LLM上下文
     """
-    # 只取最近的对话条目
-    recent_history = history[-max_entries:] if len(history) > max_entries else history
-    
-    formatted_history = []
-    for entry in recent_history:
-        role = "用户" if entry["role"] == "user" else "角色"
-        content = entry["content"]
-        formatted_history.append(f"{role}: {content}")
-    
-    return "\n".join(formatted_history)
+    # 会话历史缓冲区已增量维护好格式化文本
+    if isinstance(history, HistoryBuffer):
+        if max_entries == history.context_entries:
+            return history.context
+        recent_history = history.recent(max_entries)
+    else:
+        # 只取最近的对话条目
+        history = list(history)
+        recent_history = history[-max_entries:] if len(history) > max_entries else history
+    
+    return "\n".join(format_message(entry) for entry in recent_history)
+
+
+# 中日韩文字及全角符号，大致每个字符对应一个token
+_CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    快速估算文本的token数，不依赖分词器
+    中日韩字符按每字一个token计，其余字符按每4个一个token计
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def build_dialogue_context(history: Iterable[Message], token_budget: int, summary: str = "") -> str:
+    """
+    在token预算内构建对话上下文
+    从最新的消息开始向前加入，直到预算用完（最新一条总会加入）；
+    有剧情概要时放在最前面，并计入预算。预算不大于0时按固定条数格式化
+    """
+    summary_line = f"之前的剧情概要：{summary}" if summary else ""
+    if token_budget <= 0:
+        history_text = format_dialogue_history(history)
+        return f"{summary_line}\n{history_text}" if summary_line else history_text
+    
+    remaining = token_budget - estimate_tokens(summary_line)
+    if isinstance(history, HistoryBuffer):
+        newest_first = (history[-i] for i in range(1, len(history) + 1))
+    else:
+        newest_first = reversed(list(history))
+    
+    lines = []
+    for entry in newest_first:
+        line = format_message(entry)
+        cost = estimate_tokens(line) + 1  # 加上换行
+        if lines and cost > remaining:
+            break
+        lines.append(line)
+        remaining -= cost
+    
+    if summary_line:
+        lines.append(summary_line)
+    lines.reverse()
+    return "\n".join(lines)
 
 
 def sanitize_text(text: str) -> str:
     """
     清理文本，移除不安全或不需要的内容
     """
-    # 移除多余的换行符和空格
-    text = re.sub(r'\n+', '\n', text)
-    text = re.sub(r'\s+', ' ', text)
+    # 移除多余的换行符和空格（所有空白都会合并为一个空格）
+    text = _WHITESPACE_PATTERN.sub(' ', text)
     text = text.strip()
     
     # 过滤可能的恶意内容（简单示例）
@@ -60,82 +103,86 @@ def extract_choices_from_text(text: str) -> List[str]:
     """
     从文本中提取选项（如果LLM没有按JSON格式返回）
     """
-    # 查找A、B、C、D选项的模式
-    patterns = [
-        r'[A-D]\.\s*(.*?)(?=\n[A-D]\.|$)',
-        r'选项[A-D]：(.*?)(?=选项[A-D]|$)',
-        r'选项[A-D]\s*[:：]\s*(.*?)(?=选项[A-D]|$)',
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.MULTILINE | re.DOTALL)
-        if len(matches) >= 4:
-            choices = [match.strip() for match in matches[:4]]
-            if all(choices):  # 确保所有选项都有内容
-                return choices
-    
-    # 如果找不到标准格式，尝试按行分割并查找选项
-    lines = text.split('\n')
-    choices = []
-    for line in lines:
-        line = line.strip()
-        if line.startswith(('A.', 'B.', 'C.', 'D.')):
-            content = line[2:].strip()
-            if content:
-                choices.append(content)
-        elif line.startswith(('A：', 'B：', 'C：', 'D：')):
-            content = line[2:].strip()
-            if content:
-                choices.append(content)
-        elif line.startswith(('A:', 'B:', 'C:', 'D:')):
-            content = line[2:].strip()
-            if content:
-                choices.append(content)
-    
-    if len(choices) >= 4:
-        return choices[:4]
-    
-    # 如果仍然找不到4个选项，返回空列表
-    return ["", "", "", ""]
+    choices, _ = extract_choices(text)
+    return choices
 
 
-def ensure_json_format(response: str) -> Dict[str, Any]:
+def ensure_json_format(response: str, field: str = "response") -> Dict[str, Any]:
     """
     尝试将响应转换为JSON格式
+    没有可解析的JSON对象时，提取A/B/C/D选项，其余文本作为field字段
     """
-    import json
-    import re
-    
-    # 尝试直接解析JSON
-    try:
-        return json.loads(response)
-    except:
-        pass
-    
-    # 查找JSON对象
-    json_match = re.search(r'\{.*\}', response, re.DOTALL)
-    if json_match:
-        try:
-            json_str = json_match.group()
-            return json.loads(json_str)
-        except:
-            pass
-    
-    # 如果没有JSON格式，尝试从文本中提取信息
-    result = {"response": response, "choices": ["", "", "", ""]}
-    
-    # 尝试提取选项
-    choices = extract_choices_from_text(response)
-    if choices and any(choices):
-        result["choices"] = choices
-    
-    # 尝试分离响应和选项
-    lines = response.split('\n')
-    non_choice_lines = []
-    for line in lines:
-        if not (line.strip().startswith(('A.', 'B.', 'C.', 'D.', 'A：', 'B：', 'C：', 'D：', 'A:', 'B:', 'C:', 'D:'))):
-            non_choice_lines.append(line)
-    
-    result["response"] = "\n".join(non_choice_lines).strip()
-    
-    return result
\ No newline at end of file
+    return parse_llm_output(response, field)
+
+
+class JSONFieldStreamer:
+    """
+    从流式返回的JSON文本中增量提取某个字符串字段的内容
+    每次feed一段新文本，返回该字段新解码出的字符
+    """
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field: str):
+        self._key_pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.buffer = ""
+        self.pos = -1  # 字段值在buffer中的当前解码位置，-1表示尚未找到字段
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.pos < 0:
+            match = self._key_pattern.search(self.buffer)
+            if not match:
+                return ""
+            self.pos = match.end()
+
+        buf = self.buffer
+        n = len(buf)
+        i = self.pos
+        out = []
+        while i < n:
+            c = buf[i]
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            if c != '\\':
+                out.append(c)
+                i += 1
+                continue
+            # 转义序列不完整时等待下一段文本
+            if i + 1 >= n:
+                break
+            e = buf[i + 1]
+            if e != 'u':
+                out.append(self._ESCAPES.get(e, e))
+                i += 2
+                continue
+            if i + 6 > n:
+                break
+            try:
+                code = int(buf[i + 2:i + 6], 16)
+            except ValueError:
+                i += 6
+                continue
+            if 0xD800 <= code < 0xDC00:
+                # 代理对需要等待低位部分
+                if i + 12 > n:
+                    break
+                if buf[i + 6:i + 8] == '\\u':
+                    try:
+                        low = int(buf[i + 8:i + 12], 16)
+                    except ValueError:
+                        low = 0
+                    if 0xDC00 <= low < 0xE000:
+                        out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                        i += 12
+                        continue
+                i += 6
+                continue
+            out.append(chr(code))
+            i += 6
+        self.pos = i
+        return "".join(out)
@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+class KeywordMatcher:
+    """
+    多关键词匹配（Aho-Corasick自动机）
+    构建一次后，对任意文本只需扫描一遍即可找出其中出现的所有关键词，耗时与关键词数量无关
+    """
+    __slots__ = ("_goto", "_fail", "_output")
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[Tuple[str, ...]] = [()]
+        for keyword in keywords:
+            if keyword:
+                self._add(keyword)
+        self._fail: List[int] = [0] * len(self._goto)
+        self._build()
+
+    def _add(self, keyword: str):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._output.append(())
+            state = nxt
+        if keyword not in self._output[state]:
+            self._output[state] += (keyword,)
+
+    def _build(self):
+        """按广度优先计算失配指针，并把失配链上的输出合并到每个状态"""
+        goto, fail, output = self._goto, self._fail, self._output
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0) if goto[f].get(ch, 0) != nxt else 0
+                output[nxt] += output[fail[nxt]]
+
+    def find(self, text: str) -> Set[str]:
+        """文本中出现过的关键词"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found: Set[str] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
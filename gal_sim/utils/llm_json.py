@@ -0,0 +1,157 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库
+    orjson = None
+
+
+def loads(text: str) -> Any:
+    """解析JSON文本，安装了orjson时使用orjson；格式错误时抛出ValueError"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+# JSON的结构性记号：完整的字符串（含一直到文本末尾都未闭合的字符串）、括号和逗号
+_STRUCTURE_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*(?:"|\\?\Z)|[{}\[\],]', re.S)
+_STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+# A/B/C/D选项行，如 "A. ..."、"B：..."、"选项C: ..."、"D) ..."
+_CHOICE_LINE_PATTERN = re.compile(r'^[ \t]*(?:选项[ \t]*)?([A-D])[ \t]*[.．:：、)）][ \t]*(.*?)[ \t]*$', re.M)
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _scan_object(text: str, start: int) -> Tuple[str, Optional[str]]:
+    """
+    从start处的"{"开始扫描一遍，返回(修复后的对象文本, 截断时退回到最后一个完整成员的备选文本)
+    去掉多余的结尾逗号；文本被截断时补全未闭合的字符串和括号
+    """
+    stack = []
+    removed = []  # 需要删除的结尾逗号位置
+    last_comma = -1
+    fallback = None  # (最后一个逗号的位置, 当时的括号栈)
+    end = -1
+    unterminated = False
+    for match in _STRUCTURE_PATTERN.finditer(text, start):
+        token = match.group()
+        c = token[0]
+        if c == '"':
+            if match.end() == len(text) and not _STRING_PATTERN.fullmatch(token):
+                unterminated = True
+            continue
+        if c == ",":
+            last_comma = match.start()
+            fallback = (last_comma, tuple(stack))
+            continue
+        if c in "{[":
+            stack.append(c)
+            continue
+        # 右括号
+        if last_comma >= 0 and not text[last_comma + 1:match.start()].strip():
+            removed.append(last_comma)
+        last_comma = -1
+        if stack:
+            stack.pop()
+        if not stack:
+            end = match.end()
+            break
+
+    if end >= 0:
+        return _drop(text, start, end, removed), None
+
+    # 文本被截断
+    body = _drop(text, start, len(text), removed)
+    if unterminated:
+        if _odd_backslashes(body):
+            body = body[:-1]
+        body += '"'
+    body = body.rstrip()
+    if body.endswith(","):
+        body = body[:-1]
+    elif body.endswith(":"):
+        body += "null"
+    repaired = body + "".join(_CLOSERS[b] for b in reversed(stack))
+
+    alternative = None
+    if fallback is not None:
+        pos, fallback_stack = fallback
+        alternative = _drop(text, start, pos, removed) + "".join(_CLOSERS[b] for b in reversed(fallback_stack))
+    return repaired, alternative
+
+
+def _odd_backslashes(text: str) -> bool:
+    """文本是否以奇数个反斜杠结尾（即截断在转义序列中间）"""
+    return (len(text) - len(text.rstrip("\\"))) % 2 == 1
+
+
+def _drop(text: str, start: int, end: int, positions: List[int]) -> str:
+    """截取text[start:end]并删除其中指定位置的字符"""
+    if not positions:
+        return text[start:end]
+    parts = []
+    prev = start
+    for pos in positions:
+        if pos >= end:
+            break
+        parts.append(text[prev:pos])
+        prev = pos + 1
+    parts.append(text[prev:end])
+    return "".join(parts)
+
+
+def extract_choices(text: str) -> Tuple[List[str], str]:
+    """
+    一遍扫描提取A/B/C/D选项行，返回(四个选项, 去掉选项行后的文本)
+    每个字母只取第一次出现的内容，找不到时对应位置为空字符串
+    """
+    found: Dict[str, str] = {}
+    parts = []
+    prev = 0
+    for match in _CHOICE_LINE_PATTERN.finditer(text):
+        letter, content = match.group(1), match.group(2)
+        if not content:
+            continue
+        found.setdefault(letter, content)
+        parts.append(text[prev:match.start()])
+        prev = match.end()
+    if not found:
+        return ["", "", "", ""], text
+    parts.append(text[prev:])
+    return [found.get(letter, "") for letter in "ABCD"], "".join(parts)
+
+
+def parse_llm_output(text: str, field: str = "response") -> Dict[str, Any]:
+    """
+    解析LLM返回的JSON对象，容忍常见的格式问题
+    - 代码块标记、对象前后的说明文字
+    - 多余的结尾逗号
+    - 输出被截断（补全字符串和括号，仍无法解析时退回到最后一个完整成员）
+    找不到JSON对象时，把A/B/C/D选项行提取为choices，其余文本作为field字段
+    """
+    start = text.find("{")
+    if start >= 0:
+        # 大多数回复是完整的JSON（可能带代码块或说明文字），先直接解析第一个"{"到最后一个"}"之间的内容
+        end = text.rfind("}")
+        if end > start:
+            try:
+                result = loads(text[start:end + 1])
+                if isinstance(result, dict):
+                    return result
+            except ValueError:
+                pass
+
+        repaired, alternative = _scan_object(text, start)
+        for candidate in (repaired, alternative):
+            if candidate is None:
+                continue
+            try:
+                result = loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(result, dict):
+                return result
+
+    choices, remainder = extract_choices(text)
+    return {field: remainder.strip(), "choices": choices}
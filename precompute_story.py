@@ -0,0 +1,57 @@
+"""
+GAL-SIM 剧情树预生成脚本
+
+从开场白开始按层展开A-D选项，生成指定深度的剧情树并写入文件，
+然后以 STORY_TREE_PATH=<文件> 启动服务即可直接从剧情树返回对话（适用于展会、演示等场景）
+
+用法: python precompute_story.py --theme "海边小镇的夏天" --depth 3 [--output story.tree]
+                                [--concurrency 4] [--max-nodes 2000]
+中断后以相同参数重新运行会从断点记录（<output>.journal）继续；保留断点记录时，
+以更大的--depth重新运行只会生成新增的层
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from gal_sim.services.llm_service import LLMService
+from gal_sim.services.story_tree import StoryTree, StoryTreeBuilder
+
+
+async def build(args: argparse.Namespace):
+    journal_path = f"{args.output}.journal"
+    builder = StoryTreeBuilder(
+        LLMService(max_concurrency=args.concurrency), args.theme, args.depth, journal_path,
+        concurrency=args.concurrency, max_nodes=args.max_nodes
+    )
+    start = time.monotonic()
+
+    def progress(depth: int, nodes: int):
+        print(f"第{depth}层完成，共{nodes}个节点（本次生成{builder.generated}个，失败{builder.failures}个），"
+              f"已用时{time.monotonic() - start:.0f}秒")
+
+    await builder.build(progress)
+    count = builder.write(args.output)
+
+    tree = StoryTree(args.output)
+    print(f"剧情树已写入 {args.output}：主题\"{tree.theme}\"，{count}个节点，{os.path.getsize(args.output)}字节")
+    tree.close()
+    if builder.failures:
+        print(f"⚠️  {builder.failures}个节点生成失败，重新运行可以补上")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--theme", required=True, help="剧情主题")
+    parser.add_argument("--depth", type=int, default=3, help="展开的层数（选择次数），节点数约为4^depth")
+    parser.add_argument("--output", default="story.tree", help="输出文件")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的LLM请求数")
+    parser.add_argument("--max-nodes", type=int, default=2000, help="节点数上限")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(build(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 不读取开发者本地的.env；LLM请求发往不存在的地址并且不重试，测试不依赖上游
+os.environ["GAL_SIM_ENV_FILE"] = os.devnull
+os.environ.setdefault("LLM_API_KEY", "test")
+os.environ["LLM_BASE_URL"] = "http://127.0.0.1:9/v1"
+os.environ["LLM_MAX_RETRIES"] = "0"
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["BACKGROUND_PREFETCH_COUNT"] = "0"
+# 静态文件目录是相对路径
+os.chdir(ROOT)
@@ -0,0 +1,73 @@
+"""流式接口的准入名额在各种结束方式下都要归还"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from gal_sim.api.dialogue import admission
+from gal_sim.main import app
+
+
+def _assert_all_released():
+    assert admission.active == 0
+    assert admission.semaphore._value == admission.max_concurrent
+
+
+def _scope(path: str, spec_version: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("test", 80),
+    }
+
+
+async def _disconnect_before_first_byte(path: str, body: dict, spec_version: str):
+    """客户端在响应头发出前断开：send抛出OSError"""
+    messages = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("client disconnected")
+
+    try:
+        await app(_scope(path, spec_version), receive, send)
+    except Exception:
+        pass
+
+
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"])
+def test_disconnect_before_first_byte_releases_admission(spec_version):
+    async def run():
+        for _ in range(3):
+            await _disconnect_before_first_byte("/api/v1/start/stream", {"custom_theme": "测试"}, spec_version)
+        _assert_all_released()
+
+    asyncio.run(run())
+
+
+def test_completed_stream_releases_admission():
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            response = await client.post("/api/v1/start/stream", json={"custom_theme": "测试"})
+        # 上游不可用，流以error事件结束
+        assert response.status_code == 200
+        assert "event: error" in response.text
+        _assert_all_released()
+
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+import json
+import random
+
+import pytest
+
+from gal_sim.services.affection import DEFAULT_AFFECTION_LEXICON, AffectionScorer, load_lexicon
+from gal_sim.services.dialogue_service import DialogueService
+from gal_sim.services.session_manager import SessionData
+from gal_sim.utils.keyword_matcher import KeywordMatcher
+
+
+def test_matcher_finds_overlapping_keywords():
+    matcher = KeywordMatcher(["he", "she", "his", "hers", ""])
+    assert matcher.find("ushers") == {"he", "she", "hers"}
+    assert matcher.find("this") == {"his"}
+    assert matcher.find("xyz") == set()
+    assert KeywordMatcher([]).find("anything") == set()
+
+
+def test_matcher_matches_substring_search():
+    rng = random.Random(7)
+    for _ in range(200):
+        keywords = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 30)))
+        assert KeywordMatcher(keywords).find(text) == {keyword for keyword in keywords if keyword in text}
+
+
+def test_matcher_handles_chinese_keywords():
+    matcher = KeywordMatcher(["好感度+3", "喜欢", "不喜欢"])
+    assert matcher.find("我不喜欢这样（好感度+3）") == {"好感度+3", "喜欢", "不喜欢"}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("我喜欢你", 1),
+    ("温柔地拥抱她，说我喜欢你，会一直支持你", 3),  # 超过上限时截断
+    ("生气地离开，冷漠又讨厌", -3),
+    ("喜欢和讨厌", 0),
+    ("今天天气不错", 0),
+    ("喜欢喜欢喜欢", 1),  # 同一关键词只计一次
+])
+def test_scorer(text, expected):
+    assert AffectionScorer(DEFAULT_AFFECTION_LEXICON).score(text) == expected
+
+
+def test_scorer_is_case_insensitive():
+    assert AffectionScorer({"Love": 2}).score("I LOVE it") == 2
+
+
+def test_load_lexicon_from_file(tmp_path):
+    path = tmp_path / "lexicon.json"
+    path.write_text(json.dumps({"Hug": 2, "走开": "-2"}, ensure_ascii=False), encoding="utf-8")
+    assert load_lexicon(str(path)) == {"hug": 2, "走开": -2}
+
+
+def test_load_lexicon_falls_back_to_default(tmp_path):
+    path = tmp_path / "lexicon.json"
+    path.write_text("[1, 2]", encoding="utf-8")
+    assert load_lexicon(str(path)) == DEFAULT_AFFECTION_LEXICON
+    assert load_lexicon(str(tmp_path / "missing.json")) == DEFAULT_AFFECTION_LEXICON
+    assert load_lexicon("") == DEFAULT_AFFECTION_LEXICON
+
+
+def _session() -> SessionData:
+    session_data = SessionData("s", "校园恋爱")
+    session_data.offer_choices(["喜欢你", "一般般", "有点烦", "讨厌你"])
+    return session_data
+
+
+def test_choice_index_uses_offered_delta():
+    service = DialogueService()
+    session_data = _session()
+    assert service._record_choice(session_data, None, choice_index=3) == ("讨厌你", 3)
+    assert session_data.affection == 47
+    with pytest.raises(ValueError):
+        service._record_choice(session_data, None, choice_index=4)
+
+
+def test_free_text_matching_an_offer_uses_offered_delta():
+    service = DialogueService()
+    session_data = _session()
+    # 按词表"喜欢你"只有+1，作为选项A是+3
+    assert service._record_choice(session_data, "喜欢你") == ("喜欢你", 0)
+    assert session_data.affection == 53
+
+
+def test_free_text_is_scored_by_lexicon():
+    service = DialogueService()
+    session_data = _session()
+    assert service._record_choice(session_data, "我很关心你") == ("我很关心你", None)
+    assert session_data.affection == 51
+    assert session_data.history[-1].content == "我很关心你"
@@ -0,0 +1,81 @@
+"""批量接口的准入排队和与/dialogue一致的错误码"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from gal_sim.api import batch as batch_api
+from gal_sim.api import dialogue as dialogue_api
+from gal_sim.main import app
+from gal_sim.models.dialogue import BatchItem
+from gal_sim.services.admission import AdmissionController, AdmissionRejected
+from gal_sim.services.session_manager import session_manager
+
+
+async def _collect(items, concurrency):
+    lines = [json.loads(line) async for line in batch_api.run_batch(items, concurrency)]
+    return sorted(lines[:-1], key=lambda line: line["index"]), lines[-1]
+
+
+def test_batch_larger_than_admission_queue_waits_for_slots(monkeypatch):
+    admission = AdmissionController(max_concurrent=1, max_queue=0)
+    monkeypatch.setattr(batch_api, "admission", admission)
+    peak = [0]
+
+    async def fake_continue(session_id, user_input, theme, choice_index):
+        peak[0] = max(peak[0], admission.active)
+        await asyncio.sleep(0.01)
+        return {"character_response": f"{session_id}:{user_input}", "choices": ["A", "B", "C", "D"], "affection": 50}
+
+    monkeypatch.setattr(batch_api.dialogue_service, "continue_dialogue", fake_continue)
+    items = [BatchItem(session_id=f"s{i % 3}", user_input=str(i)) for i in range(9)]
+
+    lines, summary = asyncio.run(_collect(items, concurrency=4))
+    assert all(line["ok"] for line in lines), lines
+    assert [line["result"]["character_response"] for line in lines] == [f"s{i % 3}:{i}" for i in range(9)]
+    assert summary["succeeded"] == 9
+    assert peak[0] == 1
+    assert admission.rejected == 0 and admission.active == 0 and admission.waiting == 0
+
+
+def test_single_requests_are_still_rejected_when_queue_is_full():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, max_queue=0)
+        await admission.acquire()
+        with pytest.raises(AdmissionRejected):
+            await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire(wait=True))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        admission.release(0.1)
+        await waiter
+        assert admission.active == 1
+        admission.release(0.1)
+
+    asyncio.run(run())
+
+
+def test_error_status_matches_dialogue_endpoint(monkeypatch):
+    monkeypatch.setattr(dialogue_api, "admission", AdmissionController())
+    monkeypatch.setattr(batch_api, "admission", AdmissionController())
+
+    async def run():
+        await session_manager.create_session("batch-errors", "主题")  # 尚未提供选项
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                cases = [({"session_id": "batch-missing", "choice_index": 0}, 404),
+                         ({"session_id": "batch-errors", "choice_index": 0}, 400)]
+                for body, status in cases:
+                    single = await client.post("/api/v1/dialogue", json=body)
+                    assert single.status_code == status, single.text
+                    response = await client.post("/api/v1/batch", json={"items": [body]})
+                    line = json.loads(response.text.splitlines()[0])
+                    assert not line["ok"]
+                    assert line["status"] == status
+                    assert line["detail"] == single.json()["detail"]
+        finally:
+            await session_manager.delete_session("batch-errors")
+
+    asyncio.run(run())
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from gal_sim.models.history import HistoryBuffer, Message, format_message
+from gal_sim.utils.dialogue_utils import build_dialogue_context, format_dialogue_history
+
+
+def _message(i: int, content: str = None) -> Message:
+    return Message("user" if i % 2 else "character", f"第{i}句" if content is None else content, float(i))
+
+
+def _expected_context(messages, entries: int) -> str:
+    return "\n".join(format_message(message) for message in messages[-entries:])
+
+
+def test_ring_buffer_keeps_latest_messages_in_order():
+    buffer = HistoryBuffer(3)
+    for i in range(7):
+        buffer.append(_message(i))
+    assert [m.content for m in buffer] == ["第4句", "第5句", "第6句"]
+    assert len(buffer) == 3
+    assert buffer[0].content == "第4句"
+    assert buffer[-1].content == "第6句"
+    assert [m.content for m in buffer.recent(2)] == ["第5句", "第6句"]
+    assert [m.content for m in buffer.recent(10)] == ["第4句", "第5句", "第6句"]
+    with pytest.raises(IndexError):
+        buffer[3]
+    with pytest.raises(IndexError):
+        buffer[-4]
+
+
+def test_initial_messages_are_truncated_to_capacity():
+    buffer = HistoryBuffer(2, [_message(i) for i in range(5)])
+    assert [m.content for m in buffer] == ["第3句", "第4句"]
+
+
+@pytest.mark.parametrize("capacity, entries", [(50, 10), (5, 5), (3, 10), (8, 1)])
+def test_incremental_context_matches_full_rebuild(capacity, entries):
+    rng = random.Random(capacity * 100 + entries)
+    buffer = HistoryBuffer(capacity, context_entries=entries)
+    messages = []
+    # 内容包含空字符串、换行和与角色标签相似的文本，切片时只按长度计算
+    contents = ["", "好", "多行\n内容", "用户: 伪装的标签", "a" * 50]
+    for i in range(200):
+        message = _message(i, rng.choice(contents + [None]))
+        buffer.append(message)
+        messages.append(message)
+        if rng.random() < 0.3:
+            assert buffer.context == _expected_context(messages, buffer.context_entries)
+    assert buffer.context == _expected_context(messages, buffer.context_entries)
+
+
+def test_context_built_lazily_then_maintained():
+    buffer = HistoryBuffer(4, context_entries=2)
+    assert buffer.context == ""
+    buffer.append(_message(1))
+    assert buffer.context == format_message(_message(1))
+    for i in range(2, 6):
+        buffer.append(_message(i))
+    assert buffer.context == _expected_context([_message(i) for i in range(1, 6)], 2)
+
+
+def test_format_dialogue_history_uses_buffer_context():
+    buffer = HistoryBuffer(20, [_message(i) for i in range(15)], context_entries=10)
+    plain = [_message(i) for i in range(15)]
+    assert format_dialogue_history(buffer) == format_dialogue_history(plain)
+    assert format_dialogue_history(buffer, max_entries=3) == format_dialogue_history(plain, max_entries=3)
+
+
+@pytest.mark.parametrize("budget", [0, 1, 20, 60, 10000])
+def test_build_dialogue_context_same_for_buffer_and_list(budget):
+    messages = [_message(i, "你好呀" * (i % 4 + 1)) for i in range(12)]
+    buffer = HistoryBuffer(50, messages)
+    assert build_dialogue_context(buffer, budget, "概要") == build_dialogue_context(messages, budget, "概要")
+
+
+def test_build_dialogue_context_always_keeps_newest_message():
+    messages = [_message(0, "很长的一句话" * 100)]
+    assert build_dialogue_context(messages, 1) == format_message(messages[0])
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from gal_sim.utils.dialogue_utils import JSONFieldStreamer
+
+TEXTS = [
+    "你好，今天也一起回家吧",
+    '她说："别走"\n然后\t沉默了\\',
+    "樱花🌸飘落，路径/a/b",
+    "",
+]
+
+
+def _stream(document: str, splits, field: str = "response"):
+    streamer = JSONFieldStreamer(field)
+    pieces = []
+    start = 0
+    for end in list(splits) + [len(document)]:
+        pieces.append(streamer.feed(document[start:end]))
+        start = end
+    return streamer, pieces
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("ensure_ascii", [False, True])
+def test_every_split_point_decodes_the_field(text, ensure_ascii):
+    document = json.dumps({"response": text, "choices": ["A", "B", "C", "D"]}, ensure_ascii=ensure_ascii)
+    for split in range(len(document) + 1):
+        streamer, pieces = _stream(document, [split])
+        assert "".join(pieces) == text, (split, document)
+        assert streamer.done
+
+
+def test_character_by_character():
+    text = "💖晚安é\"结束"
+    document = json.dumps({"choices": ["A"], "response": text}, ensure_ascii=True)
+    streamer, pieces = _stream(document, range(1, len(document)))
+    assert "".join(pieces) == text
+    # 每个字符在完整到达后立即产出，不会整段积压到最后
+    assert sum(1 for piece in pieces if piece) == len(text)
+
+
+def test_stops_at_closing_quote():
+    streamer = JSONFieldStreamer("response")
+    assert streamer.feed('{"response": "第一句') == "第一句"
+    assert streamer.feed('", "dialogue": "不属于该字段"') == ""
+    assert streamer.done
+    assert streamer.feed('}') == ""
+
+
+def test_whitespace_around_colon_and_other_fields():
+    streamer = JSONFieldStreamer("t")
+    assert streamer.feed('{"text": "x", "t" :\n "台词"}') == "台词"
+
+
+def test_absent_field_yields_nothing():
+    streamer = JSONFieldStreamer("response")
+    for chunk in ('{"dialogue": "台词', '", "choices": ["A", "B"]}'):
+        assert streamer.feed(chunk) == ""
+    assert not streamer.done
@@ -0,0 +1,140 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from gal_sim.services import llm_cache
+from gal_sim.services.llm_cache import LLMResponseCache, cache_key
+from gal_sim.services.llm_service import LLMService
+
+PARAMS = {"model": "m", "messages": [{"role": "user", "content": "你好"}], "temperature": 0.7, "max_tokens": 500}
+
+
+def test_cache_key_covers_request_content_only():
+    assert cache_key(PARAMS) == cache_key(dict(reversed(list(PARAMS.items()))))
+    assert cache_key(PARAMS) == cache_key({**PARAMS, "stream": True, "timeout": 5})
+    for name, value in (("model", "other"), ("temperature", 0.2), ("max_tokens", 100),
+                        ("messages", [{"role": "user", "content": "再见"}]),
+                        ("response_format", {"type": "json_object"})):
+        assert cache_key({**PARAMS, name: value}) != cache_key(PARAMS)
+
+
+def test_memory_lru_and_ttl(monkeypatch):
+    async def run():
+        now = [1000.0]
+        monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+        cache = LLMResponseCache(enabled=True, max_size=2, ttl=10, path="")
+        await cache.set("a", "A")
+        await cache.set("b", "B")
+        assert await cache.get("a") == "A"  # a变为最近使用
+        await cache.set("c", "C")
+        assert await cache.get("b") is None
+        assert await cache.get("a") == "A"
+        now[0] += 11
+        assert await cache.get("a") is None
+        assert cache.stats()["memory_hits"] == 2
+        assert cache.stats()["misses"] == 2
+
+    asyncio.run(run())
+
+
+def test_disk_layer_survives_restart(tmp_path, monkeypatch):
+    async def run():
+        path = str(tmp_path / "cache.db")
+        now = [1000.0]
+        monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+        await LLMResponseCache(enabled=True, max_size=10, ttl=10, path=path).set("k", "内容")
+        restarted = LLMResponseCache(enabled=True, max_size=10, ttl=10, path=path)
+        assert await restarted.get("k") == "内容"
+        assert restarted.stats()["disk_hits"] == 1
+        assert await restarted.get("k") == "内容"
+        assert restarted.stats()["memory_hits"] == 1
+        now[0] += 11
+        expired = LLMResponseCache(enabled=True, max_size=10, ttl=10, path=path)
+        assert await expired.get("k") is None
+        assert expired._disk_get("k", 0) is None  # 过期条目已从磁盘删除
+
+    asyncio.run(run())
+
+
+class _Router:
+    """按顺序返回预设的补全结果"""
+    def __init__(self, text: str, finish_reason: str = "stop"):
+        self.text = text
+        self.finish_reason = finish_reason
+        self.calls = 0
+
+    async def complete(self, params, model=None):
+        self.calls += 1
+        message = SimpleNamespace(content=self.text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=self.finish_reason)],
+                               usage=None)
+
+    async def stream(self, params, model=None):
+        self.calls += 1
+        for i in range(0, len(self.text), 8):
+            yield self.text[i:i + 8]
+
+
+TURN = '{"response": "你好呀，今天也来图书馆了吗", "choices": ["A", "B", "C", "D"]}'
+
+
+def _service(router: _Router) -> LLMService:
+    service = LLMService(compact=False)
+    service.cache = LLMResponseCache(enabled=True, max_size=100, ttl=60, path="")
+    service.router = router
+    return service
+
+
+async def _stream_turn(service: LLMService):
+    async for _ in service.stream_response("主题", [], "你好"):
+        pass
+
+
+@pytest.mark.parametrize("finish_reason, cached", [("stop", True), ("length", False), ("content_filter", False)])
+def test_completion_cached_only_when_finished(finish_reason, cached):
+    async def run():
+        router = _Router(TURN, finish_reason)
+        service = _service(router)
+        await service.generate_response("主题", [], "你好")
+        await service.generate_response("主题", [], "你好")
+        assert router.calls == (1 if cached else 2)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("text, cached", [(TURN, True), (TURN[:-5], False), ("不是JSON", False)])
+def test_stream_cached_only_when_complete(text, cached):
+    async def run():
+        router = _Router(text)
+        service = _service(router)
+        await _stream_turn(service)
+        await _stream_turn(service)
+        assert router.calls == (1 if cached else 2)
+
+    asyncio.run(run())
+
+
+def test_interrupted_stream_is_not_cached():
+    async def run():
+        router = _Router(TURN)
+        service = _service(router)
+        events = service.stream_response("主题", [], "你好")
+        await events.__anext__()
+        await events.aclose()
+        await _stream_turn(service)
+        assert router.calls == 2
+
+    asyncio.run(run())
+
+
+def test_theme_bypasses_cache():
+    async def run():
+        router = _Router("魔法学院")
+        service = _service(router)
+        await service.generate_theme()
+        await service.generate_theme()
+        assert router.calls == 2
+        assert service.cache.stats()["bypassed"] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+
+from gal_sim.utils import llm_json
+from gal_sim.utils.dialogue_utils import validate_choices
+from gal_sim.utils.llm_json import _scan_object, extract_choices, parse_llm_output
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "benchmarks", "data", "llm_outputs.jsonl")
+with open(CORPUS_PATH, encoding="utf-8") as f:
+    CORPUS = [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(llm_json, "orjson", None)
+    elif llm_json.orjson is None:
+        pytest.skip("orjson未安装")
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=[case["name"] for case in CORPUS])
+def test_corpus_recovers_text_and_choices(case, backend):
+    """基准语料中的每种输出都能提取出文本和预期数量的选项"""
+    result = parse_llm_output(case["text"], case["field"])
+    choices = validate_choices(result.get("choices") or ["", "", "", ""])
+    assert sum(1 for choice in choices if choice) >= case["expected_choices"]
+    body = str(result.get(case["field"]) or "")
+    assert body and not body.startswith("{") and '"choices"' not in body
+
+
+def test_complete_object_is_returned_as_is(backend):
+    assert parse_llm_output('说明文字 {"response": "你好", "choices": ["a"]} 结尾') == {
+        "response": "你好", "choices": ["a"]
+    }
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": [1, 2,], }', {"a": [1, 2]}),
+    ('{"a": {"b": 1 ,} , "c": "x,}"}', {"a": {"b": 1}, "c": "x,}"}),
+])
+def test_trailing_commas_removed(text, expected, backend):
+    assert parse_llm_output(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # 截断在字符串中间：补全字符串和括号
+    ('{"response": "你终于来', {"response": "你终于来"}),
+    ('{"response": "好", "choices": ["A", "B', {"response": "好", "choices": ["A", "B"]}),
+    # 截断在逗号、冒号之后
+    ('{"response": "好", "choices": ["A",', {"response": "好", "choices": ["A"]}),
+    ('{"response": "好", "choices":', {"response": "好", "choices": None}),
+    # 截断在转义序列中间
+    ('{"response": "她说\\', {"response": "她说"}),
+])
+def test_truncated_objects_repaired(text, expected, backend):
+    assert parse_llm_output(text) == expected
+
+
+def test_truncated_key_falls_back_to_last_complete_member(backend):
+    # 补全后 {"response": "好", "cho"} 不是合法JSON，退回到最后一个逗号之前
+    assert parse_llm_output('{"response": "好", "cho') == {"response": "好"}
+
+
+def test_scan_object_returns_alternative_only_when_truncated():
+    text = '{"a": 1, "b": [2, 3,]}'
+    repaired, alternative = _scan_object(text, 0)
+    assert json.loads(repaired) == {"a": 1, "b": [2, 3]}
+    assert alternative is None
+
+    repaired, alternative = _scan_object('{"a": 1, "b": "x', 0)
+    assert json.loads(repaired) == {"a": 1, "b": "x"}
+    assert json.loads(alternative) == {"a": 1}
+
+
+def test_scan_object_ignores_structure_inside_strings():
+    repaired, _ = _scan_object('{"a": "{[,]}", "b": 1}', 0)
+    assert json.loads(repaired) == {"a": "{[,]}", "b": 1}
+
+
+def test_extract_choices():
+    choices, remainder = extract_choices("她看着你。\nA. 打招呼\n选项B：离开\nC) 沉默\nA. 重复的A\n")
+    assert choices == ["打招呼", "离开", "沉默", ""]
+    assert remainder.strip() == "她看着你。"
+
+
+def test_plain_text_becomes_field():
+    result = parse_llm_output("她只是笑了笑。", "dialogue")
+    assert result == {"dialogue": "她只是笑了笑。", "choices": ["", "", "", ""]}
+
+
+def test_non_object_json_is_not_returned(backend):
+    result = parse_llm_output('["a", "b"]')
+    assert result["choices"] == ["", "", "", ""]
+    assert result["response"] == '["a", "b"]'
@@ -0,0 +1,255 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from gal_sim.services import llm_router
+from gal_sim.services.llm_router import LLMEndpoint, LLMRouter, is_retryable
+from gal_sim.utils.config import LLM_ENDPOINT_FAILURE_THRESHOLD
+
+PARAMS = {"messages": [{"role": "user", "content": "你好"}]}
+
+
+def _status_error(status: int, headers=None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "http://upstream/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    return openai.APIStatusError("upstream error", response=response, body=None)
+
+
+class _Stream:
+    """模拟SDK的流式响应：逐个产出分片，error不为空时在产出完分片后抛出"""
+    def __init__(self, deltas, error=None):
+        self.deltas = deltas
+        self.error = error
+        self.closed = False
+
+    async def __aiter__(self):
+        for delta in self.deltas:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+        if self.error is not None:
+            raise self.error
+
+    async def close(self):
+        self.closed = True
+
+
+class _Upstream:
+    """按base_url模拟各endpoint：behaviours中的每一项依次作为一次请求的结果（异常、延迟或返回值）"""
+    def __init__(self, behaviours):
+        self.behaviours = behaviours
+        self.calls = 0
+        self.streams = []
+
+    async def create(self, stream=False, **params):
+        behaviour = self.behaviours[min(self.calls, len(self.behaviours) - 1)]
+        self.calls += 1
+        if isinstance(behaviour, BaseException):
+            raise behaviour
+        if isinstance(behaviour, _Stream):
+            self.streams.append(behaviour)
+            return behaviour
+        delay, result = behaviour
+        await asyncio.sleep(delay)
+        return result
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    upstreams = {}
+
+    async def noop():
+        pass
+
+    monkeypatch.setattr(llm_router, "preload_llm_sdk", noop)
+    monkeypatch.setattr(
+        llm_router, "get_llm_client",
+        lambda base_url, api_key: SimpleNamespace(chat=SimpleNamespace(completions=upstreams[base_url]))
+    )
+    return upstreams
+
+
+def _endpoints(upstreams, **behaviours):
+    endpoints = []
+    for name, behaviour in behaviours.items():
+        upstreams[f"http://{name}/v1"] = _Upstream(behaviour)
+        endpoints.append(LLMEndpoint(f"http://{name}/v1", "key", "model", name=name))
+    return endpoints
+
+
+def test_retryable_errors():
+    assert is_retryable(asyncio.TimeoutError())
+    assert is_retryable(openai.APIConnectionError(request=httpx.Request("POST", "http://upstream")))
+    for status in (408, 409, 429, 500, 503):
+        assert is_retryable(_status_error(status))
+    for status in (400, 401, 404, 422):
+        assert not is_retryable(_status_error(status))
+    assert not is_retryable(ValueError())
+
+
+def test_retry_moves_to_another_endpoint(upstreams):
+    a, b = _endpoints(upstreams, a=[_status_error(503)], b=[(0, "ok")])
+    router = LLMRouter([a, b], max_retries=2, backoff=0, hedge=False)
+    assert asyncio.run(router.complete(PARAMS)) == "ok"
+    assert upstreams["http://a/v1"].calls == 1 and upstreams["http://b/v1"].calls == 1
+    assert router.retries == 1
+    assert a.failures == 1 and a.consecutive_failures == 1
+    assert b.consecutive_failures == 0 and b.latency is not None
+
+
+def test_non_retryable_error_is_not_retried(upstreams):
+    a, b = _endpoints(upstreams, a=[_status_error(400)], b=[(0, "ok")])
+    router = LLMRouter([a, b], max_retries=2, backoff=0, hedge=False)
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(router.complete(PARAMS))
+    assert upstreams["http://b/v1"].calls == 0
+    assert router.retries == 0
+    assert a.failures == 0  # 参数错误不算endpoint不健康
+
+
+def test_gives_up_after_max_retries(upstreams):
+    a, b = _endpoints(upstreams, a=[asyncio.TimeoutError()], b=[asyncio.TimeoutError()])
+    router = LLMRouter([a, b], max_retries=2, backoff=0, hedge=False)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(router.complete(PARAMS))
+    assert upstreams["http://a/v1"].calls + upstreams["http://b/v1"].calls == 3
+    assert router.retries == 2
+
+
+def test_backoff_respects_retry_after(monkeypatch):
+    router = LLMRouter([LLMEndpoint("http://a/v1", "key", "model")], backoff=0.5)
+    monkeypatch.setattr(llm_router.random, "uniform", lambda low, high: high)
+    assert router._backoff_delay(0, asyncio.TimeoutError()) == 0.5
+    assert router._backoff_delay(2, asyncio.TimeoutError()) == 2.0
+    assert router._backoff_delay(0, _status_error(429, {"retry-after": "3"})) == 3.0
+    assert router._backoff_delay(0, _status_error(429, {"retry-after": "3600"})) == llm_router._MAX_BACKOFF
+
+
+def test_select_prefers_fast_and_heavy_endpoints():
+    now = time.monotonic()
+    slow = LLMEndpoint("http://slow/v1", "key", "model")
+    fast = LLMEndpoint("http://fast/v1", "key", "model")
+    for endpoint, latency in ((slow, 2.0), (fast, 0.5)):
+        endpoint.latency = latency
+        endpoint.last_used = now
+    router = LLMRouter([slow, fast])
+    assert router.select() is fast
+    assert router.select(exclude=[fast]) is slow
+    # 进行中的请求数和权重参与折算
+    fast.in_flight = 4
+    assert router.select() is slow
+    fast.weight = 10
+    assert router.select() is fast
+    # 没有样本的endpoint优先探测
+    fresh = LLMEndpoint("http://fresh/v1", "key", "model")
+    assert LLMRouter([slow, fast, fresh]).select() is fresh
+
+
+def test_failing_endpoint_cools_down():
+    a = LLMEndpoint("http://a/v1", "key", "model")
+    b = LLMEndpoint("http://b/v1", "key", "model")
+    router = LLMRouter([a, b])
+    for _ in range(LLM_ENDPOINT_FAILURE_THRESHOLD - 1):
+        a.record_failure()
+    assert a.available(time.monotonic())
+    a.record_failure()
+    assert not a.available(time.monotonic())
+    assert router.select() is b
+    # 全部暂停时退回到最早恢复的那个
+    b.record_success(0.1)
+    for _ in range(LLM_ENDPOINT_FAILURE_THRESHOLD):
+        b.record_failure()
+    assert router.select() is a
+    # 成功一次后连续失败计数清零
+    a.record_success(0.1)
+    assert a.consecutive_failures == 0
+
+
+def test_hedge_fires_after_p95_and_backup_wins(upstreams):
+    primary, backup = _endpoints(upstreams, primary=[(1.0, "primary")], backup=[(0, "backup")])
+    for _ in range(llm_router._MIN_HEDGE_SAMPLES):
+        primary.record_success(0.01, sample=True)
+    primary.last_used = backup.last_used = time.monotonic()
+    backup.latency = 1.0  # 让primary先被选中
+    router = LLMRouter([primary, backup], max_retries=0, hedge=True, hedge_min_delay=0.02)
+
+    async def run():
+        started = time.monotonic()
+        assert await router.complete(PARAMS) == "backup"
+        assert time.monotonic() - started < 0.5  # 没有等待慢的primary
+        await asyncio.sleep(0)
+        assert primary.in_flight == 0  # primary已被取消
+
+    asyncio.run(run())
+    assert router.hedged == 1 and router.hedge_wins == 1
+
+
+def test_no_hedge_without_enough_samples_or_when_fast(upstreams):
+    primary, backup = _endpoints(upstreams, primary=[(0.05, "primary")], backup=[(0, "backup")])
+    backup.latency = 1.0
+    backup.last_used = time.monotonic()
+    router = LLMRouter([primary, backup], max_retries=0, hedge=True, hedge_min_delay=0.01)
+    assert asyncio.run(router.complete(PARAMS)) == "primary"  # 样本不足，不对冲
+
+    upstreams["http://primary/v1"].behaviours = [(0, "primary")]
+    for _ in range(llm_router._MIN_HEDGE_SAMPLES):
+        primary.record_success(0.01, sample=True)
+    router.hedge_min_delay = 0.5
+    assert asyncio.run(router.complete(PARAMS)) == "primary"
+    assert router.hedged == 0
+    assert upstreams["http://backup/v1"].calls == 0
+
+
+def test_stream_retries_before_first_chunk(upstreams):
+    failed = _Stream([], _status_error(502))
+    a, b = _endpoints(upstreams, a=[failed], b=[_Stream(["你", "好"])])
+    router = LLMRouter([a, b], max_retries=1, backoff=0)
+
+    async def run():
+        return [delta async for delta in router.stream(PARAMS)]
+
+    assert asyncio.run(run()) == ["你", "好"]
+    assert router.retries == 1
+    assert failed.closed and upstreams["http://b/v1"].streams[0].closed
+
+
+def test_stream_does_not_retry_after_first_chunk(upstreams):
+    a, b = _endpoints(upstreams, a=[_Stream(["你"], _status_error(502))], b=[_Stream(["好"])])
+    router = LLMRouter([a, b], max_retries=1, backoff=0)
+    received = []
+
+    async def run():
+        async for delta in router.stream(PARAMS):
+            received.append(delta)
+
+    with pytest.raises(openai.APIStatusError):
+        asyncio.run(run())
+    assert received == ["你"]
+    assert router.retries == 0
+    assert upstreams["http://b/v1"].calls == 0
+
+
+def test_stream_closed_when_consumer_stops(upstreams):
+    (a,) = _endpoints(upstreams, a=[_Stream(["一", "二", "三"])])
+    router = LLMRouter([a], max_retries=0, backoff=0)
+
+    async def run():
+        stream = router.stream(PARAMS)
+        assert await stream.__anext__() == "一"
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert upstreams["http://a/v1"].streams[0].closed
+    assert a.in_flight == 0
+
+
+def test_request_params_falls_back_to_json_object():
+    schema = {"type": "json_schema", "json_schema": {"name": "turn", "schema": {}}}
+    params = {"model": "default", "response_format": schema}
+    structured = LLMEndpoint("http://a/v1", "key", "model-a", structured_output=True)
+    plain = LLMEndpoint("http://b/v1", "key", "model-b", structured_output=False)
+    assert structured.request_params(params) == {"model": "model-a", "response_format": schema}
+    assert plain.request_params(params, "override") == {"model": "override", "response_format": {"type": "json_object"}}
+    assert params["response_format"] is schema  # 不修改调用方的参数
@@ -0,0 +1,103 @@
+"""内存预算和会话数上限下的LRU淘汰，以及被淘汰会话的410响应"""
+import asyncio
+
+import httpx
+
+from gal_sim.main import app
+from gal_sim.services.metrics import SESSIONS_EVICTED
+from gal_sim.services.session_manager import SessionManager, session_manager
+
+
+def _evicted_total() -> float:
+    return SESSIONS_EVICTED.values[()]
+
+
+def test_max_sessions_evicts_least_recently_used():
+    async def run():
+        manager = SessionManager(memory_budget=0, max_sessions=2)
+        removed = []
+        manager.on_remove.append(removed.append)
+        before = _evicted_total()
+        await manager.create_session("a", "主题")
+        await manager.create_session("b", "主题")
+        await manager.get_session("a")  # a变为最近使用
+        await manager.create_session("c", "主题")
+        assert list(manager.sessions) == ["a", "c"]
+        assert removed == ["b"]
+        assert manager.was_evicted("b") and not manager.was_evicted("a")
+        assert await manager.get_session("b") is None
+        assert manager.evicted == 1
+        assert _evicted_total() == before + 1
+
+    asyncio.run(run())
+
+
+def test_memory_budget_evicts_until_within_budget():
+    async def run():
+        manager = SessionManager(memory_budget=0, max_sessions=0)
+        for index in range(5):
+            session_data = await manager.create_session(f"s{index}", "主题")
+            session_data.add_message("assistant", "台词" * 200)
+        manager.memory_budget = manager.resident_bytes // 2
+        # 增长中的会话不会淘汰自己
+        manager.sessions["s0"].add_message("user", "回应" * 200)
+        assert manager.resident_bytes <= manager.memory_budget
+        assert "s0" in manager.sessions
+        assert all(manager.was_evicted(session_id) for session_id in ("s1", "s2", "s3"))
+        assert manager.resident_bytes == sum(s.size for s in manager.sessions.values())
+
+    asyncio.run(run())
+
+
+def test_locked_sessions_are_not_evicted():
+    async def run():
+        manager = SessionManager(memory_budget=0, max_sessions=1)
+        first = await manager.create_session("a", "主题")
+        async with first.lock:
+            await manager.create_session("b", "主题")
+            assert "a" in manager.sessions  # 正在进行对话，跳过
+            assert manager.evicted == 0
+        await manager.create_session("c", "主题")
+        assert list(manager.sessions) == ["c"]
+        assert manager.was_evicted("a") and manager.was_evicted("b")
+
+    asyncio.run(run())
+
+
+def test_delete_clears_tombstone():
+    async def run():
+        manager = SessionManager(memory_budget=0, max_sessions=1)
+        await manager.create_session("a", "主题")
+        await manager.create_session("b", "主题")
+        assert manager.was_evicted("a")
+        await manager.delete_session("a")
+        assert not manager.was_evicted("a")
+
+    asyncio.run(run())
+
+
+def test_evicted_session_returns_410(monkeypatch):
+    async def run():
+        monkeypatch.setattr(session_manager, "max_sessions", 1)
+        monkeypatch.setattr(session_manager, "memory_budget", 0)
+        await session_manager.create_session("evicted-a", "主题")
+        await session_manager.create_session("evicted-b", "主题")
+        assert session_manager.was_evicted("evicted-a")
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                body = {"session_id": "evicted-a", "choice_index": 0}
+                for response in (
+                    await client.post("/api/v1/dialogue", json=body),
+                    await client.post("/api/v1/dialogue/stream", json=body),
+                    await client.get("/api/v1/session/evicted-a"),
+                ):
+                    assert response.status_code == 410
+                    assert response.headers.get("X-Session-Evicted") == "1"
+                missing = await client.get("/api/v1/session/never-existed")
+                assert missing.status_code == 404
+        finally:
+            await session_manager.delete_session("evicted-a")
+            await session_manager.delete_session("evicted-b")
+
+    asyncio.run(run())
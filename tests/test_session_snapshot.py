@@ -0,0 +1,138 @@
+import struct
+import time
+import zlib
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from gal_sim.main import app
+from gal_sim.models.history import Message
+from gal_sim.services import session_snapshot as snapshot
+from gal_sim.services.session_manager import SessionData
+
+CODECS = [snapshot.CODEC_NONE, snapshot.CODEC_ZLIB] + ([snapshot.CODEC_ZSTD] if snapshot.zstd_available() else [])
+
+
+def _session() -> SessionData:
+    session_data = SessionData("s-1", "魔法学院的邂逅", affection=63, summary="两人在图书馆相遇")
+    now = time.time()
+    session_data.history.append(Message("character", "“你也在找这本书吗？”", now))
+    session_data.history.append(Message("user", "是的，好巧", now + 1))
+    session_data.history.append(Message("character", "“那我们一起看吧。”", now + 2))
+    session_data.offered_choices = [("好啊", 3), ("不用了", -1)]
+    session_data.story_node = 4
+    session_data.summarized_until = 1
+    return session_data
+
+
+def _fields(record):
+    return {key: value for key, value in record.items() if key != "history"}
+
+
+def test_encode_decode_round_trip():
+    session_data = _session()
+    record = snapshot.decode_session(snapshot.encode_session(session_data))
+    assert record["session_id"] == "s-1"
+    assert record["theme"] == session_data.theme
+    assert record["affection"] == 63
+    assert record["summary"] == session_data.summary
+    assert record["summarized_until"] == 1
+    assert record["offered_choices"] == [("好啊", 3), ("不用了", -1)]
+    assert record["story_node"] == 4
+    assert record["created_at"] == datetime.fromtimestamp(session_data.created_at.timestamp())
+    assert [(m.role, m.content, m.timestamp) for m in record["history"]] == [
+        (m.role, m.content, m.timestamp) for m in session_data.history
+    ]
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_save_round_trip(codec):
+    session_data = _session()
+    metadata, record = snapshot.load_save(snapshot.dump_save(session_data, codec))
+    assert metadata["theme"] == session_data.theme
+    assert metadata["turns"] == 1
+    assert _fields(record) == _fields(snapshot.decode_session(snapshot.encode_session(session_data)))
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_snapshot_round_trip(tmp_path, codec):
+    path = str(tmp_path / "sessions.snap")
+    sessions = [_session() for _ in range(3)]
+    for i, session_data in enumerate(sessions):
+        session_data.session_id = f"s-{i}"
+    writer = snapshot.SnapshotWriter(path, codec)
+    writer.write(snapshot.encode_session(session_data) for session_data in sessions[:2])
+    writer.write([snapshot.encode_session(sessions[2])])
+    writer.close()
+    ids = [snapshot.decode_session(data)["session_id"] for data in snapshot.iter_snapshot(path)]
+    assert ids == ["s-0", "s-1", "s-2"]
+
+
+def test_truncated_snapshot_raises(tmp_path):
+    path = tmp_path / "sessions.snap"
+    writer = snapshot.SnapshotWriter(str(path), snapshot.CODEC_NONE)
+    writer.write([snapshot.encode_session(_session())])
+    writer.close()
+    path.write_bytes(path.read_bytes()[:-3])
+    with pytest.raises(ValueError):
+        list(snapshot.iter_snapshot(str(path)))
+
+
+def test_truncated_record_raises():
+    data = snapshot.encode_session(_session())
+    for cut in (0, 10, snapshot._HEAD.size, len(data) // 2, len(data) - 1):
+        with pytest.raises(ValueError):
+            snapshot.decode_session(data[:cut])
+    with pytest.raises(ValueError):
+        snapshot.decode_session(data + b"\0")
+
+
+@pytest.mark.parametrize("timestamp", [1e300, -1e20, float("nan"), float("inf")])
+def test_out_of_range_timestamp_raises_value_error(timestamp):
+    data = bytearray(snapshot.encode_session(_session()))
+    # 头部：好感度(i32)之后是创建时间(f64)
+    struct.pack_into("<d", data, 4, timestamp)
+    with pytest.raises(ValueError):
+        snapshot.decode_session(bytes(data))
+
+
+def test_unknown_role_raises():
+    session_data = _session()
+    data = bytearray(snapshot.encode_session(session_data))
+    # 第一条消息的角色字节紧跟在字符串和选项之后
+    offset = snapshot._HEAD.size
+    for text in (session_data.session_id, session_data.theme, session_data.summary):
+        offset += 4 + len(text.encode("utf-8"))
+    for text, _ in session_data.offered_choices:
+        offset += 4 + len(text.encode("utf-8")) + 4
+    data[offset] = 7
+    with pytest.raises(ValueError):
+        snapshot.decode_session(bytes(data))
+
+
+def test_bad_save_header_raises():
+    content = snapshot.dump_save(_session(), snapshot.CODEC_ZLIB)
+    with pytest.raises(ValueError):
+        snapshot.load_save(b"NOTSAV" + content[6:])
+    with pytest.raises(ValueError):
+        snapshot.load_save(content[:4])
+    with pytest.raises(ValueError):
+        snapshot.load_save(content[:-5])
+
+
+def test_decompression_bomb_rejected():
+    header = snapshot._FILE_HEADER.pack(snapshot.SAVE_MAGIC, snapshot.FORMAT_VERSION, snapshot.CODEC_ZLIB)
+    bomb = header + snapshot._LENGTH.pack(2) + b"{}" + zlib.compress(b"\0" * (snapshot.MAX_SESSION_BYTES + 1))
+    with pytest.raises(ValueError):
+        snapshot.load_save(bomb)
+
+
+def test_import_with_corrupted_timestamp_returns_400():
+    session_data = _session()
+    session_data.created_at = datetime.now()
+    content = bytearray(snapshot.dump_save(session_data, snapshot.CODEC_NONE))
+    _, body_offset = snapshot.read_save_metadata(bytes(content))
+    struct.pack_into("<d", content, body_offset + 4, 1e300)
+    response = TestClient(app).post("/api/v1/session/import", content=bytes(content))
+    assert response.status_code == 400
@@ -0,0 +1,273 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from gal_sim.services.session_manager import SessionData, SessionManager
+from gal_sim.services.session_store import MemorySessionStore, SQLiteSessionStore, create_session_store
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def _session(store, session_id: str = "s", max_history_length: int = 50) -> SessionData:
+    session_data = SessionData(session_id, "海边小镇", max_history_length=max_history_length)
+    session_data.store = store
+    store.save_session(session_data)
+    return session_data
+
+
+def test_write_behind_round_trip(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        session_data = _session(store)
+        session_data.add_message("character", "“你来了。”")
+        session_data.add_message("user", "嗯")
+        session_data.update_affection(5)
+        session_data.offer_choices(["A", "B", "C", "D"])
+        session_data.story_node = 3
+        store.save_session(session_data)
+        # 写入先进入缓冲
+        assert store.load_session("s") is None
+        await store.flush()
+        record = store.load_session("s")
+        assert record["theme"] == "海边小镇"
+        assert record["affection"] == 55
+        assert record["story_node"] == 3
+        assert record["offered_choices"] == [("A", 3), ("B", 1), ("C", -1), ("D", -3)]
+        assert [(m.role, m.content) for m in record["history"]] == [("character", "“你来了。”"), ("user", "嗯")]
+        assert store.last_accessed("s") == pytest.approx(session_data.last_accessed.timestamp())
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_load_returns_latest_messages_up_to_history_length(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        session_data = _session(store, max_history_length=3)
+        for i in range(6):
+            session_data.add_message("user", f"第{i}句")
+        await store.flush()
+        record = store.load_session("s")
+        assert [m.content for m in record["history"]] == ["第3句", "第4句", "第5句"]
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_close_flushes_and_data_survives_reopen(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        _session(store).add_message("user", "你好")
+        await store.close()
+        reopened = SQLiteSessionStore(db_path)
+        assert [m.content for m in reopened.load_session("s")["history"]] == ["你好"]
+        await reopened.close()
+
+    asyncio.run(run())
+
+
+def test_delete_and_conditional_expiry(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        old = _session(store, "old")
+        old.last_accessed = datetime.now() - timedelta(hours=2)
+        store.save_session(old)
+        _session(store, "fresh")
+        gone = _session(store, "gone")
+        gone.add_message("user", "再见")
+        await store.flush()
+        cutoff = time.time() - 3600
+        # 过期条件按存储中的最后访问时间判断，刚访问过的会话不会被删除
+        store.delete_session("fresh", expired_before=cutoff)
+        store.delete_session("gone")
+        await store.flush()
+        assert store.load_session("fresh") is not None
+        assert store.load_session("gone") is None
+        assert store.load_session("old") is not None
+        store.delete_expired(cutoff)
+        await store.flush()
+        assert store.load_session("old") is None
+        assert store.load_session("fresh") is not None
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_failed_flush_is_retried(db_path, monkeypatch):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        _session(store).add_message("user", "你好")
+        original = store._write_batch
+        calls = []
+
+        def flaky(*args):
+            calls.append(1)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return original(*args)
+
+        monkeypatch.setattr(store, "_write_batch", flaky)
+        with pytest.raises(sqlite3.OperationalError):
+            await store.flush()
+        await store.flush()
+        assert [m.content for m in store.load_session("s")["history"]] == ["你好"]
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_old_schema_is_migrated(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE sessions (session_id TEXT PRIMARY KEY, theme TEXT NOT NULL, affection INTEGER NOT NULL, "
+        "created_at REAL NOT NULL, last_accessed REAL NOT NULL, max_history_length INTEGER NOT NULL, "
+        "summary TEXT NOT NULL DEFAULT '', summarized_until REAL NOT NULL DEFAULT 0)"
+    )
+    now = time.time()
+    conn.execute("INSERT INTO sessions VALUES ('s', '旧主题', 60, ?, ?, 50, '', 0)", (now, now))
+    conn.commit()
+    conn.close()
+
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        record = store.load_session("s")
+        assert record["theme"] == "旧主题"
+        assert record["offered_choices"] == []
+        assert record["story_node"] == -1
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_manager_reloads_sessions_from_store(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        manager = SessionManager(store=store, max_sessions=1)
+        first = await manager.create_session("a", "主题A")
+        first.add_message("user", "你好")
+        await manager.create_session("b", "主题B")
+        # 超出会话数上限后a从内存中移出，但持久化存储中仍在
+        assert "a" not in manager.sessions
+        assert not manager.was_evicted("a")
+        await store.flush()
+        reloaded = await manager.get_session("a")
+        assert reloaded is not None and reloaded is not first
+        assert [m.content for m in reloaded.history] == ["你好"]
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_manager_reloads_when_another_process_updated(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        manager = SessionManager(store=store)
+        session_data = await manager.create_session("s", "主题")
+        await store.flush()
+        other = SQLiteSessionStore(db_path)
+        record = other.load_session("s")
+        record["affection"] = 80
+        record["last_accessed"] = datetime.now() + timedelta(seconds=5)
+        other.save_session(SessionData(**record))
+        await other.close()
+        reloaded = await manager.get_session("s")
+        assert reloaded is not session_data
+        assert reloaded.affection == 80
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_create_session_store():
+    assert isinstance(create_session_store("memory", "", 0.05), MemorySessionStore)
+    assert isinstance(create_session_store("unknown", "", 0.05), MemorySessionStore)
+
+
+def _message_rows(db_path, session_id: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_flush_trims_messages_beyond_history_length(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        session_data = _session(store, max_history_length=3)
+        other = _session(store, "other", max_history_length=3)
+        other.add_message("user", "别删我")
+        await store.flush()
+        for i in range(5):
+            session_data.add_message("user", f"第{i}句")
+        await store.flush()
+        assert _message_rows(db_path, "s") == 3
+        for i in range(5, 7):
+            session_data.add_message("user", f"第{i}句")
+            await store.flush()
+        assert _message_rows(db_path, "s") == 3
+        assert [m.content for m in store.load_session("s")["history"]] == ["第4句", "第5句", "第6句"]
+        assert _message_rows(db_path, "other") == 1
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_expired_sessions_release_message_rows(db_path):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        manager = SessionManager(session_timeout=3600, store=store, max_sessions=1)
+        evicted = await manager.create_session("evicted", "主题")
+        evicted.add_message("user", "你好")
+        cached = await manager.create_session("cached", "主题")
+        cached.add_message("user", "你好")
+        await store.flush()
+        # 被移出内存的会话仍可重新读取，行在过期时由清理任务删除
+        assert "evicted" not in manager.sessions
+        assert _message_rows(db_path, "evicted") == 1
+        for session_data in (evicted, cached):
+            session_data.last_accessed = datetime.now() - timedelta(hours=2)
+            store.save_session(session_data)
+        await store.flush()
+        await manager.cleanup_expired_sessions()
+        await store.flush()
+        assert _message_rows(db_path, "evicted") == 0
+        assert _message_rows(db_path, "cached") == 0
+        assert store.load_session("evicted") is None and store.load_session("cached") is None
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_manager_reads_store_off_the_event_loop(db_path, monkeypatch):
+    async def run():
+        store = SQLiteSessionStore(db_path)
+        manager = SessionManager(store=store, max_sessions=1)
+        await manager.create_session("a", "主题")
+        await manager.create_session("b", "主题")
+        await store.flush()
+        loop_thread = threading.get_ident()
+        reader_threads = []
+        for name in ("load_session", "last_accessed"):
+            original = getattr(store, name)
+
+            def traced(session_id, original=original):
+                reader_threads.append(threading.get_ident())
+                return original(session_id)
+
+            monkeypatch.setattr(store, name, traced)
+        # 并发读取同一个会话只得到一个缓存对象
+        first, second = await asyncio.gather(manager.get_session("a"), manager.get_session("a"))
+        assert first is second is manager.sessions["a"]
+        await manager.get_session("a")
+        assert reader_threads and loop_thread not in reader_threads
+        await store.close()
+
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from gal_sim.services import dialogue_service as dialogue_module
+from gal_sim.services.dialogue_service import DialogueService
+from gal_sim.services.story_tree import NO_CHILD, StoryTree, write_story_tree
+
+NODES = [
+    ("你终于来了！", ["A", "B", "C", "D"], [1, NO_CHILD, NO_CHILD, NO_CHILD]),
+    ("嗯，我等你很久了。", ["a", "b", "c", "d"], []),
+]
+
+
+def _write_tree(tmp_path):
+    path = tmp_path / "tree.bin"
+    write_story_tree(str(path), "海边小镇", NODES)
+    return path
+
+
+def test_round_trip(tmp_path):
+    tree = StoryTree(str(_write_tree(tmp_path)))
+    try:
+        assert tree.theme == "海边小镇"
+        assert tree.node_count == 2
+        assert tree.node(1) == {"text": "嗯，我等你很久了。", "choices": ["a", "b", "c", "d"]}
+        assert tree.child(0, 0) == 1
+        assert tree.child(0, 1) == NO_CHILD
+        assert tree.children(1) == (NO_CHILD,) * 4
+    finally:
+        tree.close()
+
+
+@pytest.mark.parametrize("keep", [0, 3, 16, 30, -1])
+def test_truncated_tree_raises_value_error(tmp_path, keep):
+    path = _write_tree(tmp_path)
+    data = path.read_bytes()
+    # 0字节（空文件）、不足头部、只有头部、截断在索引中间、只缺最后一个字节
+    path.write_bytes(data[:keep] if keep >= 0 else data[:_index_end(data) - 1])
+    with pytest.raises(ValueError):
+        StoryTree(str(path))
+
+
+def _index_end(data: bytes) -> int:
+    from gal_sim.services.story_tree import _HEADER, _NODE
+    _, node_count, theme_length = _HEADER.unpack_from(data, 0)
+    return _HEADER.size + theme_length + node_count * _NODE.size
+
+
+def test_startup_falls_back_when_tree_is_truncated(tmp_path, monkeypatch):
+    path = tmp_path / "tree.bin"
+    path.write_bytes(b"GST")
+    monkeypatch.setattr(dialogue_module, "STORY_TREE_PATH", str(path))
+    service = DialogueService()
+
+    async def run():
+        await service.startup()
+        try:
+            assert service.story_tree is None
+        finally:
+            await service.shutdown()
+
+    asyncio.run(run())
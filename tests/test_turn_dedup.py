@@ -0,0 +1,232 @@
+"""重复提交的对话轮次共用一次执行；幂等键缓存"""
+import asyncio
+
+import pytest
+
+from gal_sim.services.admission import IdempotencyCache
+from gal_sim.services.dialogue_service import DialogueService
+
+
+class _Turns:
+    """替换DialogueService中实际执行轮次的方法，由release事件控制何时完成"""
+    def __init__(self, service: DialogueService):
+        self.calls = 0
+        self.release = asyncio.Event()
+        service._continue_dialogue = self.run
+        service._stream_dialogue = self.stream
+
+    def _result(self, session_id: str) -> dict:
+        return {"session_id": session_id, "character_response": f"回应{self.calls}", "choices": [], "affection": 50}
+
+    async def run(self, session_id, user_input, theme=None, choice_index=None):
+        self.calls += 1
+        await self.release.wait()
+        return self._result(session_id)
+
+    async def stream(self, session_id, user_input, theme=None, choice_index=None):
+        self.calls += 1
+        yield "delta", {"text": "回"}
+        await self.release.wait()
+        yield "done", self._result(session_id)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def _consume(events) -> list:
+    return [item async for item in events]
+
+
+def test_duplicate_turns_share_one_execution():
+    async def run():
+        service = DialogueService()
+        turns = _Turns(service)
+        first = asyncio.create_task(service.continue_dialogue("s", None, choice_index=1))
+        await _settle()
+        second = asyncio.create_task(service.continue_dialogue("s", None, choice_index=1))
+        other = asyncio.create_task(service.continue_dialogue("s", "别的话"))
+        await _settle()
+        turns.release.set()
+        results = await asyncio.gather(first, second, other)
+        assert turns.calls == 2
+        assert results[0] == results[1]
+        assert service.deduplicated_turns == 1
+        assert not service._inflight_turns
+
+    asyncio.run(run())
+
+
+def test_cancelled_leader_does_not_fail_duplicates():
+    async def run():
+        service = DialogueService()
+        turns = _Turns(service)
+        leader = asyncio.create_task(service.continue_dialogue("s", None, choice_index=0))
+        await _settle()
+        retry = asyncio.create_task(service.continue_dialogue("s", None, choice_index=0))
+        await _settle()
+        leader.cancel()
+        await _settle()
+        turns.release.set()
+        result = await retry
+        assert result["character_response"] == "回应1"
+        assert turns.calls == 1
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(run())
+
+
+def test_retry_after_leader_cancelled_joins_running_turn():
+    async def run():
+        service = DialogueService()
+        turns = _Turns(service)
+        leader = asyncio.create_task(service.continue_dialogue("s", None, choice_index=0))
+        await _settle()
+        leader.cancel()
+        await _settle()
+        retry = asyncio.create_task(service.continue_dialogue("s", None, choice_index=0))
+        await _settle()
+        turns.release.set()
+        assert (await retry)["character_response"] == "回应1"
+        assert turns.calls == 1
+
+    asyncio.run(run())
+
+
+def test_failed_turn_is_not_shared_with_later_submissions():
+    async def run():
+        service = DialogueService()
+        calls = []
+
+        async def failing(session_id, user_input, theme=None, choice_index=None):
+            calls.append(1)
+            raise ValueError("会话不存在")
+
+        service._continue_dialogue = failing
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await service.continue_dialogue("s", "你好")
+        assert len(calls) == 2
+        assert not service._inflight_turns
+
+    asyncio.run(run())
+
+
+def test_duplicate_stream_receives_leader_result():
+    async def run():
+        service = DialogueService()
+        turns = _Turns(service)
+        leader = asyncio.create_task(_consume(service.stream_dialogue("s", None, choice_index=2)))
+        await _settle()
+        duplicate = asyncio.create_task(_consume(service.stream_dialogue("s", None, choice_index=2)))
+        await _settle()
+        turns.release.set()
+        leader_events, duplicate_events = await asyncio.gather(leader, duplicate)
+        assert turns.calls == 1
+        assert duplicate_events[-1] == leader_events[-1]
+        assert [event for event, _ in duplicate_events] == ["delta", "done"]
+
+    asyncio.run(run())
+
+
+def test_interrupted_stream_leader_makes_duplicate_rerun():
+    async def run():
+        service = DialogueService()
+        turns = _Turns(service)
+        stream = service.stream_dialogue("s", None, choice_index=2)
+        assert (await stream.__anext__())[0] == "delta"
+        duplicate = asyncio.create_task(service.continue_dialogue("s", None, choice_index=2))
+        await _settle()
+        # 客户端断开，流式轮次被关闭
+        await stream.aclose()
+        await _settle()
+        turns.release.set()
+        result = await duplicate
+        assert turns.calls == 2
+        assert result["character_response"] == "回应2"
+
+    asyncio.run(run())
+
+
+def test_idempotency_replays_result():
+    async def run():
+        cache = IdempotencyCache(ttl=60)
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            return {"n": len(calls)}
+
+        assert await cache.run("start", "k", factory) == {"n": 1}
+        assert await cache.run("start", "k", factory) == {"n": 1}
+        assert await cache.run("other", "k", factory) == {"n": 2}
+        assert await cache.run("start", None, factory) == {"n": 3}
+        assert cache.replayed == 1
+
+    asyncio.run(run())
+
+
+def test_idempotency_does_not_cache_failures():
+    async def run():
+        cache = IdempotencyCache(ttl=60)
+        outcomes = [ValueError("失败"), "成功"]
+
+        async def factory():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with pytest.raises(ValueError):
+            await cache.run("start", "k", factory)
+        assert await cache.run("start", "k", factory) == "成功"
+
+    asyncio.run(run())
+
+
+def test_idempotency_survives_cancelled_first_request():
+    async def run():
+        cache = IdempotencyCache(ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            await release.wait()
+            return "结果"
+
+        first = asyncio.create_task(cache.run("start", "k", factory))
+        await _settle()
+        waiting = asyncio.create_task(cache.run("start", "k", factory))
+        await _settle()
+        first.cancel()
+        await _settle()
+        release.set()
+        assert await waiting == "结果"
+        assert await cache.run("start", "k", factory) == "结果"
+        assert len(calls) == 1
+
+    asyncio.run(run())
+
+
+def test_idempotency_expires_and_bounds_keys():
+    async def run():
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            return len(calls)
+
+        expired = IdempotencyCache(ttl=0)
+        await expired.run("start", "k", factory)
+        assert await expired.run("start", "k", factory) == 2
+
+        bounded = IdempotencyCache(ttl=60, max_keys=2)
+        for key in ("a", "b", "c"):
+            await bounded.run("start", key, factory)
+        assert len(bounded._entries) == 2
+        assert ("start", "a") not in bounded._entries
+
+    asyncio.run(run())